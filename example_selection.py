@@ -0,0 +1,237 @@
+"""
+Pick a small, stratified set of few shot examples for every prompt.
+
+Putting every row of the dataset into ``FewShotPromptTemplate(examples=...)``
+makes each prompt as long as the dataset, far beyond what llama3 reads. The
+rows are serialized once instead, grouped by their Sex, Age Range and Study
+Title, and every prompt gets a subset that fits a token budget: first a few
+examples covering every category of those columns, then examples drawn
+towards the requested category percentages.
+
+    from example_selection import ExampleIndex, StratifiedExampleSelector
+    index = ExampleIndex(data)
+    selector = StratifiedExampleSelector(index, targets={"Sex": {"Male": 50, "Female": 50}}, token_budget=2000)
+    prompt_template = FewShotPromptTemplate(example_selector=selector, ...)
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    from langchain_core.example_selectors import BaseExampleSelector
+except ImportError:
+    # Only FewShotPromptTemplate needs the LangChain base class
+    BaseExampleSelector = object
+
+STRATA_COLUMNS = ("Sex", "Age Range", "Study Title")
+# Tokens per character of the "column: value" examples, llama3's tokenizer gives about one token per 4 characters
+TOKENS_PER_CHARACTER = 0.25
+DEFAULT_TOKEN_BUDGET = 2000
+
+
+def serialize_examples(data):
+    """Every row of ``data`` as a "column: value, column: value" string, built column by column."""
+    text = None
+    for column in data.columns:
+        values = data[column]
+        part = (f"{column}: " + values.astype(str)).where(values.notna(), f"{column}: ")
+        text = part if text is None else text + ", " + part
+    return text
+
+
+def estimate_tokens(texts):
+    return np.ceil(texts.str.len().to_numpy() * TOKENS_PER_CHARACTER).astype("int32")
+
+
+def parse_example(text):
+    """Column -> value of a serialized example, the inverse of ``serialize_examples`` for values without ", x: "."""
+    row = {}
+    for part in re.split(r", (?=[^,:]+: )", text):
+        column, _, value = part.partition(": ")
+        row[column] = value or None
+    return row
+
+
+def _normalize_name(name):
+    return re.sub(r"[\s_]+", " ", str(name)).strip().lower()
+
+
+def find_column(columns, name):
+    """The one of ``columns`` called ``name``, ignoring case and spaces against underscores (Age_range)."""
+    columns = {_normalize_name(column): column for column in columns}
+    return columns.get(_normalize_name(name))
+
+
+class ExampleIndex:
+    """
+    Serialized examples grouped by the categories of the strata columns.
+
+    Parameters:
+    - data (pd.DataFrame): The real rows.
+    - strata (tuple): Columns to stratify on, those ``data`` does not have are skipped.
+    - texts (pd.Series or None): Already serialized rows, defaults to ``serialize_examples(data)``.
+    """
+
+    def __init__(self, data, strata=STRATA_COLUMNS, texts=None):
+        texts = serialize_examples(data) if texts is None else texts
+        self.texts = texts.to_numpy(dtype=object)
+        self.tokens = estimate_tokens(texts)
+        self.strata = [find_column(data.columns, column) for column in strata]
+        self.strata = [column for column in self.strata if column is not None]
+        # codes[:, j] is the category of every example in strata column j, -1 when missing
+        self.categories = {}
+        self.codes = np.empty((len(data), len(self.strata)), dtype="int16")
+        for position, column in enumerate(self.strata):
+            codes, categories = pd.factorize(data[column])
+            self.codes[:, position] = codes
+            self.categories[column] = pd.Index(categories)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, data, texts=None):
+        """
+        Append the rows of ``data``, categories the index has not seen yet get new codes.
+
+        Parameters:
+        - data (pd.DataFrame): The new rows, strata columns it does not have count as missing.
+        - texts (pd.Series or None): Already serialized rows, defaults to ``serialize_examples(data)``.
+        """
+        texts = serialize_examples(data) if texts is None else texts
+        codes = np.full((len(data), len(self.strata)), -1, dtype="int16")
+        for position, column in enumerate(self.strata):
+            source = find_column(data.columns, column)
+            if source is None:
+                continue
+            values = data[source]
+            new = pd.Index(values.dropna().unique()).difference(self.categories[column], sort=False)
+            self.categories[column] = self.categories[column].append(new)
+            codes[:, position] = self.categories[column].get_indexer(values)
+        self.texts = np.concatenate([self.texts, texts.to_numpy(dtype=object)])
+        self.tokens = np.concatenate([self.tokens, estimate_tokens(texts)])
+        self.codes = np.vstack([self.codes, codes])
+
+    def weights(self, targets):
+        """
+        Sampling weight of every example so that the drawn examples follow ``targets``.
+
+        Parameters:
+        - targets (dict): Column -> {category: percentage}, as the bias settings of the app.
+          An example of a category left out of a column's percentages is never drawn.
+        """
+        weights = np.ones(len(self))
+        for column, percentages in (targets or {}).items():
+            column = find_column(self.strata, column)
+            if column is None:
+                continue
+            position = self.strata.index(column)
+            codes = self.codes[:, position]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.categories[column]))
+            # Target share over real share, so a rare category is drawn as often as its target asks
+            per_category = np.zeros(len(self.categories[column]) + 1)
+            for category, percentage in percentages.items():
+                code = self.categories[column].get_indexer([category])[0]
+                if code >= 0 and counts[code]:
+                    per_category[code] = percentage / counts[code]
+            weights *= per_category[codes]
+        return weights
+
+    def select(self, targets=None, token_budget=DEFAULT_TOKEN_BUDGET, max_examples=None, seed=None):
+        """
+        Positions of the examples for one prompt.
+
+        Every category of every strata column (allowed by ``targets``) gets
+        an example first, taking the examples that cover the most categories.
+        The rest of the budget is drawn with ``weights(targets)``.
+
+        Returns:
+        - np.ndarray: Example positions, their tokens add up to at most ``token_budget``.
+        """
+        rng = np.random.default_rng(seed)
+        weights = self.weights(targets)
+        candidates = np.flatnonzero(weights > 0)
+        # Shuffle first so equally good examples differ from seed to seed
+        candidates = candidates[rng.permutation(len(candidates))]
+        max_examples = max_examples or len(self)
+
+        chosen = []
+        budget = token_budget
+        uncovered = [set(np.unique(self.codes[candidates, position])) - {-1} for position in range(len(self.strata))]
+        while any(uncovered) and len(chosen) < max_examples:
+            fits = candidates[self.tokens[candidates] <= budget]
+            if not len(fits):
+                break
+            covers = np.zeros(len(fits))
+            for position, missing in enumerate(uncovered):
+                covers += np.isin(self.codes[fits, position], list(missing))
+            if covers.max() == 0:
+                break
+            # Of the examples covering the most, the one most wanted by the targets per token
+            fits = fits[covers == covers.max()]
+            best = fits[np.argmax(weights[fits] / self.tokens[fits])]
+            chosen.append(best)
+            budget -= self.tokens[best]
+            for position, missing in enumerate(uncovered):
+                missing.discard(self.codes[best, position])
+
+        remaining = np.setdiff1d(candidates, chosen)
+        # Weighted draw without replacement: order by exponential race times
+        order = remaining[np.argsort(rng.exponential(size=len(remaining)) / weights[remaining])]
+        shortest = self.tokens[order].min() if len(order) else 0
+        for position in order:
+            if len(chosen) >= max_examples or budget < shortest:
+                break
+            # Skip the drawn examples too long for what is left of the budget
+            if self.tokens[position] <= budget:
+                chosen.append(position)
+                budget -= self.tokens[position]
+        return np.array(chosen, dtype="int64")
+
+    def examples(self, positions):
+        """The serialized examples at ``positions``, in FewShotPromptTemplate's {"example": ...} form."""
+        return [{"example": text} for text in self.texts[positions]]
+
+
+class StratifiedExampleSelector(BaseExampleSelector):
+    """
+    Example selector for FewShotPromptTemplate, a new subset from the index for every prompt.
+
+    Parameters:
+    - index (ExampleIndex): The examples to choose from.
+    - targets (dict or None): Column -> {category: percentage} the examples are drawn towards.
+    - token_budget (int): Estimated tokens of the examples in one prompt.
+    - max_examples (int or None): Cap on the number of examples.
+    - seed (int or None): Seed of the first prompt, every next prompt uses the next seed.
+    """
+
+    def __init__(self, index, targets=None, token_budget=DEFAULT_TOKEN_BUDGET, max_examples=None, seed=0):
+        self.index = index
+        self.targets = targets
+        self.token_budget = token_budget
+        self.max_examples = max_examples
+        self.seed = seed
+        self._calls = 0
+
+    def select_examples(self, input_variables):
+        seed = None if self.seed is None else self.seed + self._calls
+        self._calls += 1
+        positions = self.index.select(self.targets, self.token_budget, self.max_examples, seed)
+        return self.index.examples(positions)
+
+    async def aselect_examples(self, input_variables):
+        return self.select_examples(input_variables)
+
+    def add_example(self, example):
+        """
+        Add one example to the index, for this and every other selector sharing it.
+
+        ``example`` is either a row (column -> value) or a serialized example in
+        FewShotPromptTemplate's {"example": "column: value, ..."} form.
+        """
+        if set(example) == {"example"}:
+            texts = pd.Series([example["example"]])
+            row = parse_example(example["example"])
+        else:
+            texts, row = None, example
+        self.index.add(pd.DataFrame([row]), texts)
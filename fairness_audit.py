@@ -0,0 +1,388 @@
+"""
+Train and audit the hiring classifier of data_cleaning_Jarno.ipynb on a batch of datasets, one table out.
+
+Every dataset is audited in a worker process of its own: one row per
+candidate (the last of its events), ``Hired`` from ``Candidate State``, the
+ordinal columns encoded as in the notebook, an 80/20 split, the notebook's
+XGBClassifier (or scikit-learn's histogram gradient boosting when xgboost is
+not installed) with the few hired candidates weighted up (``--no-balance``
+trains it as the notebook does), then for every protected column the group
+rates of the test set: selection rate, true positive rate and base rate,
+from one bincount per statistic rather than a groupby per group. From those come the
+statistical parity difference (largest minus smallest selection rate), the
+equal opportunity difference (the same on true positive rates) and the
+disparate impact (smallest over largest selection rate). Groups smaller than
+``--min-group-size`` are left out of the differences.
+
+The datasets are either files (CSV, Parquet or Excel exports of the webapp)
+or the bias scenarios of the webapp sampled from a registry model: no bias,
+the default percentages and uniform shares of every bias column, and every
+category pushed to each of ``--skews`` percent. Scenarios are sampled with
+a seed through webapp/result_cache.py, so a rerun reads them from disk.
+
+    python fairness_audit.py --model single --rows 2000 --jobs 2 --include-real
+    python fairness_audit.py --model sequential --rows 1000 --skews 60 90 --bias-columns Sex
+    python fairness_audit.py --datasets exports/*.csv --protected "Age Range" Sex
+"""
+import argparse
+import datetime
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from ingestion import ORDINAL_ORDERS, load_dataset
+from train_par import OUTPUTS_DIR
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT_DIR, "webapp"))
+from config import CONFIG  # noqa: E402
+from generation import ID_COLUMN  # noqa: E402
+
+# The notebook's last choice of features, Age Range is its protected column
+FEATURES = ["Study Title", "Sex", "Years Experience", "Study area"]
+PROTECTED = ["Age Range", "Sex"]
+RESULTS_NAME = "fairness.csv"
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def bias_scenarios(bias_columns=None, skews=(80,)):
+    """
+    The bias configurations of the webapp, one dict per scenario.
+
+    Parameters:
+    - bias_columns (list or None): Columns of ``CONFIG["defaults"]``, all of them when None.
+    - skews (iterable of int): Shares a single category is pushed to, the others split the rest.
+
+    Returns:
+    - list of dict: ``name``, ``bias_column`` and ``percentages`` (summing to 100).
+    """
+    scenarios = [{"name": "no bias", "bias_column": None, "percentages": None}]
+    for column in bias_columns or list(CONFIG["defaults"]):
+        defaults = CONFIG["defaults"][column]
+        categories = list(defaults)
+        scenarios.append({"name": f"{column}: defaults", "bias_column": column, "percentages": dict(defaults)})
+        uniform = split_percentages(categories, None, 0)
+        if uniform != defaults:
+            scenarios.append({"name": f"{column}: uniform", "bias_column": column, "percentages": uniform})
+        for skew in skews:
+            for category in categories:
+                scenarios.append({
+                    "name": f"{column}: {category} {skew}%", "bias_column": column,
+                    "percentages": split_percentages(categories, category, skew),
+                })
+    return scenarios
+
+
+def split_percentages(categories, category, share):
+    """``share`` percent for ``category``, whole percentages summing to 100 for the rest."""
+    others = [other for other in categories if other != category]
+    rest = 100 - (share if category is not None else 0)
+    base, extra = divmod(rest, len(others))
+    percentages = {other: base + (1 if index < extra else 0) for index, other in enumerate(others)}
+    if category is not None:
+        percentages[category] = share
+    return {name: percentages[name] for name in categories}
+
+
+def read_dataset(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith((".xlsx", ".xls")):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def generate_scenario(model, scenario, rows, seed):
+    """
+    Sample a scenario in this process, through the result cache the app and the service share.
+
+    Returns:
+    - pd.DataFrame: The sampled data.
+    - bool: Whether the model is sequential.
+    """
+    from generation import renumber_ids
+    from parallel_sampling import ParallelSampler
+    from registry import get_registry
+    from result_cache import get_result_cache, model_hash
+
+    entry = get_registry().get(model)
+    cache = get_result_cache()
+    key = cache.key(model_hash(entry["path"]), scenario["bias_column"], scenario["percentages"], rows, seed)
+    frames = cache.get(key)
+    if frames is None:
+        sampler = ParallelSampler(
+            entry["path"], is_sequential=entry["is_sequential"],
+            chunk_size=CONFIG["parallel"]["chunk_size"], in_process=True,
+        )
+        if scenario["bias_column"] is None:
+            frames = sampler.iter_unbiased(rows, seed=seed)
+        else:
+            frames = sampler.iter_biased(scenario["bias_column"], scenario["percentages"], rows, seed=seed)
+        frames = cache.store(key, frames)
+    return renumber_ids(frames), entry["is_sequential"]
+
+
+def prepare(data, features, protected, sequential=True):
+    """
+    One row per candidate with the target, encoded features and raw protected columns.
+
+    Parameters:
+    - sequential (bool): Whether candidates span several rows (events) sharing their ID.
+
+    Returns:
+    - pd.DataFrame: The features, ordinal columns as codes in their order, the others as categories.
+    - np.ndarray: The target.
+    - pd.DataFrame: The protected columns, as strings.
+    """
+    if sequential and ID_COLUMN in data.columns:
+        data = data.groupby(ID_COLUMN, sort=False).tail(1)
+    target = (data["Candidate State"] == "Hired").to_numpy(dtype=np.int8)
+    columns = {}
+    for column in features:
+        if column in ORDINAL_ORDERS:
+            # Codes in the notebook's order, values outside it missing
+            codes = pd.Categorical(data[column], categories=ORDINAL_ORDERS[column], ordered=True).codes
+            columns[column] = np.where(codes >= 0, codes, np.nan)
+        else:
+            columns[column] = data[column].map(str, na_action="ignore").astype("category").reset_index(drop=True)
+    groups = data[protected].astype("string").fillna("missing")
+    return pd.DataFrame(columns).reset_index(drop=True), target, groups.reset_index(drop=True)
+
+
+def make_classifier(seed, positive_weight=1.0):
+    """
+    The notebook's XGBClassifier, histogram gradient boosting with the same settings without xgboost.
+
+    ``positive_weight`` scales the hired candidates, few enough that an unweighted
+    model predicts nobody is hired and every group gets the same rate of 0.
+    """
+    try:
+        from xgboost import XGBClassifier
+    except ImportError:
+        from sklearn.ensemble import HistGradientBoostingClassifier
+
+        return HistGradientBoostingClassifier(
+            max_depth=3, learning_rate=0.1, max_iter=100, random_state=seed, categorical_features="from_dtype",
+            class_weight={0: 1.0, 1: positive_weight},
+        )
+    return XGBClassifier(
+        objective="binary:logistic", eval_metric="logloss", max_depth=3, learning_rate=0.1,
+        n_estimators=100, random_state=seed, enable_categorical=True, tree_method="hist", n_jobs=1,
+        scale_pos_weight=positive_weight,
+    )
+
+
+def group_rates(groups, actual, predicted):
+    """
+    Size, selection rate, true positive rate and base rate of every group, in one pass.
+
+    Returns:
+    - pd.DataFrame: One row per group.
+    """
+    codes, names = pd.factorize(groups)
+    size = np.bincount(codes, minlength=len(names))
+    positives = np.bincount(codes, weights=actual, minlength=len(names))
+    selected = np.bincount(codes, weights=predicted, minlength=len(names))
+    true_positives = np.bincount(codes, weights=actual * predicted, minlength=len(names))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame({
+            "size": size,
+            "positives": positives.astype(int),
+            "selection_rate": selected / size,
+            "true_positive_rate": np.where(positives > 0, true_positives / positives, np.nan),
+            "base_rate": positives / size,
+        }, index=pd.Index(names, name="group"))
+
+
+def fairness_metrics(rates, min_group_size):
+    """Parity, equal opportunity and disparate impact over the groups of at least ``min_group_size``."""
+    rates = rates[rates["size"] >= min_group_size]
+    selection = rates["selection_rate"]
+    opportunity = rates["true_positive_rate"].dropna()
+    return {
+        "groups": len(rates),
+        "statistical_parity_difference": selection.max() - selection.min() if len(rates) > 1 else np.nan,
+        "equal_opportunity_difference": opportunity.max() - opportunity.min() if len(opportunity) > 1 else np.nan,
+        "disparate_impact": selection.min() / selection.max() if len(rates) > 1 and selection.max() > 0 else np.nan,
+        "most_selected_group": selection.idxmax() if len(rates) else None,
+        "least_selected_group": selection.idxmin() if len(rates) else None,
+    }
+
+
+def audit(data, features=FEATURES, protected=PROTECTED, sequential=True, test_size=0.2, seed=42, min_group_size=10,
+          balance=True):
+    """
+    Train the classifier on ``data`` and measure its fairness on the held out candidates.
+
+    With ``balance`` the hired candidates weigh as much as the others together,
+    without it the classifier is trained as in the notebook.
+
+    Returns:
+    - dict: The scores of the whole test set.
+    - list of dict: The fairness metrics of every protected column.
+    """
+    from sklearn.metrics import accuracy_score, balanced_accuracy_score
+    from sklearn.model_selection import train_test_split
+
+    X, y, groups = prepare(data, features, protected, sequential)
+    stratify = y if 1 < y.sum() < len(y) - 1 else None
+    X_train, X_test, y_train, y_test, _, groups_test = train_test_split(
+        X, y, groups, test_size=test_size, random_state=seed, stratify=stratify,
+    )
+    summary = {"candidates": len(X), "hired_rate": float(y.mean()), "test_candidates": len(X_test)}
+    if len(np.unique(y_train)) < 2:
+        raise ValueError(f"The training set has a single class ({int(y_train[0])}), nothing to learn")
+    positives = y_train.sum()
+    classifier = make_classifier(seed, (len(y_train) - positives) / positives if balance else 1.0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        classifier.fit(X_train, y_train)
+    predicted = classifier.predict(X_test).astype(np.int8)
+    summary["accuracy"] = accuracy_score(y_test, predicted)
+    summary["balanced_accuracy"] = balanced_accuracy_score(y_test, predicted)
+    summary["predicted_hired_rate"] = float(predicted.mean())
+    metrics = []
+    for column in protected:
+        rates = group_rates(groups_test[column].to_numpy(), y_test, predicted)
+        metrics.append({"protected": column, **fairness_metrics(rates, min_group_size)})
+    return summary, metrics
+
+
+def run_job(job, features, protected, min_group_size, seed, balance):
+    """Load or sample one dataset and audit it. Returns one row per protected column."""
+    row = {key: job.get(key) for key in ("dataset", "model", "bias_column", "percentages")}
+    try:
+        start = time.perf_counter()
+        sequential = True
+        if job["source"] == "file":
+            data = read_dataset(job["path"])
+        elif job["source"] == "real":
+            data = load_dataset()
+        else:
+            data, sequential = generate_scenario(job["model"], job, job["rows"], job["seed"])
+        row["rows"] = len(data)
+        row["load_seconds"] = time.perf_counter() - start
+        start = time.perf_counter()
+        summary, metrics = audit(data, features, protected, sequential, seed=seed, min_group_size=min_group_size,
+                                 balance=balance)
+        row["audit_seconds"] = time.perf_counter() - start
+        row.update(summary)
+        return [{**row, **metric} for metric in metrics]
+    except Exception as error:
+        row["error"] = f"{type(error).__name__}: {error}"
+        return [row]
+
+
+def run_audit(jobs, features=FEATURES, protected=PROTECTED, max_workers=1, min_group_size=10, seed=42,
+              balance=True, progress=None):
+    """
+    Audit every job in a pool of ``max_workers`` processes.
+
+    ``progress`` is called with the rows of every finished job.
+
+    Returns:
+    - pd.DataFrame: One row per job and protected column, in job order.
+    """
+    # Every worker gets one core's worth of threads, the jobs are the parallelism
+    previous = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+    os.environ.update({variable: "1" for variable in THREAD_VARIABLES})
+    results = [None] * len(jobs)
+    try:
+        # torch (loaded with the synthesizers) does not survive a fork
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {
+                executor.submit(run_job, job, features, protected, min_group_size, seed, balance): index
+                for index, job in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    rows = future.result()
+                except Exception as error:
+                    # The worker died, e.g. killed for running out of memory
+                    rows = [{"dataset": jobs[index]["dataset"], "error": f"{type(error).__name__}: {error}"}]
+                results[index] = [{"job": index, **row} for row in rows]
+                if progress is not None:
+                    progress(results[index])
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+def build_jobs(args):
+    jobs = []
+    if args.include_real:
+        jobs.append({"dataset": "real data", "source": "real"})
+    for pattern in args.datasets or []:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            jobs.append({"dataset": os.path.basename(path), "source": "file", "path": path})
+    if args.model:
+        for scenario in bias_scenarios(args.bias_columns, args.skews):
+            jobs.append({
+                "dataset": scenario["name"], "source": "model", "model": args.model, "rows": args.rows,
+                "seed": args.seed, "bias_column": scenario["bias_column"], "percentages": scenario["percentages"],
+            })
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasets", nargs="+", help="Files or glob patterns of synthetic datasets")
+    parser.add_argument("--model", help="Registry model to sample the bias scenarios from, see webapp/registry.py")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows (or candidates) sampled per scenario")
+    parser.add_argument("--bias-columns", nargs="+", choices=list(CONFIG["defaults"]),
+                        help="Bias columns of the scenarios, all by default")
+    parser.add_argument("--skews", type=int, nargs="+", default=[80],
+                        help="Shares each category is pushed to, one scenario per category and share")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sampled scenarios")
+    parser.add_argument("--include-real", action="store_true", help="Audit the real dataset too, as a baseline")
+    parser.add_argument("--features", nargs="+", default=FEATURES)
+    parser.add_argument("--protected", nargs="+", default=PROTECTED)
+    parser.add_argument("--min-group-size", type=int, default=10, help="Smaller test groups are left out")
+    parser.add_argument("--no-balance", action="store_true",
+                        help="Train without weighting the hired candidates up, as the notebook does")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Datasets audited at once")
+    parser.add_argument("--output-dir", help="Defaults to SDV/outputs/fairness_<timestamp>")
+    args = parser.parse_args(argv)
+
+    jobs = build_jobs(args)
+    if not jobs:
+        parser.error("nothing to audit, give --datasets, --model or --include-real")
+    output_dir = args.output_dir or os.path.join(
+        OUTPUTS_DIR, "fairness_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"{len(jobs)} datasets, {args.jobs} at once, in {output_dir}")
+
+    def progress(rows):
+        first = rows[0]
+        outcome = first.get("error") or ", ".join(
+            f"{row['protected']} parity {row['statistical_parity_difference']:.3f}" for row in rows
+        )
+        print(f"job {first['job']} ({first['dataset']}): {outcome}")
+
+    results = run_audit(jobs, args.features, args.protected, args.jobs, args.min_group_size,
+                        balance=not args.no_balance, progress=progress)
+    results_path = os.path.join(output_dir, RESULTS_NAME)
+    results.to_csv(results_path, index=False)
+    columns = ["dataset", "protected", "candidates", "hired_rate", "accuracy", "statistical_parity_difference",
+               "equal_opportunity_difference", "disparate_impact", "error"]
+    print(results[[column for column in columns if column in results.columns]].to_string(
+        index=False, float_format=lambda value: f"{value:.3f}"
+    ))
+    print(f"Saved {results_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Load Dataset_2.0_Akkodis.xlsx cleaned and cached as Parquet.
+
+Parsing the workbook takes seconds, so the cleaned data is written once to
+a Parquet file named after a hash of the workbook and the cleaning rules.
+Later calls read that file instead, and a changed workbook or changed rules
+simply lead to a new cache file. The ordinal dtypes are cheap and are set
+on every load.
+
+    from ingestion import load_dataset
+    data = load_dataset()                 # same cleanup as the SDV notebooks
+    data = load_dataset(ordinal=True)     # ordinal columns as ordered categoricals
+
+    python ingestion.py [--ordinal] [--force]   # build the cache up front
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# The orders are shared with the webapp, see webapp/ordinals.py
+sys.path.insert(0, os.path.join(ROOT_DIR, "webapp"))
+from ordinals import NOTEBOOK_ORDINAL_COLUMNS  # noqa: E402
+from ordinals import ORDINAL_ORDERS as ORDERS  # noqa: E402
+
+DATASET_PATH = os.path.join(ROOT_DIR, "Dataset_2.0_Akkodis.xlsx")
+CACHE_DIR_NAME = ".ingestion_cache"
+
+# Bump whenever clean_data changes behaviour without a change to the rules below
+RULES_VERSION = 1
+
+# The cleanup repeated at the top of every notebook
+CLEANING_RULES = {
+    "strip_column_names": True,
+    "lstrip": {"Overall": "~ "},
+    "strip": {"Year of insertion": "[]", "Year of Recruitment": "[]"},
+    # Free text columns holding the odd number, Parquet needs one type per column
+    "stringify_mixed": True,
+}
+
+# From data_cleaning_Jarno.ipynb, only applied with ordinal=True
+ORDINAL_ORDERS = {column: ORDERS[column] for column in NOTEBOOK_ORDINAL_COLUMNS}
+
+# Scores with an order but no fixed list of levels
+EXPLICIT_ORDINALS = ["Technical Skills", "Standing/Position", "Comunication", "Maturity", "Dynamism", "Mobility", "English"]
+
+
+def clean_data(data, rules=CLEANING_RULES):
+    """Apply the cleaning ``rules`` to the raw workbook data."""
+    data = data.copy()
+    if rules.get("strip_column_names"):
+        data.columns = data.columns.str.strip()
+    for column, characters in rules.get("lstrip", {}).items():
+        data[column] = data[column].str.lstrip(characters)
+    for column, characters in rules.get("strip", {}).items():
+        data[column] = data[column].str.strip(characters)
+    if rules.get("stringify_mixed"):
+        for column in data.columns[data.dtypes == object]:
+            values = data[column]
+            not_text = values.notna() & ~values.map(lambda value: isinstance(value, str))
+            if not_text.any():
+                data.loc[not_text, column] = values[not_text].astype(str)
+    return data
+
+
+def set_ordinal_dtypes(data):
+    """Turn the ordinal columns into ordered categoricals, values outside an order become NaN."""
+    data = data.copy()
+    for column, order in ORDINAL_ORDERS.items():
+        data[column] = data[column].astype(CategoricalDtype(categories=order, ordered=True))
+    for column in EXPLICIT_ORDINALS:
+        data[column] = data[column].astype(CategoricalDtype(ordered=True))
+    return data
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_hash(source, cache_dir):
+    # Hashing the workbook costs more than reading the cache, so remember it per (mtime, size)
+    stat = os.stat(source)
+    index_path = os.path.join(cache_dir, "sources.json")
+    try:
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        index = {}
+    key = os.path.abspath(source)
+    entry = index.get(key)
+    if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+        return entry["sha256"]
+    sha256 = file_sha256(source)
+    index[key] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": sha256}
+    os.makedirs(cache_dir, exist_ok=True)
+    # Renamed into place, so a concurrent or interrupted run never leaves a partial index
+    index_file = tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False)
+    try:
+        with index_file:
+            json.dump(index, index_file, indent=2)
+        os.replace(index_file.name, index_path)
+    finally:
+        if os.path.exists(index_file.name):
+            os.remove(index_file.name)
+    return sha256
+
+
+def cache_key(source_sha256, rules):
+    payload = json.dumps({"source": source_sha256, "rules": rules, "version": RULES_VERSION}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def cache_path(source=DATASET_PATH, rules=CLEANING_RULES, cache_dir=None):
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source)), CACHE_DIR_NAME)
+    key = cache_key(_source_hash(source, cache_dir), rules)
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, f"{name}-{key}.parquet")
+
+
+def load_dataset(source=DATASET_PATH, ordinal=False, cache_dir=None, force=False):
+    """
+    Load the cleaned dataset, parsing the workbook only when no cache matches.
+
+    Parameters:
+    - source (str): Path of the Excel workbook.
+    - ordinal (bool): Also turn the ordinal columns into ordered categoricals.
+    - cache_dir (str or None): Where the Parquet files go, defaults to .ingestion_cache next to the workbook.
+    - force (bool): Parse the workbook even if a cache file exists.
+
+    Returns:
+    - pd.DataFrame: The cleaned data.
+    """
+    path = cache_path(source, CLEANING_RULES, cache_dir)
+    if not force and os.path.exists(path):
+        # Missing text comes back as None rather than NaN, isna() and SDV treat both the same
+        data = pd.read_parquet(path)
+    else:
+        data = clean_data(pd.read_excel(source), CLEANING_RULES)
+        # Write next to the final name first so a crash never leaves a half written cache behind
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return set_ordinal_dtypes(data) if ordinal else data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the Parquet cache of the cleaned dataset")
+    parser.add_argument("--source", default=DATASET_PATH)
+    parser.add_argument("--ordinal", action="store_true", help="Ordinal columns as ordered categoricals")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the cache exists")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    data = load_dataset(args.source, ordinal=args.ordinal, force=args.force)
+    print(f"{data.shape[0]} rows x {data.shape[1]} columns in {time.perf_counter() - start:.2f}s")
+    print(cache_path(args.source))
+
+
+if __name__ == "__main__":
+    main()
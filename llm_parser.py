@@ -0,0 +1,277 @@
+"""
+Parse LLM "Field: value, Field: value" output into records while it streams.
+
+``RecordStreamParser`` is fed the text as the model emits it and returns
+every record as soon as it is complete. Fields are recognised by their
+known names (the ``HRRecord`` fields of Generate_synthetic_data_Langchain.ipynb,
+also written with spaces or dots as in the dataset), so commas inside a job
+description no longer break a record. A value ends at the next field name
+or at a blank line, a record ends when the next one starts (its ID, or a
+field it already has). Records failing validation are counted per reason
+in ``malformed`` instead of raising.
+
+Every fed character is scanned a bounded number of times and the buffer
+only holds the value being read, so parsing time is linear in the output.
+
+    from llm_parser import RecordCollector
+    collector = RecordCollector()
+    for chunk in llm.stream(prompt):
+        collector.feed(run, chunk)
+    collector.close(run)
+    df = collector.frame()
+"""
+import re
+import threading
+from collections import Counter
+
+import pandas as pd
+
+# Same names and order as HRRecord
+HR_RECORD_FIELDS = (
+    "ID", "Candidate_State", "Age_Range", "Citizenship", "Residence", "Sex", "Protected_category", "TAG",
+    "Study_area", "Study_Title", "Years_Experience", "Sector", "Last_Role", "Year_of_insertion",
+    "Year_of_Recruitment", "Recruitment_Request", "Assumption_Headquarters", "Job_Family_Hiring",
+    "Job_Title_Hiring", "event_type_val", "event_feedback", "linked_search_key", "Overall", "Job_Description",
+    "Candidate_Profile", "Years_Experience_1", "Minimum_Ral", "Ral_Maximum", "Study_Level", "Study_Area_1",
+    "Akkodis_headquarters", "Current_Ral", "Expected_Ral", "Technical_Skills", "Standing_Position",
+    "Communication", "Maturity", "Dynamism", "Mobility", "English",
+)
+INTEGER_FIELDS = (
+    "ID", "Technical_Skills", "Standing_Position", "Communication", "Maturity", "Dynamism", "Mobility", "English",
+)
+# Other spellings of a field name, "code" is what the first datasets called the ID
+FIELD_ALIASES = {
+    "ID": ["code"],
+    "Communication": ["Comunication"],
+}
+NULL_VALUES = {"", "null", "none", "nan", "n/a", "na"}
+
+# Enough characters to hold any field name with its markup, rescanned after every feed
+MARKER_LOOKBACK = 80
+BLANK_LINE = re.compile(r"\n[ \t\r]*\n")
+LEADING_INTEGER = re.compile(r"[+-]?\d+")
+
+
+def _name_pattern(name):
+    # Candidate_State also matches "Candidate State", Years_Experience_1 "Years Experience.1"
+    return r"[\s_./]*".join(re.escape(part) for part in re.split(r"[\s_./]+", name) if part)
+
+
+def build_marker_pattern(fields, aliases=FIELD_ALIASES):
+    """One regex finding any ``Field:`` marker, the group name tells which field (f0, f1, ...)."""
+    groups = []
+    for index, field in enumerate(fields):
+        names = [field, *aliases.get(field, [])]
+        groups.append(f"(?P<f{index}>{'|'.join(_name_pattern(name) for name in names)})")
+    # Optional markdown bold around the name, e.g. "**ID:**"
+    return re.compile(rf"(?<!\w)\**(?:{'|'.join(groups)})\**[ \t]*:\**", re.IGNORECASE)
+
+
+def clean_value(text):
+    value = text.strip().rstrip(",;").strip().strip("*\"'").strip()
+    return None if value.lower() in NULL_VALUES else value
+
+
+class RecordStreamParser:
+    """
+    Incremental parser of records written as ``Field: value`` pairs.
+
+    Parameters:
+    - fields (tuple): Field names, in the column order of the rows.
+    - integer_fields (tuple): Fields converted to int, a record where that fails is malformed.
+    - min_fields (int or None): Fields a record needs besides the ID, defaults to half of them.
+      Missing fields are None, like the NULL values the prompt asks for.
+    - model (class or None): E.g. the notebook's HRRecord, rows it rejects count as malformed.
+    """
+
+    def __init__(self, fields=HR_RECORD_FIELDS, integer_fields=INTEGER_FIELDS, min_fields=None, model=None):
+        self.fields = tuple(fields)
+        self.integer_fields = set(integer_fields)
+        self.min_fields = len(self.fields) // 2 if min_fields is None else min_fields
+        self.model = model
+        self.pattern = build_marker_pattern(self.fields)
+        self.records = 0
+        self.malformed = Counter()
+        self._buffer = ""
+        self._search_from = 0
+        self._value_start = 0
+        self._field = None
+        self._record = {}
+
+    def feed(self, text):
+        """
+        Parse the next piece of output.
+
+        Returns:
+        - list of dict: Records completed by this piece, usually none or one.
+        """
+        completed = []
+        rescan_from = max(0, len(self._buffer) - MARKER_LOOKBACK)
+        self._buffer += text
+        search_from = max(self._search_from, rescan_from)
+        # Every marker ends with a colon and every blank line with a newline, skip the scans without one
+        while ":" in text:
+            match = self.pattern.search(self._buffer, search_from)
+            if match is None:
+                break
+            if self._field is not None:
+                self._end_value(self._buffer[self._value_start:match.start()], completed)
+            field = self.fields[int(match.lastgroup[1:])]
+            if field in self._record or (field == "ID" and self._record):
+                self._finish_record(completed)
+            self._field = field
+            self._value_start = search_from = match.end()
+
+        if self._field is not None and "\n" in text:
+            blank_line = BLANK_LINE.search(self._buffer, max(self._value_start, rescan_from))
+            if blank_line is not None:
+                self._end_value(self._buffer[self._value_start:blank_line.start()], completed)
+                search_from = blank_line.end()
+
+        # Keep only the value being read, or the tail a marker may start in
+        if self._field is not None:
+            keep_from = self._value_start
+        else:
+            keep_from = max(0, len(self._buffer) - MARKER_LOOKBACK)
+            search_from = max(search_from, keep_from)
+        self._buffer = self._buffer[keep_from:]
+        self._value_start -= keep_from
+        self._search_from = search_from - keep_from
+        return completed
+
+    def close(self):
+        """End of the output, returns the last record if it is valid."""
+        completed = []
+        if self._field is not None:
+            self._end_value(self._buffer[self._value_start:], completed)
+        self._finish_record(completed)
+        self._buffer = ""
+        self._search_from = self._value_start = 0
+        return completed
+
+    def _end_value(self, text, completed):
+        blank_line = BLANK_LINE.search(text)
+        if blank_line is not None:
+            # Whatever follows a blank line is the model talking, not this value
+            text = text[:blank_line.start()]
+        self._record[self._field] = clean_value(text)
+        self._field = None
+        if len(self._record) == len(self.fields):
+            self._finish_record(completed)
+
+    def _finish_record(self, completed):
+        record, self._record = self._record, {}
+        if not record:
+            return
+        row, reason = self.validate(record)
+        if reason is None:
+            self.records += 1
+            completed.append(row)
+        else:
+            self.malformed[reason] += 1
+
+    def validate(self, record):
+        """
+        Returns:
+        - dict or None: The row, every field in order with ints converted.
+        - str or None: Why the record is malformed.
+        """
+        if record.get("ID") is None:
+            return None, "missing ID"
+        if len(record) - 1 < self.min_fields:
+            return None, "too few fields"
+        row = {}
+        for field in self.fields:
+            value = record.get(field)
+            if value is not None and field in self.integer_fields:
+                # Scores come as "4", "4/5" or "4 (good)"
+                match = LEADING_INTEGER.match(value)
+                if match is None:
+                    return None, f"invalid {field}"
+                value = int(match.group())
+            row[field] = value
+        if self.model is not None:
+            try:
+                row = dict(self.model(**row))
+            except (TypeError, ValueError):
+                return None, "rejected by model"
+        return row, None
+
+
+def parse_records(text, **parser_options):
+    """
+    Parse a whole output at once.
+
+    Returns:
+    - list of dict: The valid records.
+    - Counter: Malformed records per reason.
+    """
+    parser = RecordStreamParser(**parser_options)
+    rows = parser.feed(text) + parser.close()
+    return rows, parser.malformed
+
+
+class RecordCollector:
+    """
+    Rows of several concurrent streams, one parser per stream.
+
+    ``frame()`` and ``malformed`` can be read at any time, e.g. while runs
+    are still generating, and hold what the streams completed so far.
+    """
+
+    def __init__(self, on_record=None, **parser_options):
+        self.on_record = on_record
+        self.parser_options = parser_options
+        self.rows = []
+        self._closed_malformed = Counter()
+        self._parsers = {}
+        self._discarded = set()
+        self._lock = threading.Lock()
+
+    @property
+    def malformed(self):
+        with self._lock:
+            malformed = Counter(self._closed_malformed)
+            for parser in self._parsers.values():
+                malformed.update(parser.malformed)
+            return malformed
+
+    def _add(self, stream, rows):
+        self.rows.extend(rows)
+        if self.on_record is not None:
+            for row in rows:
+                self.on_record(stream, row)
+        return rows
+
+    def feed(self, stream, text):
+        with self._lock:
+            if stream in self._discarded:
+                # A timed out request whose thread still receives the answer
+                return []
+            parser = self._parsers.get(stream)
+            if parser is None:
+                parser = self._parsers[stream] = RecordStreamParser(**self.parser_options)
+            return self._add(stream, parser.feed(text))
+
+    def close(self, stream):
+        """End of ``stream``, its last record is parsed too."""
+        with self._lock:
+            parser = self._parsers.pop(stream, None)
+            if parser is None:
+                return []
+            rows = self._add(stream, parser.close())
+            self._closed_malformed.update(parser.malformed)
+            return rows
+
+    def discard(self, stream):
+        """Drop a broken off ``stream`` without parsing its unfinished record."""
+        with self._lock:
+            self._discarded.add(stream)
+            parser = self._parsers.pop(stream, None)
+            if parser is not None:
+                self._closed_malformed.update(parser.malformed)
+
+    def frame(self):
+        with self._lock:
+            columns = list(self.parser_options.get("fields", HR_RECORD_FIELDS))
+            return pd.DataFrame(list(self.rows), columns=columns)
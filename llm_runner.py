@@ -0,0 +1,259 @@
+"""
+Run many LLM generations concurrently against a local model server.
+
+The notebooks call ``SyntheticDataGenerator.generate(runs=...)``, which waits
+for every run before starting the next one. ``GenerationRunner`` keeps up to
+``concurrency`` runs in flight instead, retries failed runs with exponential
+backoff and records how long every run took.
+
+From a notebook, with the LangChain objects of Generate_synthetic_data_Langchain.ipynb:
+
+    from llm_runner import GenerationRunner, langchain_generate
+    runner = GenerationRunner(langchain_generate(llm, prompt_template, subject="HR_Record", extra=extra),
+                              concurrency=4)
+    results = await runner.run(30)
+
+Against an Ollama compatible server without LangChain (see ollama_standin.py to test offline):
+
+    python llm_runner.py --runs 30 --concurrency 4 --token-budget 2000 --records records.csv
+
+Passing an llm_parser.RecordCollector as ``collector`` streams the answers
+and parses their records while the runs are still generating.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import urllib.request
+
+import numpy as np
+
+from example_selection import DEFAULT_TOKEN_BUDGET, ExampleIndex
+
+OLLAMA_HOST = "http://localhost:11434"
+OLLAMA_MODEL = "llama3"
+
+# The prompt of langchain_experimental's SyntheticDataGenerator
+SYNTHETIC_FEW_SHOT_PREFIX = "This is a test about generating synthetic data about {subject}. Examples below:"
+SYNTHETIC_FEW_SHOT_SUFFIX = "Now you generate synthetic data about {subject}. Make sure to {extra}:"
+DEFAULT_EXTRA = """try to make fair output specially for gender.
+        Do not remove any field, all of them should be in output.
+        Leave some values NULL.
+        TAG field should consists some meaningful tags related to the job.
+        Job_Description and candidate profile should be in accordance to each other.
+      """
+
+
+class GenerationRunner:
+    """
+    Keep several generation runs in flight, with retries and per run timings.
+
+    Parameters:
+    - generate (async callable): ``await generate(run)`` returns the text of run number ``run``.
+    - concurrency (int): Runs in flight at once, match it to what the server processes in parallel.
+    - retries (int): Extra attempts for a run that raised or timed out.
+    - backoff_seconds (float): Wait before the first retry, doubled (with jitter) for every next one.
+    - max_backoff_seconds (float): Cap on the wait between two attempts.
+    - timeout_seconds (float or None): Time allowed for a single attempt.
+    """
+
+    def __init__(self, generate, concurrency=4, retries=3, backoff_seconds=1.0, max_backoff_seconds=30.0,
+                 timeout_seconds=None):
+        self.generate = generate
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout_seconds = timeout_seconds
+
+    def backoff(self, attempt):
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1))
+        # Jitter keeps runs that failed together from retrying together
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _run_one(self, run, semaphore, started, progress):
+        result = {"run": run, "text": None, "error": None, "attempts": 0}
+        queued_at = time.perf_counter()
+        async with semaphore:
+            result["queued_seconds"] = time.perf_counter() - queued_at
+            run_start = time.perf_counter()
+            for attempt in range(1, self.retries + 2):
+                result["attempts"] = attempt
+                try:
+                    result["text"] = await asyncio.wait_for(self.generate(run), self.timeout_seconds)
+                    result["error"] = None
+                    break
+                except Exception as error:
+                    result["error"] = f"{type(error).__name__}: {error}"
+                    if attempt <= self.retries:
+                        await asyncio.sleep(self.backoff(attempt))
+            result["seconds"] = time.perf_counter() - run_start
+            result["finished_at"] = time.perf_counter() - started
+        if progress is not None:
+            progress(result)
+        return result
+
+    async def run(self, runs, progress=None):
+        """
+        Generate ``runs`` times.
+
+        Returns:
+        - list of dict: One entry per run, in run order, with ``text`` (None
+          when every attempt failed), ``error``, ``attempts``, ``seconds``
+          (from the first attempt to the result) and ``queued_seconds``.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+        return await asyncio.gather(*(self._run_one(run, semaphore, started, progress) for run in range(runs)))
+
+    def run_sync(self, runs, progress=None):
+        """``run`` for scripts. Inside Jupyter, which already runs an event loop, await ``run`` instead."""
+        return asyncio.run(self.run(runs, progress))
+
+
+def summarize(results, elapsed_seconds):
+    seconds = np.array([result["seconds"] for result in results if result["text"] is not None])
+    return {
+        "runs": len(results),
+        "failed": sum(result["text"] is None for result in results),
+        "retried": sum(result["attempts"] > 1 for result in results),
+        "elapsed_seconds": elapsed_seconds,
+        "runs_per_second": len(seconds) / elapsed_seconds if elapsed_seconds > 0 else None,
+        "p50_seconds": float(np.percentile(seconds, 50)) if len(seconds) else None,
+        "p95_seconds": float(np.percentile(seconds, 95)) if len(seconds) else None,
+    }
+
+
+def langchain_generate(llm, prompt_template, subject, extra=DEFAULT_EXTRA, collector=None):
+    """
+    Runs through a LangChain LLM, e.g. ``Ollama(model="llama3")`` with the notebook's FewShotPromptTemplate.
+
+    The prompt is formatted for every run, so a template with an example
+    selector (see example_selection.py) sends other examples each time.
+    With a ``collector`` (llm_parser.RecordCollector) the answer is streamed
+    and its records are parsed while it is being generated.
+    """
+    attempts = itertools.count()
+
+    async def generate(run):
+        prompt = prompt_template.format(subject=subject, extra=extra)
+        if collector is None:
+            return await llm.ainvoke(prompt)
+        stream = (run, next(attempts))
+        chunks = []
+        try:
+            async for chunk in llm.astream(prompt):
+                chunks.append(chunk)
+                collector.feed(stream, chunk)
+        except BaseException:
+            collector.discard(stream)
+            raise
+        collector.close(stream)
+        return "".join(chunks)
+
+    return generate
+
+
+def build_prompt(examples, subject="HR_Record", extra=DEFAULT_EXTRA):
+    """The few shot prompt SyntheticDataGenerator sends, for when LangChain is not installed."""
+    parts = [SYNTHETIC_FEW_SHOT_PREFIX.format(subject=subject), *examples]
+    parts.append(SYNTHETIC_FEW_SHOT_SUFFIX.format(subject=subject, extra=extra))
+    return "\n\n".join(parts)
+
+
+def ollama_generate(prompt, host=OLLAMA_HOST, model=OLLAMA_MODEL, options=None, request_timeout=600, collector=None):
+    """
+    Runs through Ollama's /api/generate using only the standard library, streamed into ``collector`` if given.
+
+    ``prompt`` is the prompt of every run, or a function of the run number returning it.
+    """
+    url = f"{host.rstrip('/')}/api/generate"
+    attempts = itertools.count()
+
+    def post(run, stream):
+        body = json.dumps({
+            "model": model, "prompt": prompt(run) if callable(prompt) else prompt,
+            "stream": collector is not None, "options": options or {},
+        }).encode()
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=request_timeout) as response:
+            if collector is None:
+                return json.loads(response.read())["response"]
+            # One JSON object per line, each with the next piece of the answer
+            chunks = []
+            for line in filter(bytes.strip, response):
+                chunk = json.loads(line)["response"]
+                chunks.append(chunk)
+                collector.feed(stream, chunk)
+            return "".join(chunks)
+
+    async def generate(run):
+        stream = (run, next(attempts))
+        try:
+            # urllib blocks, so every request waits in its own thread
+            text = await asyncio.to_thread(post, run, stream)
+        except BaseException:
+            if collector is not None:
+                collector.discard(stream)
+            raise
+        if collector is not None:
+            collector.close(stream)
+        return text
+
+    return generate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic records concurrently with a local LLM server")
+    parser.add_argument("--host", default=OLLAMA_HOST)
+    parser.add_argument("--model", default=OLLAMA_MODEL)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--timeout", type=float, help="Seconds allowed per attempt")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="Tokens of examples per prompt")
+    parser.add_argument("-o", "--output", help="JSON file for the generated texts and timings")
+    parser.add_argument("--records", help="CSV file for the records parsed while the answers stream in")
+    args = parser.parse_args(argv)
+
+    from ingestion import load_dataset
+    from llm_parser import RecordCollector
+
+    index = ExampleIndex(load_dataset())
+
+    def prompt(run):
+        # Other examples for every run, drawn from all categories
+        positions = index.select(token_budget=args.token_budget, seed=run)
+        return build_prompt([example["example"] for example in index.examples(positions)])
+
+    collector = RecordCollector() if args.records else None
+
+    runner = GenerationRunner(
+        ollama_generate(prompt, args.host, args.model, {"temperature": args.temperature}, collector=collector),
+        concurrency=args.concurrency,
+        retries=args.retries,
+        timeout_seconds=args.timeout,
+    )
+
+    def progress(result):
+        status = "ok" if result["text"] is not None else result["error"]
+        records = f", {len(collector.rows)} records so far" if collector is not None else ""
+        print(f"run {result['run']}: {result['seconds']:.2f}s, {result['attempts']} attempt(s), {status}{records}")
+
+    start = time.perf_counter()
+    results = runner.run_sync(args.runs, progress)
+    summary = summarize(results, time.perf_counter() - start)
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"summary": summary, "results": results}, output, indent=2)
+    if collector is not None:
+        collector.frame().to_csv(args.records, index=False)
+        print(f"{len(collector.rows)} records, malformed: {dict(collector.malformed)}")
+
+
+if __name__ == "__main__":
+    main()
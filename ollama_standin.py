@@ -0,0 +1,137 @@
+"""
+Local stand-in for an Ollama server, to run llm_runner.py without a model.
+
+Answers POST /api/generate (streaming or not) and GET /api/tags the way
+Ollama does. Every answer takes ``--latency`` seconds, spread over its
+pieces when streamed, and at most ``--parallel`` requests are answered at
+once (like OLLAMA_NUM_PARALLEL), the others wait. A share ``--failure-rate`` of the requests fails with 503
+to exercise retries. The text is one of the prompt's example records with a
+new ID, so the output parses like a real answer.
+
+    python ollama_standin.py --port 11434 --latency 0.5 --parallel 4
+    python llm_runner.py --runs 30 --concurrency 4 --records records.csv
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Example records of the few shot prompt, "ID: 123, Candidate State: ..." or "ID: 123\nCandidate_State: ..."
+EXAMPLE_PATTERN = re.compile(r"^ID: ?\d+.*?(?=\n\s*\n|\Z)", re.MULTILINE | re.DOTALL)
+
+
+def fake_answer(prompt, rng):
+    examples = EXAMPLE_PATTERN.findall(prompt)
+    if not examples:
+        return "ID: 1, Sex: Female, Age Range: 26 - 30 years"
+    records = [
+        re.sub(r"^ID: ?\d+", f"ID: {rng.randint(100000, 999999)}", rng.choice(examples))
+        for _ in range(rng.randint(1, 3))
+    ]
+    return "Here are some synthetic HR records:\n\n" + "\n\n".join(records)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    # Set by serve()
+    settings = None
+    slots = None
+    rng = None
+
+    def log_message(self, format, *args):
+        if self.settings.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": f"{self.settings.model}:latest", "model": self.settings.model}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.rng.random() < self.settings.failure_rate:
+            self._send_json(503, {"error": "server busy"})
+            return
+
+        start = time.perf_counter()
+        stream = request.get("stream", True)
+        with self.slots:
+            latency = self.settings.latency * self.rng.uniform(0.8, 1.2)
+            text = fake_answer(request.get("prompt", ""), self.rng)
+            if not stream:
+                time.sleep(latency)
+                final = self._final(request, text, start)
+                self._send_json(200, {**final, "response": text})
+                return
+
+            # Ollama streams one JSON object per line, the last one with done set
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            words = re.findall(r"\S+\s*", text)
+            for word in words:
+                time.sleep(latency / len(words))
+                chunk = {"model": request.get("model", self.settings.model), "response": word, "done": False}
+                self.wfile.write(json.dumps(chunk).encode() + b"\n")
+                self.wfile.flush()
+            final = self._final(request, text, start)
+            self.wfile.write(json.dumps({**final, "response": ""}).encode() + b"\n")
+
+    def _final(self, request, text, start):
+        return {
+            "model": request.get("model", self.settings.model),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": True,
+            "total_duration": int((time.perf_counter() - start) * 1e9),
+            "eval_count": len(text.split()),
+        }
+
+
+def serve(port=11434, latency=0.5, parallel=4, failure_rate=0.0, model="llama3", seed=None, verbose=False):
+    settings = argparse.Namespace(latency=latency, failure_rate=failure_rate, model=model, verbose=verbose)
+    handler = type("Handler", (StandinHandler,), {
+        "settings": settings,
+        "slots": threading.BoundedSemaphore(parallel),
+        "rng": random.Random(seed),
+    })
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline stand-in for an Ollama server")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per answer")
+    parser.add_argument("--parallel", type=int, default=4, help="Requests answered at once")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests failing with 503")
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    server = serve(args.port, args.latency, args.parallel, args.failure_rate, args.model, args.seed, args.verbose)
+    print(f"Ollama stand-in on http://127.0.0.1:{args.port} ({args.parallel} parallel, {args.latency}s per answer)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
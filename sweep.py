@@ -0,0 +1,348 @@
+"""
+Train a grid of PAR, GaussianCopula and HMA synthesizers in parallel and compare them in one table.
+
+Every model of the grid is fitted in its own worker process with a budget
+of ``--cores-per-job`` cores (torch and the BLAS libraries get that many
+threads), ``--jobs`` of them at once. Each one samples ``--sample-candidates``
+candidates and is scored the same way, whatever its synthesizer: the
+synthetic candidates (the first row of every PAR sequence, the HMA
+candidates joined with their first event) against every real candidate,
+with SDV's quality and diagnostic reports and webapp/fidelity.py. The
+results go to results.csv, one row per model with its fit time, sampling
+throughput, scores and peak memory.
+
+    python sweep.py --synthesizers par gaussian_copula --epochs 32 128 --num-sequences 400 1000 --jobs 2
+    python sweep.py --grid sweep_grid.json --cores-per-job 2
+
+A grid file maps synthesizers to lists of values, every combination is one
+model. ``num_sequences`` (candidates trained on), ``context`` (a name of
+CONTEXT_SETS) and ``seed`` are handled here, any other key is passed to the
+synthesizer, e.g. ``epochs`` to PAR or ``default_distribution`` to GaussianCopula:
+
+    {"par": {"epochs": [32, 128], "num_sequences": [400, 1000], "context": ["all", "profile"]},
+     "gaussian_copula": {"num_sequences": [1000, null], "default_distribution": ["beta", "norm"]},
+     "hma": {"num_sequences": [400], "context": ["profile"]}}
+"""
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from ingestion import load_dataset
+from train_par import OUTPUTS_DIR, build_metadata, data_fingerprint, prepare_data, set_threads, train
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT_DIR, "webapp"))
+from fidelity import fidelity_report, get_real_histograms  # noqa: E402
+
+SYNTHESIZERS = ("par", "gaussian_copula", "hma")
+# Candidate level columns: PAR's context columns, HMA's candidates table. None is every column PAR may use.
+CONTEXT_SETS = {
+    "all": None,
+    "profile": [
+        "Candidate State", "Age Range", "Sex", "Protected category", "Study area", "Study Title",
+        "Years Experience", "Sector",
+    ],
+    "demographics": ["Age Range", "Sex", "Protected category", "Study Title"],
+}
+# Threads of the numerical libraries, read when they are first imported in a worker
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+RESULTS_NAME = "results.csv"
+
+
+def expand_grid(grid):
+    """
+    Every combination of the grid's values, one dict per model.
+
+    Parameters:
+    - grid (dict): Synthesizer -> {parameter: value or list of values}.
+
+    Returns:
+    - list of dict: ``synthesizer``, ``num_sequences``, ``context``, ``seed`` and ``params``.
+    """
+    jobs = []
+    for synthesizer, options in grid.items():
+        if synthesizer not in SYNTHESIZERS:
+            raise ValueError(f"Unknown synthesizer {synthesizer!r}, expected one of {', '.join(SYNTHESIZERS)}")
+        options = {key: value if isinstance(value, list) else [value] for key, value in options.items()}
+        if synthesizer == "gaussian_copula":
+            # A single table of candidates, there is no context to choose
+            options.pop("context", None)
+        for values in itertools.product(*options.values()):
+            config = dict(zip(options, values))
+            context = config.pop("context", "all")
+            if context not in CONTEXT_SETS:
+                raise ValueError(f"Unknown context {context!r}, expected one of {', '.join(CONTEXT_SETS)}")
+            jobs.append({
+                "synthesizer": synthesizer,
+                "num_sequences": config.pop("num_sequences", None),
+                "context": context if synthesizer != "gaussian_copula" else None,
+                "seed": config.pop("seed", 0),
+                "params": config,
+            })
+    return jobs
+
+
+def subsample(data, num_sequences, seed):
+    """``num_sequences`` random candidates with all their rows, as train_par does."""
+    if not num_sequences:
+        return data
+    ids = np.random.default_rng(seed).permutation(data["ID"].unique())[:num_sequences]
+    return data[data["ID"].isin(ids)].reset_index(drop=True)
+
+
+def first_rows(data, columns):
+    """One row per candidate with ``columns``, those ``data`` lacks are left out."""
+    return data.drop_duplicates(subset="ID")[[column for column in ["ID", *columns] if column in data.columns]]
+
+
+def fit_par(data, context_columns, params, num_sequences, seed, output_dir, batch_size, patience):
+    # train_par subsamples the same candidates for the same seed, and logs every epoch in output_dir
+    synthesizer, _ = train(
+        data, output_dir, epochs=params.pop("epochs", 128), num_sequences=num_sequences, batch_size=batch_size,
+        checkpoint_every=10 ** 6, patience=patience, verbose=False, seed=seed, context_columns=context_columns,
+        **params,
+    )
+
+    def sample(num_candidates):
+        return synthesizer.sample(num_sequences=num_candidates)
+
+    return synthesizer, sample
+
+
+def fit_gaussian_copula(data, candidate_columns, params):
+    from sdv.single_table import GaussianCopulaSynthesizer
+
+    candidates = first_rows(data, candidate_columns).reset_index(drop=True)
+    synthesizer = GaussianCopulaSynthesizer(build_metadata(candidates, sequential=False), locales="it_IT", **params)
+    synthesizer.fit(candidates)
+
+    def sample(num_candidates):
+        return synthesizer.sample(num_rows=num_candidates)
+
+    return synthesizer, sample
+
+
+def split_tables(data, context_columns):
+    """The candidates and events tables of SDV_multitable.ipynb."""
+    candidates = first_rows(data, context_columns).rename(columns={"ID": "candidate_id"}).reset_index(drop=True)
+    events = data.drop(columns=context_columns).rename(columns={"ID": "candidate_id"})
+    events.insert(0, "event_id", np.arange(1, len(events) + 1))
+    return candidates, events
+
+
+def fit_hma(data, context_columns, params):
+    from sdv.metadata import Metadata
+    from sdv.multi_table import HMASynthesizer
+
+    candidates, events = split_tables(data, context_columns)
+    metadata = Metadata.detect_from_dataframes(data={"candidates": candidates, "events": events})
+    # Set rather than detected, detection depends on the values of the subsample
+    for table, column in (("candidates", "candidate_id"), ("events", "candidate_id"), ("events", "event_id")):
+        metadata.update_column(table_name=table, column_name=column, sdtype="id")
+    metadata.set_primary_key(table_name="candidates", column_name="candidate_id")
+    metadata.set_primary_key(table_name="events", column_name="event_id")
+    if not metadata.relationships:
+        metadata.add_relationship(
+            parent_table_name="candidates", child_table_name="events",
+            parent_primary_key="candidate_id", child_foreign_key="candidate_id",
+        )
+    for column in ("Candidate State", "Year of insertion", "Year of Recruitment"):
+        table = "candidates" if column in candidates.columns else "events"
+        metadata.update_column(table_name=table, column_name=column, sdtype="categorical")
+    synthesizer = HMASynthesizer(metadata, locales="it_IT", **{"verbose": False, **params})
+    synthesizer.fit({"candidates": candidates, "events": events})
+
+    def sample(num_candidates):
+        tables = synthesizer.sample(scale=num_candidates / len(candidates))
+        # One row per event with its candidate's columns, like PAR's sequences, candidates without events kept
+        events = tables["events"].drop(columns="event_id")
+        merged = tables["candidates"].merge(events, on="candidate_id", how="left")
+        return merged.rename(columns={"candidate_id": "ID"})
+
+    return synthesizer, sample
+
+
+def score(real_candidates, synthetic, metadata):
+    """Quality, diagnostic and fidelity scores of the synthetic candidates."""
+    from sdmetrics.reports.single_table import DiagnosticReport, QualityReport
+
+    synthetic = first_rows(synthetic, real_candidates.columns).reset_index(drop=True)
+    # sdv's evaluate_quality passes verbose where this sdmetrics expects constraints, so the reports are run here
+    table_metadata = next(iter(metadata.to_dict()["tables"].values()))
+    quality = QualityReport()
+    quality.generate(real_candidates, synthetic, table_metadata, verbose=False)
+    diagnostic = DiagnosticReport()
+    diagnostic.generate(real_candidates, synthetic, table_metadata, verbose=False)
+    column_scores, pair_scores = fidelity_report(get_real_histograms(real_candidates), synthetic)
+    scores = {"quality_score": quality.get_score(), "diagnostic_score": diagnostic.get_score()}
+    for report in (quality, diagnostic):
+        for _, row in report.get_properties().iterrows():
+            scores[row["Property"].lower().replace(" ", "_")] = row["Score"]
+    scores["fidelity_tv_complement"] = column_scores["tv_complement"].mean()
+    scores["fidelity_pair_similarity"] = pair_scores["contingency_similarity"].mean()
+    return scores
+
+
+def run_job(job, output_dir, sample_candidates, cores, batch_size, patience):
+    """
+    Fit, sample and score one model of the grid, in a worker process.
+
+    Returns:
+    - dict: The job's settings and measurements, with ``error`` set instead when it failed.
+    """
+    set_threads(cores, None)
+    warnings.filterwarnings("ignore")
+    row = {"synthesizer": job["synthesizer"], "num_sequences": job["num_sequences"], "context": job["context"],
+           "seed": job["seed"], "params": json.dumps(job["params"], sort_keys=True), "cores": cores}
+    try:
+        data, all_context_columns = prepare_data(load_dataset())
+        real_candidates = first_rows(data, all_context_columns).reset_index(drop=True)
+        context_columns = CONTEXT_SETS[job["context"]] if job["context"] else None
+        context_columns = all_context_columns if context_columns is None else context_columns
+        training_data = subsample(data, job["num_sequences"], job["seed"])
+        row["training_candidates"] = training_data["ID"].nunique()
+        row["training_rows"] = len(training_data)
+        # Read by webapp/registry.py when it registers the saved model
+        row["data_hash"] = data_fingerprint(training_data, {})
+
+        params = dict(job["params"])
+        start = time.perf_counter()
+        if job["synthesizer"] == "par":
+            synthesizer, sample = fit_par(data, context_columns, params, job["num_sequences"], job["seed"],
+                                          output_dir, batch_size, patience)
+        elif job["synthesizer"] == "gaussian_copula":
+            synthesizer, sample = fit_gaussian_copula(training_data, all_context_columns, params)
+        else:
+            synthesizer, sample = fit_hma(training_data, context_columns, params)
+        row["fit_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        synthetic = sample(sample_candidates)
+        row["sample_seconds"] = time.perf_counter() - start
+        row["sampled_candidates"] = synthetic["ID"].nunique()
+        row["sampled_rows"] = len(synthetic)
+        row["candidates_per_second"] = row["sampled_candidates"] / row["sample_seconds"]
+
+        start = time.perf_counter()
+        row.update(score(real_candidates, synthetic, build_metadata(real_candidates, sequential=False)))
+        row["score_seconds"] = time.perf_counter() - start
+        synthesizer.save(filepath=os.path.join(output_dir, "synthesizer.pkl"))
+    except Exception as error:
+        row["error"] = f"{type(error).__name__}: {error}"
+        with open(os.path.join(output_dir, "error.txt"), "w") as error_file:
+            error_file.write(traceback.format_exc())
+    # ru_maxrss is in kilobytes on Linux, every job has a process of its own
+    row["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return row
+
+
+def run_sweep(jobs, output_dir, max_workers=1, cores_per_job=1, sample_candidates=1000, batch_size=256,
+              patience=0, progress=None):
+    """
+    Run every job of ``expand_grid`` in a pool of ``max_workers`` processes and collect their rows.
+
+    Every job gets a fresh process, so its threads and peak memory are its own.
+    ``progress`` is called with every finished row.
+
+    Returns:
+    - pd.DataFrame: One row per job, in grid order.
+    """
+    # Spawned workers inherit the environment, the libraries read it when they load
+    previous = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+    os.environ.update({variable: str(cores_per_job) for variable in THREAD_VARIABLES})
+    rows = [None] * len(jobs)
+    try:
+        # torch does not survive a fork once it has started its thread pools
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 max_tasks_per_child=1) as executor:
+            futures = {}
+            for index, job in enumerate(jobs):
+                job_dir = os.path.join(output_dir, f"{index:03d}_{job['synthesizer']}")
+                os.makedirs(job_dir, exist_ok=True)
+                future = executor.submit(run_job, job, job_dir, sample_candidates, cores_per_job, batch_size, patience)
+                futures[future] = index
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    rows[index] = future.result()
+                except Exception as error:
+                    # The worker died, e.g. killed for running out of memory
+                    rows[index] = {"synthesizer": jobs[index]["synthesizer"], "error": f"{type(error).__name__}: {error}"}
+                rows[index] = {"job": index, **rows[index]}
+                if progress is not None:
+                    progress(rows[index])
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", help="JSON file with the grid, replaces the options below")
+    parser.add_argument("--synthesizers", nargs="+", choices=SYNTHESIZERS, default=list(SYNTHESIZERS))
+    parser.add_argument("--epochs", type=int, nargs="+", default=[128], help="PAR epochs")
+    parser.add_argument("--num-sequences", type=int, nargs="+", default=[1000],
+                        help="Candidates trained on, 0 for all of them")
+    parser.add_argument("--context", nargs="+", choices=list(CONTEXT_SETS), default=["all"],
+                        help="Candidate level columns of PAR and HMA")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, help="Models trained at once, defaults to cores / --cores-per-job")
+    parser.add_argument("--cores-per-job", type=int, default=1)
+    parser.add_argument("--sample-candidates", type=int, default=1000, help="Candidates sampled from every model")
+    parser.add_argument("--batch-size", type=int, default=256, help="PAR sequences per optimizer step")
+    parser.add_argument("--patience", type=int, default=0, help="PAR early stopping, 0 trains every epoch")
+    parser.add_argument("--output-dir", help="Defaults to SDV/outputs/sweep_<timestamp>")
+    args = parser.parse_args(argv)
+
+    if args.grid:
+        with open(args.grid) as grid_file:
+            grid = json.load(grid_file)
+    else:
+        num_sequences = [value or None for value in args.num_sequences]
+        common = {"num_sequences": num_sequences, "context": args.context, "seed": args.seed}
+        grid = {synthesizer: dict(common) for synthesizer in args.synthesizers}
+        if "par" in grid:
+            grid["par"]["epochs"] = args.epochs
+    jobs = expand_grid(grid)
+
+    output_dir = args.output_dir or os.path.join(
+        OUTPUTS_DIR, "sweep_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "grid.json"), "w") as grid_file:
+        json.dump(grid, grid_file, indent=2)
+    max_workers = args.jobs or max(1, (os.cpu_count() or 1) // args.cores_per_job)
+    print(f"{len(jobs)} models, {max_workers} at once with {args.cores_per_job} core(s) each, in {output_dir}")
+
+    def progress(row):
+        outcome = row.get("error") or f"quality {row['quality_score']:.3f}, fit {row['fit_seconds']:.1f}s"
+        print(f"job {row['job']} ({row['synthesizer']}): {outcome}")
+
+    results = run_sweep(jobs, output_dir, max_workers, args.cores_per_job, args.sample_candidates, args.batch_size,
+                        args.patience, progress)
+    results_path = os.path.join(output_dir, RESULTS_NAME)
+    results.to_csv(results_path, index=False)
+    columns = ["synthesizer", "num_sequences", "context", "params", "fit_seconds", "candidates_per_second",
+               "quality_score", "diagnostic_score", "fidelity_tv_complement"]
+    print(results[[column for column in columns if column in results.columns]].to_string(index=False))
+    print(f"Saved {results_path}")
+
+
+if __name__ == "__main__":
+    main()
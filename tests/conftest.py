@@ -0,0 +1,6 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The webapp modules import each other by their flat names, as when run from webapp/
+sys.path[:0] = [os.path.join(REPO_DIR, "webapp"), REPO_DIR]
@@ -0,0 +1,41 @@
+import pandas as pd
+
+from example_selection import ExampleIndex, StratifiedExampleSelector, parse_example, serialize_examples
+
+
+def _data():
+    return pd.DataFrame({
+        "Sex": ["Male", "Female", "Male", "Female", None],
+        "Age Range": ["20 - 25 years", "26 - 30 years", "26 - 30 years", "20 - 25 years", "26 - 30 years"],
+        "City": ["TURIN", "BARI", "MILAN", "ROME", "TURIN"],
+    })
+
+
+def test_serialized_examples_parse_back():
+    texts = serialize_examples(_data())
+    assert parse_example(texts[0]) == {"Sex": "Male", "Age Range": "20 - 25 years", "City": "TURIN"}
+    assert parse_example(texts[4])["Sex"] is None
+
+
+def test_select_covers_every_category_within_budget():
+    index = ExampleIndex(_data())
+    positions = index.select(token_budget=60, seed=0)
+    assert index.tokens[positions].sum() <= 60
+    assert set(index.codes[positions, 0]) >= {0, 1}
+
+
+def test_targets_leave_out_unwanted_categories():
+    index = ExampleIndex(_data())
+    positions = index.select(targets={"Sex": {"Female": 100}}, seed=0)
+    assert set(pd.Series(index.texts[positions]).str.contains("Sex: Female")) == {True}
+
+
+def test_add_example_updates_the_strata():
+    index = ExampleIndex(_data())
+    selector = StratifiedExampleSelector(index, targets={"Sex": {"Other": 100}})
+    selector.add_example({"Sex": "Other", "Age Range": "> 45 years", "City": "GENOA"})
+    selector.add_example({"example": "Sex: Male, Age Range: > 45 years, City: PISA"})
+    assert len(index) == 7
+    assert list(index.categories["Sex"]) == ["Male", "Female", "Other"]
+    assert index.codes[-1].tolist() == [0, 2]
+    assert selector.select_examples({}) == [{"example": "Sex: Other, Age Range: > 45 years, City: GENOA"}]
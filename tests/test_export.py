@@ -0,0 +1,44 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from export import export_frames
+
+
+def _frames():
+    return [
+        pd.DataFrame({"ID": [1, 2], "Sex": ["Male", "Female"], "Score": [3.5, np.nan]}),
+        pd.DataFrame({"ID": [3], "Sex": [None], "Score": [4.0]}),
+    ]
+
+
+def _read(export_format, path):
+    if export_format == "csv":
+        frame = pd.read_csv(path)
+    elif export_format == "parquet":
+        frame = pd.read_parquet(path)
+    else:
+        frame = pd.read_excel(path)
+    # Every format has its own missing string, compare them as NaN
+    return frame.astype({"Sex": object}).fillna({"Sex": np.nan})
+
+
+@pytest.mark.parametrize("export_format", ["csv", "parquet", "xlsx"])
+def test_export_round_trip(tmp_path, export_format):
+    path = str(tmp_path / f"data.{export_format}")
+    assert export_frames(_frames(), export_format, path, chunk_rows=2) == path
+    expected = pd.concat(_frames(), ignore_index=True).fillna({"Sex": np.nan})
+    pd.testing.assert_frame_equal(_read(export_format, path), expected, check_dtype=False)
+
+
+def test_csv_to_a_file_object_has_one_header():
+    output = io.BytesIO()
+    export_frames(_frames(), "csv", output, chunk_rows=1)
+    assert output.getvalue().decode().splitlines() == ["ID,Sex,Score", "1,Male,3.5", "2,Female,", "3,,4.0"]
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        export_frames(_frames(), "json", "data.json")
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from generation import category_counts, renumber_ids
+
+
+def test_category_counts_keep_rows_of_derived_percentages():
+    assert category_counts({"Male": 100 * 3 / 7, "Female": 100 * 4 / 7}, 7) == {"Male": 3, "Female": 4}
+    assert category_counts({"Male": 30, "Female": 70}, 10) == {"Male": 3, "Female": 7}
+    assert category_counts({"Male": 50}, 3) == {"Male": 1}
+
+
+def test_renumber_ids_gives_fresh_ids_across_frames():
+    frames = [
+        pd.DataFrame({"ID": [7, 7, 9], "Event": ["a", "b", "c"]}),
+        pd.DataFrame({"ID": []}),
+        pd.DataFrame({"ID": [7, 8], "Event": ["d", "e"]}),
+    ]
+    renumbered = renumber_ids(frames, start=1)
+    assert renumbered["ID"].tolist() == [1, 1, 2, 3, 4]
+    assert renumbered["Event"].tolist() == ["a", "b", "c", "d", "e"]
+    assert frames[0]["ID"].tolist() == [7, 7, 9]
+
+
+def test_renumber_ids_of_nothing():
+    assert renumber_ids([]).empty
+    assert renumber_ids([pd.DataFrame({"ID": []})]).empty
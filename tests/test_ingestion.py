@@ -0,0 +1,23 @@
+import json
+
+from ingestion import _source_hash, file_sha256
+
+
+def test_source_hash_is_remembered(tmp_path):
+    source = tmp_path / "workbook.xlsx"
+    source.write_bytes(b"rows")
+    cache_dir = tmp_path / "cache"
+    assert _source_hash(str(source), str(cache_dir)) == file_sha256(str(source))
+    index = json.loads((cache_dir / "sources.json").read_text())
+    assert index[str(source)]["sha256"] == file_sha256(str(source))
+    assert [path.name for path in cache_dir.iterdir()] == ["sources.json"]
+
+
+def test_damaged_index_is_rebuilt(tmp_path):
+    source = tmp_path / "workbook.xlsx"
+    source.write_bytes(b"rows")
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "sources.json").write_text('{"truncated": ')
+    assert _source_hash(str(source), str(cache_dir)) == file_sha256(str(source))
+    assert list(json.loads((cache_dir / "sources.json").read_text())) == [str(source)]
@@ -0,0 +1,38 @@
+from llm_parser import RecordStreamParser, parse_records
+
+FIELDS = ("ID", "Sex", "Job_Description", "English")
+
+
+def _parser(**options):
+    return RecordStreamParser(fields=FIELDS, integer_fields=("ID", "English"), **options)
+
+
+def test_commas_inside_a_value_do_not_split_the_record():
+    rows, malformed = parse_records(
+        "ID: 1, Sex: Male, Job Description: Java, SQL, Spring, English: 4/5\n"
+        "**ID:** 2, Sex: null, Job_Description: Support, English: 3 (good)",
+        fields=FIELDS, integer_fields=("ID", "English"),
+    )
+    assert rows == [
+        {"ID": 1, "Sex": "Male", "Job_Description": "Java, SQL, Spring", "English": 4},
+        {"ID": 2, "Sex": None, "Job_Description": "Support", "English": 3},
+    ]
+    assert not malformed
+
+
+def test_records_complete_while_streaming():
+    parser = _parser()
+    text = "ID: 1, Sex: Female, Job_Description: Data analyst, English: 5\nID: 2, Sex: Ma"
+    completed = [parser.feed(text[start:start + 3]) for start in range(0, len(text), 3)]
+    assert sum(completed, []) == [{"ID": 1, "Sex": "Female", "Job_Description": "Data analyst", "English": 5}]
+    assert parser.feed("le, English: 2\n\nThat is all.") == []
+    assert parser.close() == [{"ID": 2, "Sex": "Male", "Job_Description": None, "English": 2}]
+
+
+def test_malformed_records_are_counted():
+    rows, malformed = parse_records(
+        "Sex: Male, English: 4\n\nID: x, Sex: Male, English: 4\n\nID: 3, Sex: Male, English: good",
+        fields=FIELDS, integer_fields=("ID", "English"),
+    )
+    assert rows == []
+    assert malformed == {"missing ID": 1, "invalid ID": 1, "invalid English": 1}
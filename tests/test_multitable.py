@@ -0,0 +1,82 @@
+import os
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from multitable import ShardedTableSampler, renumber_keys, table_plan
+from registry import get_registry
+
+
+RELATIONSHIPS = [
+    {"parent_table_name": "candidates", "child_table_name": "events",
+     "parent_primary_key": "ID", "child_foreign_key": "candidate_id"},
+    {"parent_table_name": "events", "child_table_name": "feedback",
+     "parent_primary_key": "event_id", "child_foreign_key": "event_id"},
+]
+
+
+def _synthesizer(relationships, primary_keys, max_child_rows):
+    tables = {table: SimpleNamespace(primary_key=key) for table, key in primary_keys.items()}
+    metadata = SimpleNamespace(tables=tables, relationships=relationships)
+    return SimpleNamespace(get_metadata=lambda: metadata, _max_child_rows=max_child_rows)
+
+
+def test_table_plan():
+    synthesizer = _synthesizer(
+        RELATIONSHIPS,
+        {"candidates": "ID", "events": "event_id", "feedback": None},
+        {"__events__candidate_id__num_rows": 3.0, "__feedback__event_id__num_rows": 2.0},
+    )
+    root, capacities, primary_keys, relationships = table_plan(synthesizer)
+    assert root == "candidates"
+    assert capacities == {"candidates": 1, "events": 3, "feedback": 6}
+    assert primary_keys == {"candidates": "ID", "events": "event_id"}
+    assert relationships == RELATIONSHIPS
+
+
+def test_table_plan_needs_a_single_root():
+    cycle = [dict(RELATIONSHIPS[0]), {**RELATIONSHIPS[0], "parent_table_name": "events", "child_table_name": "candidates"}]
+    with pytest.raises(ValueError):
+        table_plan(_synthesizer(cycle, {"candidates": "ID", "events": "event_id"}, {}))
+
+
+def test_renumber_keys():
+    tables = {
+        "candidates": pd.DataFrame({"ID": [50, 60]}),
+        "events": pd.DataFrame({"event_id": [7, 8, 9], "candidate_id": [60, 50, 99]}),
+        "feedback": pd.DataFrame({"event_id": [9, 7]}),
+    }
+    renumbered = renumber_keys(
+        tables, {"candidates": 10, "events": 100}, {"candidates": "ID", "events": "event_id"}, RELATIONSHIPS
+    )
+    assert renumbered["candidates"]["ID"].tolist() == [11, 12]
+    assert renumbered["events"]["event_id"].tolist() == [101, 102, 103]
+    assert renumbered["events"]["candidate_id"].tolist() == [12, 11, pd.NA]
+    assert renumbered["feedback"]["event_id"].tolist() == [103, 101]
+    assert tables["candidates"]["ID"].tolist() == [50, 60]
+
+
+def _multi_table_path():
+    return next(iter(get_registry().multi_table_models().values()))["path"]
+
+
+def _sample_tables(monkeypatch, tmp_path, hash_seed):
+    # The spawned workers take their hash seed from the environment they start in
+    monkeypatch.setenv("PYTHONHASHSEED", hash_seed)
+    output_dir = tmp_path / f"hash-seed-{hash_seed}"
+    ShardedTableSampler(_multi_table_path(), max_workers=1, shard_size=50).sample_to_dir(
+        100, str(output_dir), seed=3
+    )
+    return {
+        table: pd.read_parquet(output_dir / table)
+        for table in sorted(os.listdir(output_dir)) if table != "metadata.json"
+    }
+
+
+def test_shards_are_independent_of_the_worker(monkeypatch, tmp_path):
+    first = _sample_tables(monkeypatch, tmp_path, "1")
+    second = _sample_tables(monkeypatch, tmp_path, "2")
+    assert list(first) == list(second)
+    for table in first:
+        pd.testing.assert_frame_equal(first[table], second[table])
@@ -0,0 +1,51 @@
+import pytest
+
+import par_inference
+from config import CONFIG
+from model_loading import load_synthesizer
+from par_inference import disable_batched_sampling, enable_batched_sampling, fidelity_check
+
+
+@pytest.fixture(scope="module")
+def synthesizer():
+    return load_synthesizer(CONFIG["models"]["sequential"]["path"])
+
+
+def test_batched_sequences_follow_sdv_distribution(synthesizer):
+    results = fidelity_check(synthesizer, 200, seed=0, quantize=False).set_index("sampler")
+    sdv, batched = results.loc["sdv"], results.loc["batched"]
+    # SDV's own score against a second SDV sample is the noise floor at this size
+    assert batched["mean_tv_complement"] >= sdv["mean_tv_complement"] - 0.03
+    assert batched["min_tv_complement"] >= sdv["min_tv_complement"] - 0.1
+    assert batched["mean_length"] == pytest.approx(sdv["mean_length"], rel=0.25)
+
+
+def test_untested_sdv_keeps_sdv_sampler(synthesizer, monkeypatch):
+    monkeypatch.setitem(par_inference.TESTED_VERSIONS, "sdv", "0.0.")
+    monkeypatch.setitem(CONFIG["par_inference"], "enabled", True)
+    par_inference.untested_versions.cache_clear()
+    try:
+        with pytest.warns(RuntimeWarning, match="untested versions"):
+            enable_batched_sampling(synthesizer)
+        assert "_sample_from_par" not in vars(synthesizer)
+        assert par_inference.sampling_mode(synthesizer) == "sdv"
+    finally:
+        par_inference.untested_versions.cache_clear()
+        disable_batched_sampling(synthesizer)
+
+
+def test_missing_attribute_keeps_sdv_sampler(synthesizer, monkeypatch):
+    monkeypatch.delattr(synthesizer._model, "sample_size")
+    with pytest.warns(RuntimeWarning, match="sample_size"):
+        enable_batched_sampling(synthesizer)
+    assert "_sample_from_par" not in vars(synthesizer)
+    assert par_inference.sampling_mode(synthesizer) == "sdv"
+
+
+def test_sampling_mode_follows_the_synthesizer(synthesizer):
+    try:
+        enable_batched_sampling(synthesizer, quantize=True)
+        assert par_inference.sampling_mode(synthesizer) == "batched-int8"
+    finally:
+        disable_batched_sampling(synthesizer)
+    assert par_inference.sampling_mode(synthesizer) == "sdv"
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from config import CONFIG
+from parallel_sampling import ParallelSampler, _sample_chunk_in_worker, chunk_sizes
+
+SINGLE_MODEL = CONFIG["models"]["single"]["path"]
+
+
+def test_chunk_sizes():
+    assert chunk_sizes(10, 4) == [4, 4, 2]
+    assert chunk_sizes(8, 4) == [4, 4]
+    assert chunk_sizes(0, 4) == []
+
+
+def _run_chunk_in_worker(monkeypatch, hash_seed, chunk_seed):
+    # A spawned worker takes its hash seed from the environment it starts in
+    monkeypatch.setenv("PYTHONHASHSEED", hash_seed)
+    sampler = ParallelSampler(SINGLE_MODEL, is_sequential=False, max_workers=1)
+    try:
+        _, frame = sampler._get_executor().submit(
+            _sample_chunk_in_worker, 0, chunk_seed, False, num_sequences=50
+        ).result()
+    finally:
+        sampler.close()
+    return frame
+
+
+def test_chunk_is_independent_of_the_worker(monkeypatch):
+    first = _run_chunk_in_worker(monkeypatch, "1", chunk_seed=1234)
+    second = _run_chunk_in_worker(monkeypatch, "2", chunk_seed=1234)
+    # City is drawn by Faker, whose city list follows the hash seed unless it is ordered
+    assert first["City"].notna().any()
+    pd.testing.assert_frame_equal(first, second)
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from privacy import PrivacyIndex
+
+
+def _data():
+    return pd.DataFrame({
+        "ID": [1, 2, 3, 4],
+        "Sex": ["Male", "Female", "Male", "Female"],
+        "Age Range": pd.Categorical(
+            ["< 20 years", "20 - 25 years", "26 - 30 years", "20 - 25 years"],
+            categories=["< 20 years", "20 - 25 years", "26 - 30 years"], ordered=True,
+        ),
+        "English": [1.0, 3.0, 5.0, np.nan],
+    })
+
+
+def test_exact_copies_are_found_whatever_the_id_and_dtypes():
+    index = PrivacyIndex(_data())
+    synthetic = pd.DataFrame({
+        "ID": [10, 11, 12],
+        "Sex": ["Male", "Female", "Female"],
+        "Age Range": ["< 20 years", "20 - 25 years", "26 - 30 years"],
+        "English": [1, None, 5],
+    })
+    exact, distances = index.check(synthetic)
+    assert exact.tolist() == [True, True, False]
+    assert distances[0] == 0 and distances[1] == 0
+    assert distances[2] > 0
+
+
+def test_unknown_categories_are_not_copies():
+    index = PrivacyIndex(_data())
+    exact, distances = index.check(pd.DataFrame({
+        "ID": [1], "Sex": ["Other"], "Age Range": ["< 20 years"], "English": [1.0],
+    }))
+    assert not exact[0]
+    assert distances[0] > 0
@@ -0,0 +1,62 @@
+import os
+
+import pandas as pd
+
+from config import CONFIG
+from result_cache import ResultCache
+
+
+def _frames():
+    return [
+        pd.DataFrame({"ID": [1, 2], "Sex": ["Male", "Female"], "Score": pd.array([4, None], dtype="Int64")}),
+        pd.DataFrame({"ID": [3], "Sex": ["Female"], "Score": pd.array([2], dtype="Int64")}),
+    ]
+
+
+def test_key_depends_on_everything_that_shapes_the_result(monkeypatch):
+    key = ResultCache.key("abc", "sdv", "Sex", {"Male": 50, "Female": 50}, 100, 7)
+    assert key == ResultCache.key("abc", "sdv", "Sex", {"Female": 50.0, "Male": 50}, 100, 7)
+    assert key != ResultCache.key("abc", "sdv", "Sex", {"Male": 40, "Female": 60}, 100, 7)
+    assert key != ResultCache.key("abc", "sdv", "Sex", {"Male": 50, "Female": 50}, 100, 8)
+    assert key != ResultCache.key("abd", "sdv", "Sex", {"Male": 50, "Female": 50}, 100, 7)
+    assert key != ResultCache.key("abc", "batched", "Sex", {"Male": 50, "Female": 50}, 100, 7)
+    monkeypatch.setitem(CONFIG["parallel"], "chunk_size", CONFIG["parallel"]["chunk_size"] + 1)
+    assert key != ResultCache.key("abc", "sdv", "Sex", {"Male": 50, "Female": 50}, 100, 7)
+
+
+def test_store_then_get(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = ResultCache.key("abc", "sdv", None, None, 3, 1)
+    assert cache.get(key) is None
+    passed = list(cache.store(key, iter(_frames())))
+    assert len(passed) == 2
+    stored = cache.get(key)
+    assert len(stored) == 2
+    for frame, expected in zip(stored, _frames()):
+        pd.testing.assert_frame_equal(frame, expected)
+    assert [entry.name for entry in tmp_path.iterdir()] == [f"{key}.parquet"]
+
+
+def test_interrupted_store_is_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = ResultCache.key("abc", "sdv", None, None, 3, 1)
+    stored = cache.store(key, iter(_frames()))
+    next(stored)
+    stored.close()
+    assert cache.get(key) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_damaged_file_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    truncated = ResultCache.key("abc", "sdv", None, None, 3, 1)
+    untagged = ResultCache.key("abc", "sdv", None, None, 3, 2)
+    list(cache.store(truncated, iter(_frames())))
+    with open(cache.path(truncated), "r+b") as stored:
+        stored.truncate(100)
+    _frames()[0].to_parquet(cache.path(untagged))
+    for key in (truncated, untagged):
+        assert cache.get(key) is None
+        assert not os.path.exists(cache.path(key))
+    list(cache.store(truncated, iter(_frames())))
+    assert len(cache.get(truncated)) == 2
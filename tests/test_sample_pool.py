@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pandas as pd
+
+import sample_pool
+from sample_pool import UNBIASED, SamplePool
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_draw_goes_before_the_queued_refills(monkeypatch):
+    calls = []
+    refill_started, release_refill = threading.Event(), threading.Event()
+
+    def sample(key, count):
+        background = threading.current_thread().name == "sample-pool-refill"
+        calls.append(("refill" if background else "draw", key))
+        if background and len(calls) == 1:
+            refill_started.set()
+            release_refill.wait(10)
+        return pd.DataFrame({"ID": range(count)})
+
+    monkeypatch.setattr(sample_pool, "generate_data_no_bias",
+                        lambda synthesizer, count, is_sequential: sample(UNBIASED, count))
+    monkeypatch.setattr(sample_pool, "generate_data_quota", lambda synthesizer, **options: (
+        sample((options["column_name"], *options["category_percentages"]), options["num_sequences"]), None
+    ))
+    pool = SamplePool(object(), False, {"Sex": ["Male", "Female"]}, max_size=10, low_watermark=5, refill_batch=10)
+    try:
+        pool.warm_up()
+        assert refill_started.wait(10)
+        # Only the unbiased bucket is warmed up, a bias bucket once a request used it
+        assert pool._pending == {UNBIASED}
+        pool._schedule_refill(("Sex", "Female"))
+        drawn = []
+        draw = threading.Thread(target=lambda: drawn.append(pool.draw_biased("Sex", {"Male": 100}, 3)))
+        draw.start()
+        _wait_for(lambda: pool._sampling_lock._waiting_draws == 1)
+        release_refill.set()
+        draw.join(10)
+        assert len(drawn[0]) == 3
+        _wait_for(lambda: len(calls) == 4)
+        assert calls[:2] == [("refill", UNBIASED), ("draw", ("Sex", "Male"))]
+        assert sorted(calls[2:]) == [("refill", ("Sex", "Female")), ("refill", ("Sex", "Male"))]
+    finally:
+        release_refill.set()
+        pool.close()
@@ -0,0 +1,104 @@
+import http.client
+import io
+import json
+import threading
+
+import pandas as pd
+import pytest
+
+from export import export_frames
+from service import make_server, validate_request
+
+
+class FakeService:
+    """Writes fixed chunks like GenerationService.run, optionally failing after some of them."""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+
+    def run(self, request, path, privacy=None):
+        def frames():
+            for index in range(5):
+                if self.fail_after is not None and index == self.fail_after:
+                    raise RuntimeError("sampling failed")
+                yield pd.DataFrame({"ID": range(index * 20_000, (index + 1) * 20_000), "Sex": "Male"})
+
+        return export_frames(frames(), request["format"], path)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(service):
+        server = make_server(service, "127.0.0.1", 0, max_concurrent=1, max_queued=2)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=30)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _post(connection, body):
+    connection.request("POST", "/generate", json.dumps(body), {"Content-Type": "application/json"})
+    return connection.getresponse()
+
+
+@pytest.mark.parametrize("export_format", ["csv", "parquet"])
+def test_generate_streams_the_file(serve, export_format):
+    connection = serve(FakeService())
+    response = _post(connection, {"model": "single", "num_rows": 10, "format": export_format})
+    assert response.status == 200
+    assert response.getheader("Transfer-Encoding") == "chunked"
+    payload = io.BytesIO(response.read())
+    frame = pd.read_csv(payload) if export_format == "csv" else pd.read_parquet(payload)
+    assert frame["ID"].tolist() == list(range(100_000))
+    # The connection stays usable after a streamed response
+    connection.request("GET", "/health")
+    assert connection.getresponse().status == 200
+
+
+def test_failure_before_the_first_chunk_is_an_error(serve):
+    response = _post(serve(FakeService(fail_after=0)), {"model": "single", "num_rows": 10})
+    assert response.status == 500
+    assert "sampling failed" in json.loads(response.read())["error"]
+
+
+def test_failure_midway_truncates_the_download(serve):
+    response = _post(serve(FakeService(fail_after=3)), {"model": "single", "num_rows": 10})
+    assert response.status == 200
+    with pytest.raises(http.client.IncompleteRead):
+        response.read()
+
+
+@pytest.mark.parametrize("request_body", [
+    {"num_rows": True},
+    {"num_rows": 10, "seed": True},
+    {"num_rows": 10, "bias_column": "Sex", "category_percentages": {"Male": "50", "Female": "50"}},
+    {"num_rows": 10, "bias_column": "Sex", "category_percentages": {"Male": -50, "Female": 150}},
+    {"num_rows": 10, "bias_column": "Sex", "category_percentages": {"Male": True, "Female": 99}},
+    {"num_rows": 10, "bias_column": "Sex", "category_percentages": ["Male", "Female"]},
+])
+def test_invalid_requests(request_body):
+    with pytest.raises(ValueError):
+        validate_request(request_body)
+
+
+def test_invalid_request_is_a_bad_request(serve):
+    response = _post(serve(FakeService()), {
+        "model": "single", "num_rows": 10, "bias_column": "Sex", "category_percentages": {"Male": "50", "Female": "50"},
+    })
+    assert response.status == 400
+    assert "Male" in json.loads(response.read())["error"]
+
+
+def test_valid_request_gets_its_defaults():
+    request = validate_request(
+        {"num_rows": 10, "bias_column": "Sex", "category_percentages": {"Male": 30.5, "Female": 69.5}}
+    )
+    assert request["model"] == "single"
+    assert request["category_percentages"] == {"Male": 30.5, "Female": 69.5}
+    assert request["format"] == "csv"
@@ -0,0 +1,39 @@
+import tracing
+from config import CONFIG
+from tracing import read_spans, span, trace
+
+
+def _trace_file(monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setitem(CONFIG["tracing"], "path", str(path))
+    monkeypatch.setitem(CONFIG["tracing"], "enabled", True)
+    # Spans other tests left waiting
+    tracing.flush()
+    if path.exists():
+        path.unlink()
+    return path
+
+
+def test_spans_are_written_when_their_trace_ends(monkeypatch, tmp_path):
+    path = _trace_file(monkeypatch, tmp_path)
+    with trace("request", model="single", bias_column="Sex"):
+        with span("sample") as stage:
+            stage.rows = 10
+        with span("export"):
+            pass
+        assert not path.exists()
+    spans = read_spans(path)
+    assert [record["name"] for record in spans] == ["sample", "export", "request"]
+    assert {record["trace_id"] for record in spans} == {spans[-1]["trace_id"]}
+    assert spans[0]["model"] == "single" and spans[0]["bias"] == "Sex" and spans[0]["rows"] == 10
+
+
+def test_long_traces_are_written_in_batches(monkeypatch, tmp_path):
+    path = _trace_file(monkeypatch, tmp_path)
+    monkeypatch.setitem(CONFIG["tracing"], "flush_spans", 3)
+    with trace("request"):
+        for index in range(4):
+            with span("sample_chunk", chunk=index):
+                pass
+        assert [record["chunk"] for record in read_spans(path)] == [0, 1, 2]
+    assert len(read_spans(path)) == 5
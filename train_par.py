@@ -0,0 +1,423 @@
+"""
+Train the sequential (PAR) synthesizer of SDV_sequential.ipynb from the command line.
+
+The model is checkpointed every ``--checkpoint-every`` epochs, so an
+interrupted run continues with ``--resume`` instead of starting over.
+Training stops early once the loss has not improved by the share
+``--min-delta`` for ``--patience`` epochs, or when ``--max-minutes`` are
+used up (resume later to go on). Every epoch's loss and time go to
+training_log.jsonl. ``--batch-size`` takes an optimizer step per batch of
+candidates instead of one per epoch, which is what lets every candidate
+fit in memory (12263 of them train at about 40s per epoch on one thread).
+
+    python train_par.py --batch-size 256 --threads 4 --max-minutes 60  # every sequence
+    python train_par.py --num-sequences 400 --epochs 256               # the notebook's subsample
+    python train_par.py --resume SDV/outputs/2024-12-08_17-25-16       # continue an interrupted run
+
+The output directory gets what the notebook saved: synthesizer.pkl,
+metadata.json and parameters.txt, next to checkpoint.pt and the log.
+"""
+import argparse
+import copy
+import datetime
+import functools
+import hashlib
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import sdv.sequential.par
+import torch
+from deepecho.models.par import PARModel, PARNet
+from sdv.metadata import Metadata
+from sdv.sequential import PARSynthesizer
+
+from ingestion import load_dataset
+
+OUTPUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SDV", "outputs")
+CHECKPOINT_NAME = "checkpoint.pt"
+LOG_NAME = "training_log.jsonl"
+SETTINGS_NAME = "training_settings.json"
+
+# Not used as context, as in SDV_sequential.ipynb
+EXCLUDE_COLUMNS = [
+    "ID", "event_type__val", "event_feedback", "linked_search__key", "Overall", "Technical Skills",
+    "Standing/Position", "Comunication", "Maturity", "Dynamism", "Mobility", "English", "City", "Province", "Region",
+]
+
+
+def prepare_data(data):
+    """
+    Keep the first rows of a candidate whose context columns change between rows, as the notebook does.
+
+    Returns:
+    - pd.DataFrame: The training data, sorted by ID.
+    - list: The context columns.
+    """
+    context_columns = [column for column in data.columns if column not in EXCLUDE_COLUMNS]
+    # Unlike the notebook a value going missing counts as a change too, PAR rejects both
+    inconsistent_ids = data.groupby("ID")[context_columns].nunique(dropna=False).gt(1).any(axis=1)
+    inconsistent_ids = inconsistent_ids[inconsistent_ids].index
+    data = data.sort_values(by=["ID"]).reset_index(drop=True)
+    inconsistent_rows = data["ID"].isin(inconsistent_ids)
+    data = data[~inconsistent_rows | (data["ID"] != data["ID"].shift())]
+    return data.reset_index(drop=True), context_columns
+
+
+def build_metadata(data, sequential=True):
+    """The notebook's metadata, ``sequential=False`` leaves out the sequence key for one row per candidate."""
+    metadata = Metadata.detect_from_dataframe(data)
+    # Not the notebook's \d{1,5}: SDV generates "0" and "00" from it, the same int ID for two sampled candidates
+    metadata.update_column(column_name="ID", sdtype="id", regex_format=r"[1-9]\d{0,4}")
+    for column in ("Candidate State", "Year of insertion", "Year of Recruitment"):
+        if column in data.columns:
+            metadata.update_column(column_name=column, sdtype="categorical")
+    if sequential:
+        metadata.set_sequence_key(column_name="ID")
+    return metadata
+
+
+def data_fingerprint(data, settings):
+    """Hash of the training data and the settings that shape the model, a checkpoint only resumes the same."""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def set_threads(intra_op, inter_op):
+    """Set torch's CPU thread pools, inter-op only works before torch runs anything in parallel."""
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            warnings.warn("torch already started its inter-op threads, --interop-threads is ignored")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+class TrainingLog:
+    """Append-only JSON lines, one per epoch or event."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, event, **fields):
+        record = {"event": event, "time": datetime.datetime.now().isoformat(timespec="seconds"), **fields}
+        with open(self.path, "a") as log:
+            log.write(json.dumps(record) + "\n")
+
+
+class EarlyStopping:
+    """
+    Stop once the loss has not improved by a share ``min_delta`` for ``patience`` epochs.
+
+    The improvement is relative, as PAR's loss shrinks with the square of the number of sequences.
+
+    The weights of the best epoch are kept, to restore them when stopping.
+    """
+
+    def __init__(self, patience, min_delta):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_loss = float("inf")
+        self.best_epoch = None
+        self.best_state = None
+        self.stale_epochs = 0
+
+    def update(self, epoch, loss, model):
+        """Returns True when training should stop."""
+        if loss < self.best_loss * (1 - self.min_delta):
+            self.best_loss = loss
+            self.best_epoch = epoch
+            self.best_state = copy.deepcopy(model.state_dict())
+            self.stale_epochs = 0
+        else:
+            self.stale_epochs += 1
+        return bool(self.patience) and self.stale_epochs >= self.patience
+
+    def state_dict(self):
+        return {key: getattr(self, key) for key in ("best_loss", "best_epoch", "best_state", "stale_epochs")}
+
+    def load_state_dict(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+class CheckpointedPARModel(PARModel):
+    """
+    deepecho's PARModel with checkpoints, resuming, early stopping and an epoch log.
+
+    ``fit_sequences`` trains the same network with the same loss as
+    PARModel.fit_sequences. Besides the epoch loop, it can take an optimizer
+    step per batch of sequences, building the dense tensors of one batch at
+    a time, which is what makes training on every candidate fit in memory.
+
+    Parameters:
+    - output_dir (str): Where checkpoint.pt and training_log.jsonl go.
+    - fingerprint (str): Identifies the data and settings, see ``data_fingerprint``.
+    - batch_size (int or None): Sequences per optimizer step, None trains on all at once like PARModel.
+    - checkpoint_every (int): Epochs between checkpoints.
+    - patience (int): Epochs without improvement before stopping, 0 never stops early.
+    - min_delta (float): Relative loss decrease that counts as an improvement.
+    - max_seconds (float or None): Training time after which the run checkpoints and stops.
+    - resume (bool): Continue from the checkpoint in ``output_dir``.
+    """
+
+    def __init__(self, output_dir, fingerprint, batch_size=None, checkpoint_every=10, patience=20, min_delta=1e-3,
+                 max_seconds=None, resume=False, **par_kwargs):
+        super().__init__(**par_kwargs)
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.fingerprint = fingerprint
+        self.checkpoint_every = checkpoint_every
+        self.early_stopping = EarlyStopping(patience, min_delta)
+        self.max_seconds = max_seconds
+        self.resume = resume
+        self.log = TrainingLog(os.path.join(output_dir, LOG_NAME))
+        self.stop_reason = None
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.output_dir, CHECKPOINT_NAME)
+
+    def save_checkpoint(self, epoch, optimizer, losses):
+        checkpoint = {
+            "fingerprint": self.fingerprint,
+            "epoch": epoch,
+            "model": self._model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "losses": losses,
+            "early_stopping": self.early_stopping.state_dict(),
+        }
+        # Written next to the final name first, a crash while saving keeps the previous checkpoint
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, self.checkpoint_path)
+        self.log.write("checkpoint", epoch=epoch)
+
+    def load_checkpoint(self, optimizer):
+        checkpoint = torch.load(self.checkpoint_path, map_location=self.device, weights_only=False)
+        if checkpoint["fingerprint"] != self.fingerprint:
+            raise ValueError(
+                f"{self.checkpoint_path} was trained on other data or settings, start a new run instead"
+            )
+        self._model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        self.early_stopping.load_state_dict(checkpoint["early_stopping"])
+        self.log.write("resume", epoch=checkpoint["epoch"])
+        return checkpoint["epoch"] + 1, checkpoint["losses"]
+
+    def _idx_map(self, x, t):
+        # PARModel._idx_map gives every NaN of a categorical column its own one-hot index, as NaN != NaN
+        # in a set. They all share the None index in the end, so only the first is kept here.
+        x = [
+            [None if pd.isna(value) else value for value in values] if kind in ("categorical", "ordinal") else values
+            for values, kind in zip(x, t)
+        ]
+        return super()._idx_map(x, t)
+
+    def _batches(self, lengths, epoch):
+        """Sequence positions per batch, shuffled per epoch, with sequences of a similar length together."""
+        if not self.batch_size or self.batch_size >= len(lengths):
+            return [np.arange(len(lengths))]
+        rng = np.random.default_rng(epoch)
+        order = rng.permutation(len(lengths))
+        # Short and long sequences in separate batches keep the padding small
+        order = order[np.argsort(lengths[order], kind="stable")]
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        return [batches[index] for index in rng.permutation(len(batches))]
+
+    def _batch_tensors(self, X, C, batch):
+        x = torch.nn.utils.rnn.pack_sequence([X[index].to_dense() for index in batch], enforce_sorted=False)
+        c = torch.stack([C[index].to_dense() for index in batch], dim=0).to(self.device) if self._ctx_dims else []
+        return x.to(self.device), c
+
+    def fit_sequences(self, sequences, context_types, data_types):
+        self._build(sequences, context_types, data_types)
+        # Mostly one-hot columns, dense tensors of every candidate would not fit in memory
+        X = [self._data_to_tensor(sequence["data"]).cpu().to_sparse() for sequence in sequences]
+        C = [self._context_to_tensor(sequence["context"]).cpu().to_sparse() for sequence in sequences]
+        lengths = np.array([x.shape[0] for x in X])
+
+        self._model = PARNet(self._data_dims, self._ctx_dims).to(self.device)
+        optimizer = torch.optim.Adam(self._model.parameters(), lr=1e-3)
+        start_epoch, losses = 0, []
+        if self.resume and os.path.exists(self.checkpoint_path):
+            start_epoch, losses = self.load_checkpoint(optimizer)
+        else:
+            self.log.write("start", epochs=self.epochs, sequences=len(sequences), batch_size=self.batch_size,
+                           threads=torch.get_num_threads(), interop_threads=torch.get_num_interop_threads())
+
+        started = time.perf_counter()
+        epoch = start_epoch - 1
+        for epoch in range(start_epoch, self.epochs):
+            epoch_start = time.perf_counter()
+            log_likelihood = 0.0
+            for batch in self._batches(lengths, epoch):
+                x, c = self._batch_tensors(X, C, batch)
+                Y = self._model(x, c)
+                X_padded, seq_len = torch.nn.utils.rnn.pad_packed_sequence(x)
+                Y_padded, _ = torch.nn.utils.rnn.pad_packed_sequence(Y)
+
+                optimizer.zero_grad()
+                loss = self._compute_loss(X_padded[1:, :, :], Y_padded[:-1, :, :], seq_len)
+                loss.backward()
+                optimizer.step()
+                # _compute_loss divides by the squared batch size, undone to add up the batches
+                log_likelihood += loss.item() * len(batch) ** 2
+
+            # The same scale as PARModel's full batch loss
+            loss_value = log_likelihood / len(sequences) ** 2
+            losses.append(loss_value)
+            # The loss is of the weights before this epoch's step, as in PARModel
+            stop = self.early_stopping.update(epoch, loss_value, self._model)
+            self.log.write("epoch", epoch=epoch, loss=loss_value, seconds=time.perf_counter() - epoch_start,
+                           best_loss=self.early_stopping.best_loss)
+            if self.verbose:
+                print(f"epoch {epoch}: loss {loss_value:.4f} ({time.perf_counter() - epoch_start:.2f}s)")
+
+            if stop:
+                self.stop_reason = "early_stopping"
+                break
+            if self.max_seconds is not None and time.perf_counter() - started > self.max_seconds:
+                self.stop_reason = "time_budget"
+                break
+            if (epoch + 1) % self.checkpoint_every == 0:
+                self.save_checkpoint(epoch, optimizer, losses)
+
+        self.save_checkpoint(epoch, optimizer, losses)
+        if self.stop_reason == "early_stopping" and self.early_stopping.best_state is not None:
+            self._model.load_state_dict(self.early_stopping.best_state)
+        self.log.write("end", epoch=epoch, reason=self.stop_reason or "epochs",
+                       best_epoch=self.early_stopping.best_epoch, best_loss=self.early_stopping.best_loss)
+        self.loss_values = pd.DataFrame({"Epoch": range(len(losses)), "Loss": losses})
+
+
+def train(data, output_dir, epochs=256, num_sequences=None, batch_size=None, checkpoint_every=10, patience=20,
+          min_delta=1e-3, max_seconds=None, resume=False, cuda=False, verbose=True, seed=0, context_columns=None):
+    """
+    Fit a PARSynthesizer like SDV_sequential.ipynb, with checkpoints in ``output_dir``.
+
+    Parameters:
+    - data (pd.DataFrame): The cleaned dataset, see ingestion.load_dataset.
+    - num_sequences (int or None): Train on this many random candidates, None trains on all.
+    - seed (int): Seed of the subsample.
+    - context_columns (list or None): PAR's context columns, defaults to every column but EXCLUDE_COLUMNS.
+    The other parameters are those of CheckpointedPARModel.
+
+    Returns:
+    - PARSynthesizer: The fitted synthesizer.
+    - str or None: Why training stopped before ``epochs`` ("early_stopping" or "time_budget").
+    """
+    data, all_context_columns = prepare_data(data)
+    context_columns = all_context_columns if context_columns is None else list(context_columns)
+    metadata = build_metadata(data)
+    if num_sequences:
+        # Like get_random_sequence_subset, but seeded and counting distinct candidates rather than rows
+        ids = np.random.default_rng(seed).permutation(data["ID"].unique())[:num_sequences]
+        data = data[data["ID"].isin(ids)].reset_index(drop=True)
+
+    synthesizer = PARSynthesizer(
+        metadata, epochs=epochs, locales="it_IT", context_columns=context_columns, verbose=verbose, cuda=cuda,
+    )
+    settings = {"num_sequences": num_sequences, "seed": seed, "context_columns": context_columns}
+    model_factory = functools.partial(
+        CheckpointedPARModel,
+        output_dir=output_dir,
+        fingerprint=data_fingerprint(data, settings),
+        batch_size=batch_size,
+        checkpoint_every=checkpoint_every,
+        patience=patience,
+        min_delta=min_delta,
+        max_seconds=max_seconds,
+        resume=resume,
+    )
+    # PARSynthesizer creates its PARModel inside fit
+    sdv.sequential.par.PARModel = model_factory
+    try:
+        synthesizer.fit(data)
+    finally:
+        sdv.sequential.par.PARModel = PARModel
+
+    model = synthesizer._model
+    stop_reason = model.stop_reason
+    # Pickle as a plain PARModel, so that loading the synthesizer does not need this script
+    for attribute in ("output_dir", "fingerprint", "checkpoint_every", "early_stopping", "max_seconds", "resume",
+                      "log", "stop_reason"):
+        delattr(model, attribute)
+    model.__class__ = PARModel
+    return synthesizer, stop_reason
+
+
+def save_outputs(synthesizer, output_dir):
+    """What the notebook saved after training."""
+    synthesizer.save(filepath=os.path.join(output_dir, "synthesizer.pkl"))
+    synthesizer.metadata.save_to_json(filepath=os.path.join(output_dir, "metadata.json"))
+    with open(os.path.join(output_dir, "parameters.txt"), "w") as parameters:
+        parameters.write(str(synthesizer.get_parameters()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resume", metavar="OUTPUT_DIR", help="Continue the run in this directory")
+    parser.add_argument("--output-dir", help="Directory of a new run, defaults to SDV/outputs/<timestamp>")
+    parser.add_argument("--epochs", type=int, default=256)
+    parser.add_argument("--num-sequences", type=int, help="Train on a random subset of the candidates")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the --num-sequences subset")
+    parser.add_argument("--batch-size", type=int, help="Sequences per optimizer step, all of them by default")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="Epochs between checkpoints")
+    parser.add_argument("--patience", type=int, default=20, help="Epochs without improvement before stopping, 0 never")
+    parser.add_argument("--min-delta", type=float, default=1e-3, help="Relative loss decrease counted as an improvement")
+    parser.add_argument("--max-minutes", type=float, help="Checkpoint and stop after this much training time")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--interop-threads", type=int, help="torch inter-op threads")
+    parser.add_argument("--cuda", action="store_true")
+    parser.add_argument("--quiet", action="store_true", help="Do not print every epoch")
+    args = parser.parse_args(argv)
+
+    threads, interop_threads = set_threads(args.threads, args.interop_threads)
+    settings = vars(args)
+    if args.resume:
+        output_dir = args.resume
+        # The run continues with the settings it was started with
+        with open(os.path.join(output_dir, SETTINGS_NAME)) as settings_file:
+            settings = {**json.load(settings_file), "resume": output_dir}
+    else:
+        output_dir = args.output_dir or os.path.join(OUTPUTS_DIR, datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, SETTINGS_NAME), "w") as settings_file:
+            json.dump(settings, settings_file, indent=2)
+    print(f"Training in {output_dir} with {threads} intra-op and {interop_threads} inter-op threads")
+
+    # PAR warns about an empty concat on every call
+    warnings.filterwarnings("ignore", category=FutureWarning)
+    start = time.perf_counter()
+    synthesizer, stop_reason = train(
+        load_dataset(),
+        output_dir,
+        epochs=settings["epochs"],
+        num_sequences=settings["num_sequences"],
+        batch_size=settings["batch_size"],
+        checkpoint_every=settings["checkpoint_every"],
+        patience=settings["patience"],
+        min_delta=settings["min_delta"],
+        max_seconds=args.max_minutes * 60 if args.max_minutes else None,
+        resume=bool(args.resume),
+        cuda=settings["cuda"],
+        verbose=not args.quiet,
+        seed=settings["seed"],
+    )
+    print(f"Trained in {time.perf_counter() - start:.1f}s, stopped by {stop_reason or 'the epoch limit'}")
+    if stop_reason == "time_budget":
+        print(f"Continue with: python train_par.py --resume {output_dir}")
+        return
+    save_outputs(synthesizer, output_dir)
+    print(f"Saved {os.path.join(output_dir, 'synthesizer.pkl')}")
+
+
+if __name__ == "__main__":
+    main()
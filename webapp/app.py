@@ -1,9 +1,8 @@
 import streamlit as st
 import pandas as pd
-from sdv.sequential import PARSynthesizer
-from sdv.single_table import GaussianCopulaSynthesizer
 from io import BytesIO
 from sdv.sampling import Condition
+from model_loading import get_synthesizer
 
 
  #Functions used in webapp for:
@@ -20,7 +19,7 @@ def sequencefraq(var, sequences):
 
 @st.cache_data
 def generate_data_no_bias(sequences=150):
-    synthetic_data = synthesizer_seq.sample(num_sequences=sequences,sequence_length=None)
+    synthetic_data = get_synthesizer(SYNTHESIZER_SEQ_PATH).sample(num_sequences=sequences,sequence_length=None)
     return synthetic_data
 
 @st.cache_data
@@ -29,7 +28,7 @@ def generate_data_sex(male=50, female=50, sequences=150):
     femaleseq = sequencefraq(female, sequences)
     scenario_context = pd.DataFrame(data={
     'Sex': ['Male']*maleseq + ['Female']*femaleseq})
-    biased_sample = synthesizer_seq.sample_sequential_columns(context_columns=scenario_context)    
+    biased_sample = get_synthesizer(SYNTHESIZER_SEQ_PATH).sample_sequential_columns(context_columns=scenario_context)    
     return biased_sample
 
 @st.cache_data
@@ -50,7 +49,7 @@ def generate_data_age_range(age1=9, age2=20, age3=46, age4=12, age5=5, age6=3, a
                     ['40 - 45 years'] * age6seq +
                     ['> 45 years']    * age7seq
                     })
-    biased_sample = synthesizer_seq.sample_sequential_columns(context_columns=scenario_context)    
+    biased_sample = get_synthesizer(SYNTHESIZER_SEQ_PATH).sample_sequential_columns(context_columns=scenario_context)    
     return biased_sample
 
 @st.cache_data
@@ -71,7 +70,7 @@ def generate_data_study_title(study1=0, study2=4, study3=39, study4=53, study5=2
                     ['Doctorate']                * study6seq +
                     ['Professional qualification']    * study7seq
                     })
-    biased_sample = synthesizer_seq.sample_sequential_columns(context_columns=scenario_context)    
+    biased_sample = get_synthesizer(SYNTHESIZER_SEQ_PATH).sample_sequential_columns(context_columns=scenario_context)    
     return biased_sample
 
 @st.cache_data
@@ -105,7 +104,7 @@ def generate_data_single(_custom_synthesizer, column_name, category_percentages,
 
 @st.cache_data
 def generate_unbiased_single(num_rows=150):
-    return synthesizer_sin.sample(num_rows=num_rows)
+    return get_synthesizer(SYNTHESIZER_SIN_PATH).sample(num_rows=num_rows)
 
 def to_excel(df):
     output = BytesIO()
@@ -117,15 +116,9 @@ def to_excel(df):
 
 
 
-#Load the SDV synthesizer (single table)
-synthesizer_sin = PARSynthesizer.load(
-    filepath='webapp/synthesizer_sin.pkl'
-)
-
-#Load the SDV synthesizer (sequential)
-synthesizer_seq = PARSynthesizer.load(
-    filepath='webapp/synthesizer_seq_1000_nocuda.pkl'
-)
+#SDV synthesizers, loaded on first use and shared between reruns (see model_loading.py)
+SYNTHESIZER_SIN_PATH = 'webapp/synthesizer_sin.pkl'
+SYNTHESIZER_SEQ_PATH = 'webapp/synthesizer_seq_1000_nocuda.pkl'
 
 #Start of interface
 
@@ -180,7 +173,7 @@ if model == "Single (only candidates)":
                 column_name = 'Sex'
                 category_percentages = {'Male': male, 'Female': female}
                 st.write("Data is being Generated")
-                df = generate_data_single(synthesizer_sin, column_name, category_percentages, num_rows)
+                df = generate_data_single(get_synthesizer(SYNTHESIZER_SIN_PATH), column_name, category_percentages, num_rows)
                 df_xlsx = to_excel(df)
                 st.download_button(
                 label="Download data as Excel file",
@@ -225,7 +218,7 @@ if model == "Single (only candidates)":
                 column_name = 'Age Range'
                 category_percentages = {'< 20 years': age1, '20 - 25 years': age2,'26 - 30 years': age3, '31 - 35 years': age4,'36 - 40 years': age5, '40 - 45 years': age6,'> 45 years':age7}
                 st.write("Data is being Generated")
-                df = generate_data_single(synthesizer_sin, column_name, category_percentages, num_rows)
+                df = generate_data_single(get_synthesizer(SYNTHESIZER_SIN_PATH), column_name, category_percentages, num_rows)
                 df_xlsx = to_excel(df)
                 st.download_button(
                 label="Download data as Excel file",
@@ -270,7 +263,7 @@ if model == "Single (only candidates)":
                 column_name = 'Study Title'
                 category_percentages = {'Middle school diploma': study1, 'High school graduation': study2,'Three-year degree': study3, 'Five-year degree': study4,"master's degree": study5, 'Doctorate': study6,'Professional qualification':study7}
                 st.write("Data is being Generated")
-                df = generate_data_single(synthesizer_sin, column_name, category_percentages, num_rows)
+                df = generate_data_single(get_synthesizer(SYNTHESIZER_SIN_PATH), column_name, category_percentages, num_rows)
                 df_xlsx = to_excel(df)
                 st.download_button(
                 label="Download data as Excel file",
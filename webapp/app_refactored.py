@@ -1,43 +1,48 @@
+import os
+import shutil
+import tempfile
+
 import streamlit as st
 import pandas as pd
-from sdv.sequential import PARSynthesizer
-from sdv.sampling import Condition
-from io import BytesIO
-from sdmetrics.visualization import get_column_plot
-
-# Configurations
-CONFIG = {
-    "bias_options": ["None", "Sex", "Age Range", "Study Title"],
-    "defaults": {
-        "Sex": {"Male": 50, "Female": 50},
-        "Age Range": {
-            "< 20 years": 8,
-            "20 - 25 years": 27,
-            "26 - 30 years": 46,
-            "31 - 35 years": 9,
-            "36 - 40 years": 4,
-            "40 - 45 years": 2,
-            "> 45 years": 4,
-        },
-        "Study Title": {
-            "Middle school diploma": 0,
-            "High school graduation": 4,
-            "Three-year degree": 39,
-            "Five-year degree": 53,
-            "master's degree": 2,
-            "Doctorate": 1,
-            "Professional qualification": 1,
-        },
-    },
-}
 
-# Load the real data
-@st.cache_data
-def load_real_data(filepath):
-    return pd.read_csv(filepath)
+from config import CONFIG
+from export import EXPORT_FORMATS, export_frames
+from fidelity import FidelityAccumulator, get_real_histograms
+from geo import GeoAccumulator, RealLocations, get_region_map, load_regions
+from generation import ID_COLUMN, candidate_values, find_shortfalls
+from model_loading import file_signature, get_synthesizer
+from multitable import SHARD_FORMATS, ShardedTableSampler
+from par_inference import sampling_mode
+from parallel_sampling import ParallelSampler
+from privacy import PrivacyAccumulator
+from reference_data import get_frequency_plot, load_reference_data
+from registry import get_registry
+from result_cache import get_result_cache, model_hash
+from sample_pool import SamplePool
+from tracing import get_metrics, recent_spans, span, trace, traced_frames
+
+# Load the real data once per process, every session reads the same frame and frequencies
+@st.cache_resource
+def get_reference_data():
+    return load_reference_data()
+
+reference_data = get_reference_data()
+
+
+@st.cache_resource
+def get_fidelity_histograms():
+    return get_real_histograms(reference_data.data)
+
 
-real_data_sin = load_real_data("webapp/real_data_sin.csv")
-real_data_seq = load_real_data("webapp/real_data_seq.csv")
+# The simplified borders and the real counts per region, read and counted once per process, see geo.py
+@st.cache_resource
+def get_regions():
+    return load_regions()
+
+
+@st.cache_resource
+def get_real_locations():
+    return RealLocations(reference_data.data)
 
 # Generalized functions
 def generate_bias_inputs(category_names, default_values):
@@ -49,70 +54,257 @@ def generate_bias_inputs(category_names, default_values):
     return percentages
 
 
-@st.cache_data
-def create_context(column_name, category_percentages, num_rows):
-    rows = []
-    for category, percentage in category_percentages.items():
-        rows.extend([category] * int((percentage / 100) * num_rows))
-    return pd.DataFrame({column_name: rows})
+# Pools and samplers of the recently used models only, like the loaded models themselves
+@st.cache_resource(max_entries=CONFIG["registry"]["max_loaded_models"], on_release=lambda pool: pool.close())
+def get_sample_pool(model, signature, is_sequential):
+    # One pool per model, shared by every session. The file signature is part
+    # of the cache key so a replaced model gets a new pool. The pool gets the
+    # synthesizer through the registry, which may drop it from memory meanwhile.
+    pool = SamplePool(
+        lambda: get_registry().get_synthesizer(model),
+        is_sequential=is_sequential,
+        bias_categories={
+            column: list(categories) for column, categories in CONFIG["defaults"].items()
+        },
+        **CONFIG["sample_pool"],
+    )
+    pool.warm_up()
+    return pool
 
 
-@st.cache_data
-def generate_data_generalized(_synthesizer, column_name, category_percentages, num_sequences, is_sequential=False):
-    if is_sequential:
-        context_df = create_context(column_name, category_percentages, num_sequences)
-        generated_data = _synthesizer.sample_sequential_columns(context_columns=context_df)
-    else:
-        conditions = [
-            Condition(
-                num_rows=int((percentage / 100) * num_sequences),
-                column_values={column_name: category},
+@st.cache_resource(max_entries=CONFIG["registry"]["max_loaded_models"], on_release=lambda sampler: sampler.close())
+def get_parallel_sampler(synthesizer_path, signature, is_sequential):
+    return ParallelSampler(
+        synthesizer_path,
+        is_sequential=is_sequential,
+        max_workers=CONFIG["parallel"]["max_workers"],
+        chunk_size=CONFIG["parallel"]["chunk_size"],
+    )
+
+
+def show_progress(progress_bar):
+    def update(done, total):
+        progress_bar.progress(done / total, text=f"Sampled {done} of {total} chunks")
+    return update
+
+
+def generate_data(sample_pool, synthesizer_path, is_sequential, num_sequences, column_name=None,
+                  category_percentages=None, seed=None):
+    """Return the generated data as an iterable of DataFrame chunks."""
+    # Seeded requests are read from the result cache once generated,
+    # see result_cache.py
+    if seed is not None:
+        cache = get_result_cache()
+        key = cache.key(
+            model_hash(synthesizer_path), sampling_mode(get_synthesizer(synthesizer_path)),
+            column_name, category_percentages, num_sequences, seed,
+        )
+        frames = cache.get(key)
+        if frames is not None:
+            return frames
+    # Large and seeded requests are spread over all cores and streamed chunk by chunk,
+    # everything else is served from the pool
+    if seed is not None or num_sequences >= CONFIG["parallel"]["min_sequences"]:
+        sampler = get_parallel_sampler(synthesizer_path, file_signature(synthesizer_path), is_sequential)
+        progress = show_progress(st.progress(0.0))
+        if column_name is None:
+            frames = sampler.iter_unbiased(num_sequences, seed=seed, progress=progress)
+        else:
+            frames = sampler.iter_biased(column_name, category_percentages, num_sequences, seed=seed,
+                                         progress=progress)
+        return frames if seed is None else cache.store(key, frames)
+    with span("pool_draw") as stage:
+        if column_name is None:
+            frame = sample_pool.draw_unbiased(num_sequences)
+        else:
+            frame = sample_pool.draw_biased(column_name, category_percentages, num_sequences)
+        stage.rows = len(frame)
+    return [frame]
+
+
+def traced_generation(frames, fidelity, privacy, geo):
+    # Sampling and every report's counts each get their own span, the export's is what is left
+    frames = traced_frames(measure(traced_frames(frames, "sample"), fidelity), "fidelity_update")
+    frames = traced_frames(measure(frames, privacy), "privacy_update")
+    return traced_frames(measure(frames, geo), "geo_update")
+
+
+def keep_column(frames, column_name, kept):
+    # Pass the chunks through, holding on to a single column (and the IDs) for the comparison plot
+    for frame in frames:
+        kept.append(frame[[column for column in (ID_COLUMN, column_name) if column in frame.columns]])
+        yield frame
+
+
+def measure(frames, accumulator):
+    # Pass the chunks through, counting them for the fidelity, privacy or geography report
+    for frame in frames:
+        accumulator.update(frame)
+        yield frame
+
+
+def show_fidelity(accumulator):
+    with span("fidelity_report"):
+        column_scores, pair_scores = accumulator.report()
+    st.subheader("Fidelity to the Real Data")
+    shapes, trends = st.columns(2)
+    shapes.metric("Column shapes (1 - TVD)", f"{column_scores['tv_complement'].mean():.1%}")
+    trends.metric("Column pair trends", f"{pair_scores['contingency_similarity'].mean():.1%}")
+    with st.expander("Scores per column"):
+        st.dataframe(column_scores.sort_values("tv_complement"), hide_index=True)
+    with st.expander("Least similar column pairs"):
+        st.dataframe(pair_scores.nsmallest(20, "contingency_similarity"), hide_index=True)
+
+
+def show_privacy(accumulator):
+    with span("privacy_report"):
+        report = accumulator.report()
+    if not report["rows"]:
+        return
+    st.subheader("Privacy")
+    exact, near, distance = st.columns(3)
+    exact.metric("Copies of real candidates", f"{report['exact_matches']} ({report['exact_match_share']:.1%})")
+    near.metric(
+        "Near copies", f"{report['near_copy_share']:.1%}",
+        help=f"Candidates as close to a real one as the closest {CONFIG['privacy']['near_copy_quantile']:.0%} of "
+             f"the real candidates are to each other. {report['real_near_copy_share']:.1%} of the real candidates are.",
+    )
+    distance.metric("Median distance to closest real candidate", f"{report['median_dcr']:.3f}")
+    if report["exact_matches"]:
+        st.warning(f"{report['exact_matches']} generated candidates equal a real candidate in every column.")
+
+
+def show_geography(accumulator):
+    with span("geo_report"):
+        regions = accumulator.report()
+    if not regions["synthetic"].sum():
+        return
+    st.subheader("Where the Candidates Live")
+    with span("geo_map"):
+        fig = get_region_map(get_regions(), regions)
+    st.plotly_chart(fig, width="stretch")
+    columns = {"real_share": "Real", "synthetic_share": "Synthetic", "difference": "Difference"}
+    with st.expander("Shares per region"):
+        st.dataframe(regions.rename(columns=columns), hide_index=True)
+    with st.expander("Provinces furthest from the real data"):
+        st.dataframe(accumulator.report(by="Province").head(20).rename(columns=columns), hide_index=True)
+
+
+def get_export_format_input():
+    return st.selectbox(
+        "Select the file format",
+        list(EXPORT_FORMATS),
+        format_func=lambda export_format: EXPORT_FORMATS[export_format]["label"],
+    )
+
+
+def offer_download(frames, export_format):
+    file_format = EXPORT_FORMATS[export_format]
+    file_name = f"synthetic_data.{file_format['extension']}"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = export_frames(frames, export_format, os.path.join(tmp_dir, file_name))
+        with open(path, "rb") as exported:
+            st.download_button(
+                label=f"Download data as {file_format['label']} file",
+                data=exported,
+                file_name=file_name,
+                mime=file_format["mime"],
             )
-            for category, percentage in category_percentages.items()
-        ]
-        generated_data = _synthesizer.sample_from_conditions(conditions=conditions)
-    return generated_data
 
 
-@st.cache_data
-def generate_data_no_bias(_synthesizer, num_sequences, is_sequential=False):
-    if is_sequential:
-        return _synthesizer.sample(num_sequences=num_sequences)
-    return _synthesizer.sample(num_rows=num_sequences)
+def offer_tables_download(synthesizer_path, num_candidates, export_format, seed):
+    # The shards are written to disk by the workers and zipped, the tables are never held in memory
+    sampler = ShardedTableSampler(
+        synthesizer_path,
+        max_workers=CONFIG["multitable"]["max_workers"],
+        shard_size=CONFIG["multitable"]["shard_size"],
+    )
+    progress_bar = st.progress(0.0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        totals = sampler.sample_to_dir(
+            num_candidates, os.path.join(tmp_dir, "tables"), export_format, seed=seed,
+            progress=lambda done, total: progress_bar.progress(done / total, text=f"Wrote {done} of {total} shards"),
+        )
+        archive = shutil.make_archive(os.path.join(tmp_dir, "synthetic_tables"), "zip", os.path.join(tmp_dir, "tables"))
+        st.write(", ".join(f"{count} rows in {table}" for table, count in totals.items()))
+        with open(archive, "rb") as exported:
+            st.download_button(
+                label="Download the tables as a ZIP file",
+                data=exported,
+                file_name="synthetic_tables.zip",
+                mime="application/zip",
+            )
+
+
+def show_admin_sidebar():
+    # Latency of the request stages in this process, see tracing.py
+    if st.query_params.get("admin") != "1":
+        return
+    st.sidebar.header("Request Metrics")
+    metrics = get_metrics().snapshot()
+    if not metrics:
+        st.sidebar.write("No requests traced yet.")
+        return
+    st.sidebar.dataframe(pd.DataFrame(metrics), hide_index=True)
+    spans = recent_spans()
+    last_trace = [record for record in spans if record["trace_id"] == spans[-1]["trace_id"]]
+    st.sidebar.subheader("Last Request")
+    st.sidebar.dataframe(
+        pd.DataFrame(last_trace)[["name", "seconds", "self_seconds", "rows", "rows_per_second", "rss_delta_mb"]],
+        hide_index=True,
+    )
 
 
 def get_dataset_size_input(label, default_value=150):
     return st.number_input(label, value=default_value, placeholder="Type a number...")
 
 
-def to_excel(df):
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine="xlsxwriter")
-    df.to_excel(writer, index=False)
-    writer.close()
-    processed_data = output.getvalue()
-    return processed_data
-
+def get_seed_input():
+    # Empty means fresh data on every press, a seed gives the same data every time
+    return st.number_input("Seed (optional)", value=None, min_value=0, step=1,
+                           placeholder="Leave empty for random data")
 
-# Load the synthesizers
-synthesizer_sin = PARSynthesizer.load(filepath="webapp/synthesizer_sin.pkl")
-synthesizer_seq = PARSynthesizer.load(filepath="webapp/synthesizer_seq_1000_nocuda.pkl")
 
 # Streamlit UI
 st.title("Synthetic Data Generator")
 st.write(
     "Select a type of model, the variable to create a bias for (optional), "
-    "pick a number of candidates or rows to be generated, and get an Excel file at the press of a button."
+    "pick a number of candidates or rows to be generated, and get an Excel, CSV or Parquet file at the press of a button."
 )
 
+def format_model(entry):
+    quality = entry.get("quality", {}).get("fidelity_tv_complement")
+    return entry["label"] if quality is None else f"{entry['label']} (column shapes {quality:.0%})"
+
+
 st.subheader("Model Selection")
+# Every model of the manifest, see registry.py
+models = {**get_registry().models(), **get_registry().multi_table_models()}
 model = st.selectbox(
     "Select the type of data synthesizer",
-    ["Single (only candidates)", "Sequential (candidates and events)"],
+    list(models),
+    format_func=lambda name: format_model(models[name]),
 )
 
-is_sequential = model == "Sequential (candidates and events)"
-synthesizer = synthesizer_seq if is_sequential else synthesizer_sin
+if models[model].get("multi_table"):
+    # Related tables (candidates and their events) linked by their keys, no bias options
+    st.subheader("Output Size")
+    num_sequences = get_dataset_size_input("Enter the number of candidates to generate")
+    seed = get_seed_input()
+    export_format = st.selectbox(
+        "Select the file format", SHARD_FORMATS, format_func=lambda name: EXPORT_FORMATS[name]["label"]
+    )
+    if st.button("Generate Data"):
+        st.write("Generating related tables...")
+        with trace("request", model=model, num_rows=num_sequences, seed=seed, format=export_format):
+            offer_tables_download(models[model]["path"], num_sequences, export_format, seed)
+    show_admin_sidebar()
+    st.stop()
+
+# The synthesizer is only loaded once its model is selected, see model_loading.py
+is_sequential = models[model]["is_sequential"]
+synthesizer_path = models[model]["path"]
+sample_pool = get_sample_pool(model, file_signature(synthesizer_path), is_sequential)
 
 st.subheader("Bias Selection (optional)")
 biascat = st.selectbox("Select the variable you want to introduce bias for", CONFIG["bias_options"])
@@ -120,16 +312,19 @@ biascat = st.selectbox("Select the variable you want to introduce bias for", CON
 if biascat == "None":
     st.subheader("Output Size")
     num_sequences = get_dataset_size_input("Enter the number of rows to generate")
+    seed = get_seed_input()
+    export_format = get_export_format_input()
     if st.button("Generate Data"):
         st.write("Generating unbiased data...")
-        df = generate_data_no_bias(synthesizer, num_sequences, is_sequential)
-        df_xlsx = to_excel(df)
-        st.download_button(
-            label="Download data as Excel file",
-            data=df_xlsx,
-            file_name="synthetic_data.xlsx",
-            mime="application/vnd.ms-excel",
-        )
+        with trace("request", model=model, num_rows=num_sequences, seed=seed, format=export_format):
+            frames = generate_data(sample_pool, synthesizer_path, is_sequential, num_sequences, seed=seed)
+            fidelity = FidelityAccumulator(get_fidelity_histograms(), is_sequential)
+            privacy = PrivacyAccumulator(reference_data.data, is_sequential)
+            geo = GeoAccumulator(get_real_locations(), is_sequential)
+            offer_download(traced_generation(frames, fidelity, privacy, geo), export_format)
+            show_fidelity(fidelity)
+            show_privacy(privacy)
+            show_geography(geo)
 else:
     category_percentages = generate_bias_inputs(
         category_names=list(CONFIG["defaults"][biascat].keys()),
@@ -140,30 +335,43 @@ else:
     else:
         st.subheader("Output Size")
         num_sequences = get_dataset_size_input("Enter the number of rows to generate")
+        seed = get_seed_input()
+        export_format = get_export_format_input()
         if st.button("Generate Data"):
             st.write(f"Generating biased data for {biascat}...")
-            df = generate_data_generalized(
-                synthesizer,
-                column_name=biascat,
-                category_percentages=category_percentages,
-                num_sequences=num_sequences,
-                is_sequential=is_sequential,
-            )
-            df_xlsx = to_excel(df)
-            st.download_button(
-                label="Download data as Excel file",
-                data=df_xlsx,
-                file_name="synthetic_data.xlsx",
-                mime="application/vnd.ms-excel",
-            )
-            # Generate and display the column plot
-            if is_sequential:
-                real_data = real_data_seq
-            else:
-                real_data = real_data_sin
-                
-            st.subheader("Comparison with Real Data")
-            fig = get_column_plot(
-                real_data=real_data, synthetic_data=df, column_name=biascat
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            with trace("request", model=model, bias_column=biascat, num_rows=num_sequences, seed=seed,
+                       format=export_format):
+                frames = generate_data(
+                    sample_pool,
+                    synthesizer_path,
+                    is_sequential,
+                    num_sequences,
+                    column_name=biascat,
+                    category_percentages=category_percentages,
+                    seed=seed,
+                )
+                biased_columns = []
+                fidelity = FidelityAccumulator(get_fidelity_histograms(), is_sequential)
+                privacy = PrivacyAccumulator(reference_data.data, is_sequential)
+                geo = GeoAccumulator(get_real_locations(), is_sequential)
+                offer_download(
+                    keep_column(traced_generation(frames, fidelity, privacy, geo), biascat, biased_columns),
+                    export_format,
+                )
+                df = pd.concat(biased_columns, ignore_index=True)
+                shortfalls = find_shortfalls(df, biascat, category_percentages, num_sequences, is_sequential)
+                for category, shortfall in shortfalls.items():
+                    st.warning(
+                        f"Only {shortfall['generated']} of the {shortfall['requested']} requested rows with "
+                        f"{biascat} '{category}' could be generated in time."
+                    )
+                # The real data has one row per candidate, so compare it with one value per synthetic candidate
+                st.subheader("Comparison with Real Data")
+                with span("frequency_plot"):
+                    fig = get_frequency_plot(reference_data, candidate_values(df, biascat, is_sequential), biascat)
+                st.plotly_chart(fig, width="stretch")
+                show_fidelity(fidelity)
+                show_privacy(privacy)
+                show_geography(geo)
+
+show_admin_sidebar()
@@ -0,0 +1,299 @@
+"""
+Offline CPU benchmark of model loading, sampling and exporting.
+
+Every case is timed ``--repeats`` times with a fixed seed and written to a
+JSON file. Rows are candidates, so for the sequential models rows/s counts
+sequences. Two result files (e.g. before and after a change) can be compared:
+
+    python webapp/benchmark.py run -o benchmark.json
+    python webapp/benchmark.py run --quick -o benchmark_quick.json
+    python webapp/benchmark.py compare old.json new.json --tolerance 0.2
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from config import CONFIG, WEBAPP_DIR
+from export import EXPORT_FORMATS, export_frames
+from generation import (
+    candidate_values,
+    find_shortfalls,
+    generate_data_generalized,
+    generate_data_no_bias,
+    generate_data_quota,
+    seed_synthesizer,
+)
+from model_loading import load_synthesizer
+
+BENCHMARK_MODELS = {
+    "seq_100": {"path": os.path.join(WEBAPP_DIR, "synthesizer_seq_100.pkl"), "is_sequential": True},
+    "seq_1000_nocuda": {"path": os.path.join(WEBAPP_DIR, "synthesizer_seq_1000_nocuda.pkl"), "is_sequential": True},
+    "sin": {"path": os.path.join(WEBAPP_DIR, "synthesizer_sin.pkl"), "is_sequential": False},
+}
+
+# name -> (bias column, category percentages), None samples unconditionally
+BIAS_CONFIGS = {
+    "none": None,
+    "sex_default": ("Sex", CONFIG["defaults"]["Sex"]),
+    "sex_skewed": ("Sex", {"Male": 90, "Female": 10}),
+    "age_default": ("Age Range", CONFIG["defaults"]["Age Range"]),
+    # Doctorate is 1% of the real data, the hardest category to condition on
+    "study_doctorate_1pct": ("Study Title", CONFIG["defaults"]["Study Title"]),
+}
+
+# Conditional sampling through SDV Conditions (the app before) and generate_data_quota
+SAMPLING_MODES = ["conditions", "quota"]
+
+DEFAULT_ROWS = [100, 1000]
+QUICK_ROWS = [50]
+BENCHMARK_SEED = 0
+
+
+def _legacy_to_excel(frames, path):
+    # The in-memory to_excel the app used before export.py
+    output = io.BytesIO()
+    writer = pd.ExcelWriter(output, engine="xlsxwriter")
+    pd.concat(list(frames), ignore_index=True).to_excel(writer, index=False)
+    writer.close()
+    with open(path, "wb") as file:
+        file.write(output.getvalue())
+
+
+EXPORTERS = {
+    "to_excel": _legacy_to_excel,
+    **{
+        export_format: (lambda frames, path, export_format=export_format: export_frames(frames, export_format, path))
+        for export_format in EXPORT_FORMATS
+    },
+}
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process where the kernel allows it (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, since the last reset_peak_rss if it worked."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(latencies, rows):
+    latencies = np.asarray(latencies)
+    return {
+        "repeats": len(latencies),
+        "p50_seconds": float(np.percentile(latencies, 50)),
+        "p99_seconds": float(np.percentile(latencies, 99)),
+        "mean_seconds": float(latencies.mean()),
+        "rows_per_second": float(rows / np.median(latencies)) if rows and np.median(latencies) > 0 else None,
+    }
+
+
+def time_repeats(function, repeats):
+    """Run ``function(repeat)`` ``repeats`` times, returning the latencies, the last result and the peak RSS."""
+    reset_peak_rss()
+    latencies = []
+    result = None
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        result = function(repeat)
+        latencies.append(time.perf_counter() - start)
+    return latencies, result, peak_rss_mb()
+
+
+def sample_case(synthesizer, is_sequential, bias, num_rows, seed, mode="conditions"):
+    seed_synthesizer(synthesizer, seed)
+    if bias is None:
+        return generate_data_no_bias(synthesizer, num_rows, is_sequential)
+    column_name, category_percentages = bias
+    if mode == "quota":
+        generated_data, _ = generate_data_quota(
+            synthesizer, column_name, category_percentages, num_rows, is_sequential,
+            **CONFIG["conditional_sampling"],
+        )
+        return generated_data
+    return generate_data_generalized(synthesizer, column_name, category_percentages, num_rows, is_sequential)
+
+
+def benchmark_model(name, settings, row_counts, bias_names, export_formats, repeats, log=print):
+    results = []
+    path = settings["path"]
+
+    latencies, synthesizer, rss = time_repeats(lambda repeat: load_synthesizer(path), repeats)
+    results.append({
+        "case": "load", "model": name, "bias": None, "mode": None, "rows": None, "format": None,
+        "file_size_bytes": os.path.getsize(path), "peak_rss_mb": rss, **summarize(latencies, None),
+    })
+    log(f"{name}: load p50 {results[-1]['p50_seconds']:.3f}s")
+
+    for num_rows in row_counts:
+        for bias_name in bias_names:
+            bias = BIAS_CONFIGS[bias_name]
+            for mode in (["unconditional"] if bias is None else SAMPLING_MODES):
+                latencies, frame, rss = time_repeats(
+                    lambda repeat: sample_case(
+                        synthesizer, settings["is_sequential"], bias, num_rows, BENCHMARK_SEED + repeat, mode
+                    ),
+                    repeats,
+                )
+                record = {
+                    "case": "sample", "model": name, "bias": bias_name, "mode": mode, "rows": num_rows,
+                    "format": None, "output_rows": len(frame), "peak_rss_mb": rss, **summarize(latencies, num_rows),
+                }
+                if bias is not None:
+                    column_name, category_percentages = bias
+                    values = candidate_values(frame, column_name, settings["is_sequential"])
+                    record["category_shares"] = {
+                        str(category): float(share) for category, share in values.value_counts(normalize=True).items()
+                    }
+                    record["shortfalls"] = find_shortfalls(
+                        frame, column_name, category_percentages, num_rows, settings["is_sequential"]
+                    )
+                results.append(record)
+                log(f"{name}: sample {bias_name} ({mode}) x{num_rows} p50 {record['p50_seconds']:.3f}s "
+                    f"({record['rows_per_second']:.0f} rows/s)")
+
+        frame = sample_case(synthesizer, settings["is_sequential"], None, num_rows, BENCHMARK_SEED)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for export_format in export_formats:
+                path_out = os.path.join(tmp_dir, f"export.{export_format}")
+                latencies, _, rss = time_repeats(lambda repeat: EXPORTERS[export_format]([frame], path_out), repeats)
+                record = {
+                    "case": "export", "model": name, "bias": None, "mode": None, "rows": num_rows,
+                    "format": export_format, "output_rows": len(frame), "file_size_bytes": os.path.getsize(path_out), "peak_rss_mb": rss,
+                    **summarize(latencies, len(frame)),
+                }
+                results.append(record)
+                log(f"{name}: export {export_format} x{len(frame)} p50 {record['p50_seconds']:.3f}s")
+    return results
+
+
+def environment():
+    def version(module_name):
+        try:
+            return __import__(module_name).__version__
+        except Exception:
+            return None
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=WEBAPP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {name: version(name) for name in ("sdv", "deepecho", "rdt", "torch", "pandas", "numpy", "pyarrow")},
+    }
+
+
+def case_key(record):
+    return (record["case"], record["model"], record["bias"], record.get("mode"), record["rows"], record["format"])
+
+
+def compare(old, new, tolerance):
+    """
+    List the cases whose p50 latency got more than ``tolerance`` (a fraction) slower.
+
+    Returns:
+    - list of dict: One entry per regressed case.
+    """
+    old_results = {case_key(record): record for record in old["results"]}
+    regressions = []
+    for record in new["results"]:
+        previous = old_results.get(case_key(record))
+        if previous is None or previous["p50_seconds"] <= 0:
+            continue
+        change = record["p50_seconds"] / previous["p50_seconds"] - 1
+        if change > tolerance:
+            regressions.append({"case": case_key(record), "old_p50": previous["p50_seconds"],
+                                "new_p50": record["p50_seconds"], "change": change})
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmark")
+    run.add_argument("-o", "--output", required=True, help="JSON file to write")
+    run.add_argument("--models", nargs="+", choices=list(BENCHMARK_MODELS), default=list(BENCHMARK_MODELS))
+    run.add_argument("--rows", nargs="+", type=int, help=f"Row counts to sweep (default {DEFAULT_ROWS})")
+    run.add_argument("--bias", nargs="+", choices=list(BIAS_CONFIGS), default=list(BIAS_CONFIGS))
+    run.add_argument("--formats", nargs="+", choices=list(EXPORTERS), default=list(EXPORTERS))
+    run.add_argument("--repeats", type=int, default=5)
+    run.add_argument("--threads", type=int, default=1, help="torch threads, fixed for comparable numbers")
+    run.add_argument("--quick", action="store_true", help=f"Smoke run: rows {QUICK_ROWS} and 2 repeats")
+
+    diff = commands.add_parser("compare", help="Compare two benchmark files")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p50 slowdown")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "compare":
+        with open(args.old) as old, open(args.new) as new:
+            regressions = compare(json.load(old), json.load(new), args.tolerance)
+        for regression in regressions:
+            print(f"{regression['case']}: {regression['old_p50']:.3f}s -> {regression['new_p50']:.3f}s "
+                  f"(+{regression['change']:.0%})")
+        print(f"{len(regressions)} regression(s) above {args.tolerance:.0%}")
+        return 1 if regressions else 0
+
+    import torch
+
+    # The benchmark times the stages itself, its spans would only mix with the served requests'
+    CONFIG["tracing"]["enabled"] = False
+    # PAR warns about an empty concat on every sample call
+    warnings.filterwarnings("ignore", category=FutureWarning)
+    torch.set_num_threads(args.threads)
+    row_counts = args.rows or (QUICK_ROWS if args.quick else DEFAULT_ROWS)
+    repeats = 2 if args.quick else args.repeats
+    results = []
+    for name in args.models:
+        results.extend(benchmark_model(name, BENCHMARK_MODELS[name], row_counts, args.bias, args.formats, repeats))
+    report = {
+        "environment": environment(),
+        "settings": {"rows": row_counts, "repeats": repeats, "bias": args.bias, "formats": args.formats,
+                     "threads": args.threads, "seed": BENCHMARK_SEED},
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Generate synthetic data without the Streamlit UI.
+
+Examples (from the repository root):
+    python webapp/cli.py generate --model sequential --rows 5000 --format parquet -o data.parquet
+    python webapp/cli.py generate --bias-column Sex --percentage Male=30 --percentage Female=70 -o data.csv
+    python webapp/cli.py generate-tables --model SDV/outputs/multitable/2024-12-08_20-28-10 --rows 100000 -o tables/
+    python webapp/cli.py privacy data.parquet --sequential --real candidates_original_preprocessed.csv
+    python webapp/cli.py serve --port 8000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from config import CONFIG
+from multitable import SHARD_FORMATS, ShardedTableSampler
+from privacy import PrivacyAccumulator, privacy_report
+from reference_data import apply_schema, load_reference_data
+from registry import get_registry
+from service import SERVICE_FORMATS, GenerationService, make_server, validate_request
+
+
+def parse_percentages(values):
+    percentages = {}
+    for value in values or []:
+        category, _, percentage = value.rpartition("=")
+        if not category:
+            raise argparse.ArgumentTypeError(f"Expected CATEGORY=PERCENTAGE, got {value!r}")
+        percentages[category] = int(percentage)
+    return percentages
+
+
+def read_table(path):
+    return pd.read_parquet(path) if os.path.splitext(path)[1] == ".parquet" else pd.read_csv(path)
+
+
+def print_privacy(report):
+    if not report["rows"]:
+        return
+    print(
+        f"Privacy: {report['exact_matches']} of {report['rows']} candidates copy a real one, "
+        f"{report['near_copy_share']:.1%} are near copies ({report['real_near_copy_share']:.1%} of the real ones are), "
+        f"median distance to the closest real candidate {report['median_dcr']:.3f}",
+        file=sys.stderr,
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Generate one file")
+    generate.add_argument("--model", choices=list(get_registry().models()), default="single",
+                          help="A model of the registry, see registry.py list")
+    generate.add_argument("--rows", type=int, default=150, help="Number of rows (single) or candidates (sequential)")
+    generate.add_argument("--bias-column", choices=list(CONFIG["defaults"]))
+    generate.add_argument(
+        "--percentage", action="append", metavar="CATEGORY=PERCENTAGE",
+        help="Share of a category of the bias column, repeat for every category (defaults from the app)",
+    )
+    generate.add_argument("--seed", type=int)
+    generate.add_argument("--format", choices=SERVICE_FORMATS, default="csv")
+    generate.add_argument("-o", "--output", required=True)
+    generate.add_argument("--workers", type=int, help="Worker processes for large requests")
+    generate.add_argument("--no-privacy", action="store_true", help="Skip the privacy check against the real data")
+
+    tables = commands.add_parser("generate-tables", help="Generate related tables in shards, see multitable.py")
+    tables.add_argument("--model", choices=list(get_registry().multi_table_models()), required=True,
+                        help="A multi-table model of the registry")
+    tables.add_argument("--rows", type=int, default=1000, help="Number of candidates (rows of the root table)")
+    tables.add_argument("--shard-size", type=int, default=CONFIG["multitable"]["shard_size"])
+    tables.add_argument("--seed", type=int)
+    tables.add_argument("--format", choices=SHARD_FORMATS, default="parquet")
+    tables.add_argument("-o", "--output", required=True, help="Directory to write, must be empty or missing")
+    tables.add_argument("--workers", type=int, help="Worker processes, one shard each at a time")
+
+    privacy = commands.add_parser("privacy", help="Check a generated file for copies of real candidates")
+    privacy.add_argument("path", help="A generated CSV or Parquet file")
+    privacy.add_argument("--sequential", action="store_true", help="The file holds sequences, check one row per ID")
+    privacy.add_argument("--real", help="CSV or Parquet of the real candidates, the app's reference data by default")
+
+    serve = commands.add_parser("serve", help="Run the HTTP generation service")
+    serve.add_argument("--host", default=CONFIG["service"]["host"])
+    serve.add_argument("--port", type=int, default=CONFIG["service"]["port"])
+    serve.add_argument("--max-concurrent-jobs", type=int, default=CONFIG["service"]["max_concurrent_jobs"])
+    serve.add_argument("--max-queued-jobs", type=int, default=CONFIG["service"]["max_queued_jobs"])
+    serve.add_argument("--workers", type=int, help="Worker processes per model for large requests")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "privacy":
+        real = apply_schema(read_table(args.real)) if args.real else load_reference_data().data
+        report = privacy_report(real, read_table(args.path), args.sequential)
+        print(json.dumps(report, indent=2))
+        print_privacy(report)
+        return 0
+    # A one off generate call has no use for pre-generated pools
+    service = GenerationService(max_workers=args.workers, use_pool=args.command == "serve")
+    try:
+        if args.command == "generate":
+            try:
+                request = validate_request({
+                    "model": args.model,
+                    "num_rows": args.rows,
+                    "bias_column": args.bias_column,
+                    "category_percentages": parse_percentages(args.percentage),
+                    "seed": args.seed,
+                    "format": args.format,
+                })
+            except (ValueError, argparse.ArgumentTypeError) as error:
+                print(f"error: {error}", file=sys.stderr)
+                return 2
+            privacy = None
+            if not args.no_privacy:
+                is_sequential = get_registry().get(args.model)["is_sequential"]
+                privacy = PrivacyAccumulator(load_reference_data().data, is_sequential)
+            start = time.perf_counter()
+            service.run(request, args.output, privacy=privacy)
+            print(f"Wrote {args.output} in {time.perf_counter() - start:.2f}s")
+            if privacy is not None:
+                print_privacy(privacy.report())
+        elif args.command == "generate-tables":
+            if args.rows < 1 or args.shard_size < 1:
+                print("error: --rows and --shard-size must be positive", file=sys.stderr)
+                return 2
+            sampler = ShardedTableSampler(
+                get_registry().multi_table_models()[args.model]["path"],
+                max_workers=args.workers or CONFIG["multitable"]["max_workers"],
+                shard_size=args.shard_size,
+            )
+            start = time.perf_counter()
+            try:
+                totals = sampler.sample_to_dir(
+                    args.rows, args.output, args.format, seed=args.seed,
+                    progress=lambda done, total: print(f"Wrote shard {done} of {total}", file=sys.stderr),
+                )
+            except ValueError as error:
+                print(f"error: {error}", file=sys.stderr)
+                return 2
+            rows = ", ".join(f"{count} {table}" for table, count in totals.items())
+            print(f"Wrote {rows} to {args.output} in {time.perf_counter() - start:.2f}s")
+        else:
+            server = make_server(
+                service, args.host, args.port, args.max_concurrent_jobs, args.max_queued_jobs
+            )
+            print(f"Serving on http://{args.host}:{server.server_address[1]}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import os
+
+WEBAPP_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(WEBAPP_DIR)
+
+# Configurations shared by the Streamlit app and the helper modules
+CONFIG = {
+    # The default models, registry.py adds every model of its manifest under its own name
+    "models": {
+        "single": {
+            "label": "Single (only candidates)",
+            "path": os.path.join(WEBAPP_DIR, "synthesizer_sin.pkl"),
+            "is_sequential": False,
+        },
+        "sequential": {
+            "label": "Sequential (candidates and events)",
+            "path": os.path.join(WEBAPP_DIR, "synthesizer_seq_1000_nocuda.pkl"),
+            "is_sequential": True,
+        },
+    },
+    # Manifest of every trained synthesizer, see registry.py. The loaded models
+    # are kept within max_loaded_mb and max_loaded_models, least recently used out first.
+    "registry": {
+        "manifest_path": os.path.join(WEBAPP_DIR, "models.json"),
+        # Load times and memory measured on this machine, kept out of version control
+        "measurements_path": os.path.join(WEBAPP_DIR, "models.local.json"),
+        "search_dirs": [WEBAPP_DIR, os.path.join(REPO_DIR, "SDV")],
+        "max_loaded_mb": 2048,
+        "max_loaded_models": 4,
+    },
+    # Seeded results kept on disk, see result_cache.py. Replicas of the app and
+    # the service share them when they share this directory.
+    "result_cache": {
+        "directory": os.path.join(WEBAPP_DIR, ".result_cache"),
+        "max_mb": 1024,
+        "max_age_seconds": 7 * 24 * 60 * 60,
+    },
+    # Real candidates the generated data is compared with, see reference_data.py
+    "reference_data": {
+        "parquet_path": os.path.join(WEBAPP_DIR, "real_data_sin.parquet"),
+        "csv_path": os.path.join(WEBAPP_DIR, "real_data_sin.csv"),
+    },
+    "bias_options": ["None", "Sex", "Age Range", "Study Title"],
+    "defaults": {
+        "Sex": {"Male": 50, "Female": 50},
+        "Age Range": {
+            "< 20 years": 8,
+            "20 - 25 years": 27,
+            "26 - 30 years": 46,
+            "31 - 35 years": 9,
+            "36 - 40 years": 4,
+            "40 - 45 years": 2,
+            "> 45 years": 4,
+        },
+        "Study Title": {
+            "Middle school diploma": 0,
+            "High school graduation": 4,
+            "Three-year degree": 39,
+            "Five-year degree": 53,
+            "master's degree": 2,
+            "Doctorate": 1,
+            "Professional qualification": 1,
+        },
+    },
+    # Pre-generated candidates kept per synthesizer, see sample_pool.py.
+    # Sizes are counted in candidates (sequences for the sequential model, rows otherwise).
+    "sample_pool": {
+        "max_size": 2000,
+        "low_watermark": 200,
+        "refill_batch": 250,
+        "max_age_seconds": 6 * 60 * 60,
+    },
+    # Requests of at least min_sequences are sampled in chunks over a process pool,
+    # see parallel_sampling.py. max_workers None means one worker per core.
+    "parallel": {
+        "min_sequences": 2000,
+        "chunk_size": 250,
+        "max_workers": None,
+    },
+    # Related tables of multi-table models written in shards of shard_size candidates,
+    # see multitable.py. max_workers None means one worker per core.
+    "multitable": {
+        "shard_size": 1000,
+        "max_workers": None,
+    },
+    # Sequences of PAR models sampled batch_size at a time, see par_inference.py. Opt-in, as it
+    # replaces private parts of SDV's sampler: check a model with the benchmark of par_inference.py
+    # before enabling it. quantize runs the network in int8.
+    "par_inference": {
+        "enabled": False,
+        "batch_size": 512,
+        "quantize": False,
+    },
+    # Conditional sampling of columns PAR cannot use as context, see generate_data_quota.
+    # The pool refills one category at a time, so it skips the unconditional oversampling.
+    "conditional_sampling": {
+        "oversample": 1.2,
+        "time_budget_seconds": 10.0,
+        "max_tries_per_batch": 5,
+    },
+    # Synthetic candidates checked against the real ones, see privacy.py. Unordered columns with
+    # more than max_categories categories only count for exact copies, and a candidate closer to a
+    # real one than near_copy_quantile of the real candidates are to each other is a near copy.
+    "privacy": {
+        "max_categories": 50,
+        "near_copy_quantile": 0.05,
+    },
+    # Region borders of the map of where the candidates live, see geo.py. The source is simplified
+    # to tolerance degrees (~1 km per 0.01) and rounded to precision decimals once, into simplified_path.
+    "geo": {
+        "geojson_path": os.path.join(REPO_DIR, "data analysis", "limits_IT_regions.geojson"),
+        "simplified_path": os.path.join(WEBAPP_DIR, "regions_simplified.geojson"),
+        "tolerance": 0.01,
+        "precision": 3,
+    },
+    # Spans of the generation path appended to path (rotated past max_mb) and
+    # counted in latency histograms with these bucket bounds, see tracing.py.
+    # A process appends its spans once a trace ends or flush_spans are waiting.
+    "tracing": {
+        "enabled": True,
+        "path": os.path.join(WEBAPP_DIR, "traces.jsonl"),
+        "max_mb": 50,
+        "flush_spans": 200,
+        "buckets_seconds": [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300],
+        "recent_spans": 50,
+    },
+    # Headless generation service, see service.py
+    "service": {
+        "host": "127.0.0.1",
+        "port": 8000,
+        "max_concurrent_jobs": 2,
+        "max_queued_jobs": 16,
+    },
+}
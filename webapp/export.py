@@ -0,0 +1,153 @@
+import os
+
+import pandas as pd
+
+from tracing import span
+
+# Rows handed to a writer at once, bounds the memory used while exporting
+EXPORT_CHUNK_ROWS = 10_000
+
+# Excel refuses sheets longer than this (header row included)
+XLSX_MAX_ROWS = 1_048_576
+
+EXPORT_FORMATS = {
+    "xlsx": {
+        "label": "Excel",
+        "extension": "xlsx",
+        "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    },
+    "csv": {
+        "label": "CSV",
+        "extension": "csv",
+        "mime": "text/csv",
+    },
+    "parquet": {
+        "label": "Parquet",
+        "extension": "parquet",
+        "mime": "application/vnd.apache.parquet",
+    },
+}
+
+
+def iter_row_chunks(frames, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Re-slice an iterable of DataFrames into chunks of at most ``chunk_rows`` rows."""
+    for frame in frames:
+        for start in range(0, len(frame), chunk_rows):
+            yield frame.iloc[start:start + chunk_rows]
+
+
+def write_csv(frames, path):
+    # A file name, or a binary file object such as a streamed HTTP response
+    output = open(path, "wb") if isinstance(path, (str, os.PathLike)) else path
+    try:
+        header = True
+        for chunk in frames:
+            output.write(chunk.to_csv(index=False, header=header).encode("utf-8"))
+            header = False
+    finally:
+        if output is not path:
+            output.close()
+
+
+def _arrow_schema(chunk):
+    import pyarrow as pa
+
+    fields = []
+    for column, dtype in chunk.dtypes.items():
+        if dtype == object or isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            # Low-cardinality strings, stored once per row group as a dictionary
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(column, pa.Array.from_pandas(chunk[column]).type))
+    return pa.schema(fields)
+
+
+def _to_arrow(chunk, schema):
+    import pyarrow as pa
+
+    arrays = []
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.Array.from_pandas(values.astype("string"), type=pa.string()).dictionary_encode())
+        elif pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            # A later chunk may hold missing values (floats) where the first one only had ints
+            arrays.append(pa.Array.from_pandas(pd.to_numeric(values, errors="coerce"), type=field.type))
+        else:
+            arrays.append(pa.Array.from_pandas(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(frames, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in frames:
+            if writer is None:
+                schema = _arrow_schema(chunk)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(_to_arrow(chunk, schema))
+        if writer is None:
+            pq.write_table(pa.table({}), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_xlsx(frames, path):
+    import xlsxwriter
+
+    # constant_memory flushes every row to disk once the next one is started
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    worksheet = None
+    row = 0
+    try:
+        for chunk in frames:
+            values = chunk.astype(object).where(chunk.notna(), None)
+            for record in values.itertuples(index=False, name=None):
+                if worksheet is None or row == XLSX_MAX_ROWS:
+                    worksheet = workbook.add_worksheet()
+                    worksheet.write_row(0, 0, list(chunk.columns))
+                    row = 1
+                worksheet.write_row(row, 0, record)
+                row += 1
+        if worksheet is None:
+            workbook.add_worksheet()
+    finally:
+        workbook.close()
+
+
+WRITERS = {
+    "xlsx": write_xlsx,
+    "csv": write_csv,
+    "parquet": write_parquet,
+}
+
+
+def export_frames(frames, export_format, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Write generated data to ``path`` one chunk at a time.
+
+    Parameters:
+    - frames: An iterable of DataFrames, e.g. the chunks of a generation request as they are sampled.
+    - export_format (str): One of the keys of ``EXPORT_FORMATS``.
+    - path (str or file object): File to write, CSV and Parquet also go to a writable binary file object.
+    - chunk_rows (int): Maximum number of rows handed to the writer at once.
+
+    Returns:
+    - str: The path that was written.
+    """
+    if export_format not in WRITERS:
+        raise ValueError(f"Unknown export format {export_format!r}, expected one of {list(WRITERS)}")
+    with span("export", format=export_format) as stage:
+        stage.rows = 0
+
+        def counted(chunks):
+            for chunk in chunks:
+                stage.rows += len(chunk)
+                yield chunk
+
+        WRITERS[export_format](counted(iter_row_chunks(frames, chunk_rows)), path)
+    return path
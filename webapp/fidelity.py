@@ -0,0 +1,213 @@
+"""
+Column and column pair fidelity of synthetic data against real histograms.
+
+The real data is turned into histograms once (``get_real_histograms``). A
+synthetic frame, or a stream of chunks through ``FidelityAccumulator``, is
+then encoded into integer codes and counted for every column and column
+pair with a single ``np.bincount`` each, so the scores of all columns come
+out of one vectorized pass.
+
+From a notebook (repository root):
+
+    import sys; sys.path.insert(0, "webapp")
+    from fidelity import fidelity_report, get_real_histograms
+    column_scores, pair_scores = fidelity_report(get_real_histograms(real_data), synthetic_data)
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_numeric_dtype
+
+# Same as generation.ID_COLUMN, not imported so that notebooks can use this module without SDV
+ID_COLUMN = "ID"
+# Columns with more categories than this are scored on their own but left out of the pairs
+MAX_PAIR_CATEGORIES = 50
+# Added to every probability before the KL divergence, as calculate_kl_divergence in the notebooks did
+KL_EPSILON = 1e-10
+# Rows encoded at once for the pair counts, bounds the size of the pair code matrix
+PAIR_BLOCK_ROWS = 8192
+
+
+def _column_categories(column):
+    if isinstance(column.dtype, CategoricalDtype):
+        categories = column.cat.categories
+    else:
+        categories = pd.Index(column.dropna().unique())
+    if is_numeric_dtype(categories.dtype):
+        return pd.Index(categories.astype("float64"))
+    return pd.Index(categories.astype(str))
+
+
+def _normalize(counts, offsets):
+    totals = np.add.reduceat(counts, offsets[:-1]).astype("float64")
+    totals[totals == 0] = 1
+    return counts / np.repeat(totals, np.diff(offsets))
+
+
+class RealHistograms:
+    """
+    Category histograms of every column, and contingency tables of every column pair, of the real data.
+
+    Every column gets one bin per real category plus a bin for missing values
+    and one for values the real data never had.
+
+    Parameters:
+    - data (pd.DataFrame): The real data.
+    - columns (list or None): Columns to score, defaults to every column but the ID.
+    - max_pair_categories (int): Columns with more categories are not paired.
+    """
+
+    def __init__(self, data, columns=None, max_pair_categories=MAX_PAIR_CATEGORIES):
+        self.columns = [column for column in (columns or data.columns) if column != ID_COLUMN]
+        self.categories = [_column_categories(data[column]) for column in self.columns]
+        self.numeric = [is_numeric_dtype(categories.dtype) for categories in self.categories]
+        # Bins per column: the categories, missing, unseen
+        self.bins = np.array([len(categories) + 2 for categories in self.categories])
+        self.offsets = np.concatenate([[0], np.cumsum(self.bins)])
+
+        pairable = [index for index, bins in enumerate(self.bins) if bins - 2 <= max_pair_categories]
+        self.pairs = np.array(
+            [(a, b) for position, a in enumerate(pairable) for b in pairable[position + 1:]], dtype="int64"
+        ).reshape(-1, 2)
+        pair_bins = self.bins[self.pairs[:, 0]] * self.bins[self.pairs[:, 1]]
+        self.pair_offsets = np.concatenate([[0], np.cumsum(pair_bins)])
+
+        codes = self.encode(data)
+        self.num_rows = len(data)
+        self.column_probabilities = _normalize(self.count_columns(codes), self.offsets)
+        self.pair_probabilities = _normalize(self.count_pairs(codes), self.pair_offsets)
+
+    def encode(self, frame):
+        """Bin index of every value of ``frame``, one row per scored column."""
+        codes = np.empty((len(self.columns), len(frame)), dtype="int32")
+        for index, (column, categories) in enumerate(zip(self.columns, self.categories)):
+            if column not in frame.columns:
+                codes[index] = len(categories)
+                continue
+            values = frame[column]
+            if self.numeric[index]:
+                values = pd.to_numeric(values, errors="coerce").astype("float64")
+            # Match the few distinct values against the categories instead of every row
+            value_codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            uniques = pd.Index(uniques)
+            if not self.numeric[index]:
+                uniques = uniques.astype(str)
+            lookup = categories.get_indexer(uniques)
+            lookup[lookup == -1] = len(categories) + 1
+            # The last entry is picked by the -1 code of missing values
+            lookup = np.append(lookup, len(categories))
+            codes[index] = lookup[value_codes]
+        return codes
+
+    def count_columns(self, codes):
+        return np.bincount((codes + self.offsets[:-1, None]).ravel(), minlength=self.offsets[-1])
+
+    def count_pairs(self, codes):
+        counts = np.zeros(self.pair_offsets[-1], dtype="int64")
+        if not len(self.pairs):
+            return counts
+        left, right = self.pairs[:, 0], self.pairs[:, 1]
+        multipliers = self.bins[right].astype("int32")[:, None]
+        pair_offsets = self.pair_offsets[:-1].astype("int32")[:, None]
+        for start in range(0, codes.shape[1], PAIR_BLOCK_ROWS):
+            block = codes[:, start:start + PAIR_BLOCK_ROWS]
+            pair_codes = block[left] * multipliers + block[right] + pair_offsets
+            counts += np.bincount(pair_codes.ravel(), minlength=self.pair_offsets[-1])
+        return counts
+
+
+class FidelityAccumulator:
+    """
+    Count synthetic data chunk by chunk, e.g. while it is being exported.
+
+    For sequential data only the first row of every sequence is counted, as
+    the real reference data has one row per candidate. Columns the synthetic
+    data does not have are left out of the report.
+    """
+
+    def __init__(self, histograms, is_sequential=False):
+        self.histograms = histograms
+        self.is_sequential = is_sequential
+        self.num_rows = 0
+        self.present = np.zeros(len(histograms.columns), dtype=bool)
+        self.column_counts = np.zeros(histograms.offsets[-1], dtype="int64")
+        self.pair_counts = np.zeros(histograms.pair_offsets[-1], dtype="int64")
+
+    def update(self, frame):
+        if self.is_sequential and ID_COLUMN in frame.columns:
+            frame = frame.drop_duplicates(subset=ID_COLUMN)
+        codes = self.histograms.encode(frame)
+        self.present |= np.isin(self.histograms.columns, frame.columns)
+        self.num_rows += len(frame)
+        self.column_counts += self.histograms.count_columns(codes)
+        self.pair_counts += self.histograms.count_pairs(codes)
+
+    def report(self):
+        """
+        Score every column and column pair.
+
+        Returns:
+        - pd.DataFrame: Per column the KL divergence (real to synthetic), total
+          variation distance, its complement and the missing shares.
+        - pd.DataFrame: Per column pair the contingency similarity (1 minus the
+          total variation distance of the two contingency tables).
+        """
+        histograms = self.histograms
+        real = histograms.column_probabilities
+        synthetic = _normalize(self.column_counts, histograms.offsets)
+        starts = histograms.offsets[:-1]
+
+        tv_distance = 0.5 * np.add.reduceat(np.abs(real - synthetic), starts)
+        real_smooth = _normalize(real + KL_EPSILON, histograms.offsets)
+        synthetic_smooth = _normalize(synthetic + KL_EPSILON, histograms.offsets)
+        kl_divergence = np.add.reduceat(real_smooth * np.log(real_smooth / synthetic_smooth), starts)
+        missing_bins = starts + histograms.bins - 2
+        column_scores = pd.DataFrame({
+            "column": histograms.columns,
+            "kl_divergence": kl_divergence,
+            "tv_distance": tv_distance,
+            "tv_complement": 1 - tv_distance,
+            "missing_real": real[missing_bins],
+            "missing_synthetic": synthetic[missing_bins],
+        })
+
+        pair_starts = histograms.pair_offsets[:-1]
+        if len(pair_starts):
+            pair_synthetic = _normalize(self.pair_counts, histograms.pair_offsets)
+            similarity = 1 - 0.5 * np.add.reduceat(np.abs(histograms.pair_probabilities - pair_synthetic), pair_starts)
+        else:
+            similarity = np.array([])
+        columns = np.array(histograms.columns, dtype=object)
+        pair_scores = pd.DataFrame({
+            "column_a": columns[histograms.pairs[:, 0]],
+            "column_b": columns[histograms.pairs[:, 1]],
+            "contingency_similarity": similarity,
+        })
+        pairs_present = self.present[histograms.pairs[:, 0]] & self.present[histograms.pairs[:, 1]]
+        return (
+            column_scores[self.present].reset_index(drop=True),
+            pair_scores[pairs_present].reset_index(drop=True),
+        )
+
+
+def fidelity_report(histograms, synthetic_data, is_sequential=False):
+    """Score one synthetic frame, see ``FidelityAccumulator.report``."""
+    accumulator = FidelityAccumulator(histograms, is_sequential)
+    accumulator.update(synthetic_data)
+    return accumulator.report()
+
+
+# Real histograms per reference dataset: (fingerprint, columns) -> RealHistograms
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def get_real_histograms(data, columns=None, max_pair_categories=MAX_PAIR_CATEGORIES):
+    """Histograms of ``data``, built once per process for the same data and columns."""
+    fingerprint = int(pd.util.hash_pandas_object(data, index=False).sum())
+    key = (fingerprint, tuple(data.columns), tuple(columns or ()), max_pair_categories)
+    with _histograms_lock:
+        if key not in _histograms:
+            _histograms[key] = RealHistograms(data, columns, max_pair_categories)
+        return _histograms[key]
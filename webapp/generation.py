@@ -0,0 +1,252 @@
+import math
+import random
+import time
+
+import numpy as np
+import pandas as pd
+from sdv.sampling import Condition
+
+from tracing import span
+
+ID_COLUMN = "ID"
+
+# Sequences drawn per missing candidate when topping up a non-context column of PAR
+SEQUENTIAL_TOP_UP_FACTOR = 10
+# Faker provider lists whose order depends on the hash seed, see _order_faker_lists
+UNORDERED_FAKER_LISTS = ("cities",)
+
+
+def category_counts(category_percentages, num_rows):
+    """Number of rows (or sequences) to generate per category."""
+    return {
+        # The epsilon keeps percentages derived from counts (e.g. 100 * 3 / 7) from losing a row
+        category: int(percentage * num_rows / 100 + 1e-9)
+        for category, percentage in category_percentages.items()
+    }
+
+
+def create_context(column_name, category_percentages, num_rows):
+    with span("create_context") as stage:
+        rows = []
+        for category, count in category_counts(category_percentages, num_rows).items():
+            rows.extend([category] * count)
+        stage.rows = len(rows)
+        return pd.DataFrame({column_name: rows})
+
+
+def generate_data_generalized(synthesizer, column_name, category_percentages, num_sequences, is_sequential=False):
+    if is_sequential:
+        context_df = create_context(column_name, category_percentages, num_sequences)
+        generated_data = synthesizer.sample_sequential_columns(context_columns=context_df)
+    else:
+        conditions = [
+            Condition(num_rows=count, column_values={column_name: category})
+            for category, count in category_counts(category_percentages, num_sequences).items()
+            if count > 0
+        ]
+        generated_data = synthesizer.sample_from_conditions(conditions=conditions)
+    return generated_data
+
+
+def generate_data_no_bias(synthesizer, num_sequences, is_sequential=False):
+    if is_sequential:
+        return synthesizer.sample(num_sequences=num_sequences)
+    return synthesizer.sample(num_rows=num_sequences)
+
+
+def candidate_values(frame, column_name, is_sequential=False, id_column=ID_COLUMN):
+    """Value of ``column_name`` per candidate, the first row of every sequence for PAR output."""
+    if is_sequential and id_column in frame.columns:
+        return frame.groupby(id_column, sort=False)[column_name].first()
+    return frame[column_name]
+
+
+def find_shortfalls(frame, column_name, category_percentages, num_sequences, is_sequential=False):
+    """
+    Compare the generated category mix with the requested one.
+
+    Returns:
+    - dict: Category -> {"requested": int, "generated": int} for every category that came up short.
+    """
+    if frame.empty or column_name not in frame.columns:
+        generated = {}
+    else:
+        generated = candidate_values(frame, column_name, is_sequential).value_counts().to_dict()
+    return {
+        category: {"requested": count, "generated": int(generated.get(category, 0))}
+        for category, count in category_counts(category_percentages, num_sequences).items()
+        if generated.get(category, 0) < count
+    }
+
+
+def _count_candidates(frame, is_sequential=False, id_column=ID_COLUMN):
+    if is_sequential and id_column in frame.columns:
+        return frame[id_column].nunique()
+    return len(frame)
+
+
+def _take_candidates(frame, values, category, count, id_column=ID_COLUMN):
+    """The first ``count`` candidates of ``frame`` whose value is ``category``."""
+    ids = values.index[values == category][:count]
+    if id_column in frame.columns and values.index.name == id_column:
+        return frame[frame[id_column].isin(ids)]
+    return frame.loc[ids]
+
+
+def _top_up(synthesizer, column_name, category, count, is_sequential, deadline, max_tries_per_batch):
+    """Sample up to ``count`` candidates of one category before ``deadline``, never raising on a miss."""
+    frames = []
+    while count > 0 and time.monotonic() < deadline:
+        if is_sequential:
+            # PAR cannot condition on its sequential columns, so keep what an unconditional draw hits
+            batch = synthesizer.sample(num_sequences=count * SEQUENTIAL_TOP_UP_FACTOR)
+            values = candidate_values(batch, column_name, is_sequential=True)
+            batch = _take_candidates(batch, values, category, count)
+        else:
+            try:
+                batch = synthesizer.sample_from_conditions(
+                    conditions=[Condition(num_rows=count, column_values={column_name: category})],
+                    max_tries_per_batch=max_tries_per_batch,
+                )
+            except ValueError:
+                # Not a single row matched within max_tries_per_batch, try again while there is time
+                continue
+        frames.append(batch)
+        count -= _count_candidates(batch, is_sequential)
+    return frames
+
+
+def generate_data_quota(synthesizer, column_name, category_percentages, num_sequences, is_sequential=False,
+                        oversample=1.2, time_budget_seconds=10.0, max_tries_per_batch=5):
+    """
+    Generate data with a given category mix without open ended reject sampling.
+
+    A context column of a PARSynthesizer is conditioned on directly. Otherwise
+    ``num_sequences * oversample`` candidates are sampled once without
+    conditions and every category takes its quota from them. Categories that
+    are still short (the rare ones) are topped up with conditional sampling,
+    each for at most ``time_budget_seconds``.
+
+    Parameters:
+    - synthesizer: A trained SDV synthesizer object.
+    - column_name (str): The bias column.
+    - category_percentages (dict): Category -> percentage of the candidates.
+    - num_sequences (int): Number of candidates to generate.
+    - is_sequential (bool): Whether the synthesizer is a PARSynthesizer.
+    - oversample (float): Size of the unconditional draw relative to the request, 0 skips it.
+    - time_budget_seconds (float): Time allowed to top up a single category.
+    - max_tries_per_batch (int): Passed to SDV for every conditional top up call.
+
+    Returns:
+    - tuple: The generated DataFrame and the shortfalls, see ``find_shortfalls``.
+    """
+    if is_sequential and column_name in (getattr(synthesizer, "context_columns", None) or []):
+        generated_data = generate_data_generalized(
+            synthesizer, column_name, category_percentages, num_sequences, is_sequential
+        )
+        return generated_data, find_shortfalls(
+            generated_data, column_name, category_percentages, num_sequences, is_sequential
+        )
+
+    counts = {category: count for category, count in category_counts(category_percentages, num_sequences).items()
+              if count > 0}
+    frames = []
+    missing = dict(counts)
+    if oversample > 0 and counts:
+        draw = generate_data_no_bias(synthesizer, math.ceil(sum(counts.values()) * oversample), is_sequential)
+        values = candidate_values(draw, column_name, is_sequential)
+        for category, count in counts.items():
+            taken = _take_candidates(draw, values, category, count)
+            frames.append(taken)
+            missing[category] -= _count_candidates(taken, is_sequential)
+
+    for category, count in missing.items():
+        if count > 0:
+            deadline = time.monotonic() + time_budget_seconds
+            frames.extend(_top_up(
+                synthesizer, column_name, category, count, is_sequential, deadline, max_tries_per_batch
+            ))
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        generated_data = pd.DataFrame()
+    elif is_sequential:
+        # Unconditional draws of PAR reuse IDs, keep the sequences apart
+        generated_data = renumber_ids(frames)
+    else:
+        generated_data = pd.concat(frames, ignore_index=True)
+    return generated_data, find_shortfalls(
+        generated_data, column_name, category_percentages, num_sequences, is_sequential
+    )
+
+
+def _order_faker_lists(faker):
+    # Faker builds some lists from a set (e.g. the Italian cities), so their order, and the value a
+    # seeded draw picks, changes with PYTHONHASHSEED. Sorted once per provider, the draw only depends on the seed.
+    for generator in getattr(faker, "factories", [faker]):
+        for provider in generator.providers:
+            for name in UNORDERED_FAKER_LISTS:
+                if isinstance(getattr(provider, name, None), list) and name not in vars(provider):
+                    setattr(provider, name, sorted(getattr(provider, name)))
+
+
+def seed_synthesizer(synthesizer, seed):
+    """
+    Make the next samples drawn from a loaded synthesizer depend only on ``seed``.
+
+    Freshly loaded single-table synthesizers (and the context synthesizer
+    inside PAR) fall back to the same fixed seed, so without this every
+    process would produce the same rows.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        import torch
+
+        torch.manual_seed(seed)
+    except ImportError:
+        pass
+    # A multi-table synthesizer holds one single-table synthesizer per table
+    table_synthesizers = list(getattr(synthesizer, "_table_synthesizers", {}).values())
+    for synth in (synthesizer, getattr(synthesizer, "_context_synthesizer", None), *table_synthesizers):
+        if synth is None:
+            continue
+        if hasattr(synth, "_set_random_state") and getattr(synth, "_model", None) is not None:
+            synth._set_random_state(seed)
+        hyper_transformer = getattr(getattr(synth, "_data_processor", None), "_hyper_transformer", None)
+        transformers = getattr(hyper_transformer, "field_transformers", {}) or {}
+        for offset, transformer in enumerate(transformers.values()):
+            if transformer is not None and getattr(transformer, "random_states", None) is not None:
+                # transform runs too when conditions are encoded, e.g. for a partial PAR context
+                for method_name in ("transform", "reverse_transform"):
+                    state = np.random.RandomState((seed + offset) % 2**32)
+                    transformer.set_random_state(state, method_name)
+            if getattr(transformer, "faker", None) is not None:
+                # Anonymized PII columns (e.g. City) draw from their own Faker instance
+                _order_faker_lists(transformer.faker)
+                transformer.faker.seed_instance((seed + offset) % 2**32)
+
+
+def renumber_ids(frames, start=1, id_column=ID_COLUMN):
+    """
+    Concatenate generated frames, giving every candidate a fresh ID.
+
+    Frames sampled in separate SDV calls draw their IDs from the same regex,
+    so the same ID can show up in two frames for two different candidates.
+    Rows that share an ID within one frame (the events of one sequence) keep
+    sharing it.
+    """
+    renumbered = []
+    next_id = start
+    for frame in frames:
+        if frame.empty:
+            continue
+        frame = frame.copy()
+        if id_column in frame.columns:
+            codes, uniques = pd.factorize(frame[id_column])
+            frame[id_column] = codes + next_id
+            next_id += len(uniques)
+        renumbered.append(frame)
+    if not renumbered:
+        return pd.DataFrame()
+    return pd.concat(renumbered, ignore_index=True)
@@ -0,0 +1,291 @@
+"""
+Where the synthetic candidates live, against the real ones, per Italian region.
+
+The region borders of ``data analysis/limits_IT_regions.geojson`` are
+simplified once (Douglas-Peucker, coordinates rounded) and written to
+``CONFIG["geo"]["simplified_path"]``, together with the signature of the
+source file, so a process only reads the small file and the map ships a few
+tens of KB instead of the full borders. The real candidates are counted per
+Region and Province once (``RealLocations``), the synthetic ones chunk by
+chunk with one ``value_counts`` per chunk (``GeoAccumulator``).
+
+Sequential models write the location as one ``Residence`` column,
+"CITY » Province ~ Region", which is split per distinct value.
+
+    python webapp/geo.py   # rebuild the simplified borders
+"""
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from config import CONFIG
+
+# Same as generation.ID_COLUMN, not imported so that notebooks can use this module without SDV
+ID_COLUMN = "ID"
+RESIDENCE_PATTERN = r"^(?P<City>.*?) » (?P<Province>.*?) ~ (?P<Region>.*)$"
+# Region names of the candidates -> reg_name of the GeoJSON, other regions ("(OVERSEAS)", ...) are off the map
+REGION_NAMES = {
+    "Piedmont": "Piemonte",
+    "Aosta Valley": "Valle d'Aosta/Vallée d'Aoste",
+    "Lombardy": "Lombardia",
+    "Trentino Alto Adige": "Trentino-Alto Adige/Südtirol",
+    "Veneto": "Veneto",
+    "Friuli Venezia Giulia": "Friuli-Venezia Giulia",
+    "Liguria": "Liguria",
+    "Emilia Romagna": "Emilia-Romagna",
+    "Tuscany": "Toscana",
+    "Umbria": "Umbria",
+    "Marche": "Marche",
+    "Lazio": "Lazio",
+    "Abruzzo": "Abruzzo",
+    "Molise": "Molise",
+    "Campania": "Campania",
+    "Puglia": "Puglia",
+    "Basilicata": "Basilicata",
+    "Calabria": "Calabria",
+    "Sicily": "Sicilia",
+    "Sardinia": "Sardegna",
+}
+
+
+def simplify_line(points, tolerance):
+    """Douglas-Peucker: the points of ``points`` (n x 2) kept within ``tolerance`` of the line."""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        between = points[first + 1:last]
+        direction = end - start
+        length = np.hypot(*direction)
+        if length == 0:
+            # A closed ring, measure from its first point
+            distances = np.hypot(*(between - start).T)
+        else:
+            offsets = between - start
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.extend([(first, middle), (middle, last)])
+    return points[keep]
+
+
+def simplify_geometry(geometry, tolerance, precision):
+    """
+    Simplify a Polygon or MultiPolygon, dropping the rings that collapse.
+
+    A region of which every polygon collapses keeps its largest one as it was.
+    """
+    polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+    simplified = []
+    for polygon in polygons:
+        rings = [np.round(simplify_line(np.asarray(ring, dtype="float64"), tolerance), precision) for ring in polygon]
+        # A ring needs three distinct points besides the closing one, the polygon goes with its exterior
+        kept = [ring for ring in rings if len(np.unique(ring, axis=0)) >= 3]
+        if kept and kept[0] is rings[0]:
+            simplified.append([ring.tolist() for ring in kept])
+    if not simplified:
+        largest = max(polygons, key=lambda polygon: len(polygon[0]))
+        simplified = [[np.round(np.asarray(ring, dtype="float64"), precision).tolist() for ring in largest]]
+    if len(simplified) == 1:
+        return {"type": "Polygon", "coordinates": simplified[0]}
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+def simplify_regions(geojson, tolerance, precision):
+    """The GeoJSON with every region's geometry simplified and only its name kept."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"reg_name": feature["properties"]["reg_name"]},
+                "geometry": simplify_geometry(feature["geometry"], tolerance, precision),
+            }
+            for feature in geojson["features"]
+        ],
+    }
+
+
+def _source_signature(path, settings):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size, settings["tolerance"], settings["precision"]]
+
+
+def build_simplified_regions(source_path=None, simplified_path=None):
+    """Simplify the source borders and write them to ``simplified_path``, returns the simplified GeoJSON."""
+    settings = CONFIG["geo"]
+    source_path = source_path or settings["geojson_path"]
+    simplified_path = simplified_path or settings["simplified_path"]
+    with open(source_path) as source:
+        regions = simplify_regions(json.load(source), settings["tolerance"], settings["precision"])
+    regions["source_signature"] = _source_signature(source_path, settings)
+    # A temporary file of its own, processes building at the same time each rename a complete file into place
+    simplified = tempfile.NamedTemporaryFile("w", dir=os.path.dirname(simplified_path), suffix=".tmp", delete=False)
+    try:
+        with simplified:
+            json.dump(regions, simplified, separators=(",", ":"))
+        os.replace(simplified.name, simplified_path)
+    finally:
+        if os.path.exists(simplified.name):
+            os.remove(simplified.name)
+    return regions
+
+
+_regions = None
+_regions_lock = threading.Lock()
+
+
+def load_regions():
+    """
+    The simplified region borders, read once per process.
+
+    They are simplified again only when the source file or the settings changed.
+    """
+    global _regions
+    settings = CONFIG["geo"]
+    with _regions_lock:
+        if _regions is None:
+            signature = _source_signature(settings["geojson_path"], settings)
+            regions = None
+            if os.path.exists(settings["simplified_path"]):
+                with open(settings["simplified_path"]) as simplified:
+                    regions = json.load(simplified)
+            if regions is None or regions.get("source_signature") != signature:
+                regions = build_simplified_regions()
+            _regions = regions
+        return _regions
+
+
+def locations(frame, is_sequential=False):
+    """
+    Province and Region of every candidate of ``frame``, None if it has neither location columns.
+
+    For sequential data only the first row of every sequence counts.
+    """
+    if is_sequential and ID_COLUMN in frame.columns:
+        frame = frame.drop_duplicates(subset=ID_COLUMN)
+    if "Region" in frame.columns:
+        return frame[[column for column in ("Province", "Region") if column in frame.columns]]
+    if "Residence" in frame.columns:
+        # Split the distinct values only, every row just looks its own up
+        residence = frame["Residence"].astype("category")
+        parts = residence.cat.categories.to_series().str.extract(RESIDENCE_PATTERN)
+        codes = residence.cat.codes.to_numpy()
+        known = codes >= 0
+        return pd.DataFrame({
+            column: np.where(known, parts[column].to_numpy(dtype=object)[codes], None)
+            for column in ("Province", "Region")
+        }, index=frame.index)
+    return None
+
+
+def count_locations(located):
+    """Candidates per Region and per (Region, Province) of the output of ``locations``."""
+    regions = located["Region"].astype(object).value_counts()
+    if "Province" in located.columns:
+        provinces = located[["Region", "Province"]].astype(object).value_counts()
+    else:
+        provinces = pd.Series(dtype="int64", index=pd.MultiIndex.from_arrays([[], []], names=["Region", "Province"]))
+    return regions, provinces
+
+
+class RealLocations:
+    """
+    Real candidates per Region and per Province, counted once and shared read-only.
+
+    Parameters:
+    - data (pd.DataFrame): The real data, with its Region and Province columns.
+    """
+
+    def __init__(self, data):
+        self.region_counts, self.province_counts = count_locations(locations(data))
+        self.num_rows = int(self.region_counts.sum())
+
+
+class GeoAccumulator:
+    """
+    Count synthetic candidates per Region and Province chunk by chunk, e.g. while they are being exported.
+
+    Frames without location columns are ignored.
+    """
+
+    def __init__(self, real_locations, is_sequential=False):
+        self.real = real_locations
+        self.is_sequential = is_sequential
+        self.counts = []
+
+    def update(self, frame):
+        located = locations(frame, self.is_sequential)
+        if located is not None:
+            self.counts.append(count_locations(located))
+
+    def report(self, by="Region"):
+        """
+        Returns:
+        - pd.DataFrame: Real and synthetic candidates (counts and shares) per
+          Region, or per Region and Province with ``by="Province"``, and the
+          difference of the shares, largest first.
+        """
+        position = 0 if by == "Region" else 1
+        real = self.real.region_counts if by == "Region" else self.real.province_counts
+        levels = list(range(real.index.nlevels))
+        chunks = [counts[position] for counts in self.counts]
+        synthetic = pd.concat(chunks).groupby(level=levels).sum() if chunks else pd.Series(dtype="int64")
+        table = pd.DataFrame({"real": real, "synthetic": synthetic}).fillna(0).astype("int64")
+        table["real_share"] = table["real"] / max(table["real"].sum(), 1)
+        table["synthetic_share"] = table["synthetic"] / max(table["synthetic"].sum(), 1)
+        table["difference"] = table["synthetic_share"] - table["real_share"]
+        table.index.names = ["Region"] if by == "Region" else ["Region", "Province"]
+        return table.reset_index().sort_values("difference", key=np.abs, ascending=False, ignore_index=True)
+
+
+def get_region_map(regions, report):
+    """
+    Choropleth of the synthetic minus the real share of the candidates per region.
+
+    Parameters:
+    - regions (dict): The simplified borders, see ``load_regions``.
+    - report (pd.DataFrame): ``GeoAccumulator.report()``, regions off the map are left out.
+    """
+    mapped = report[report["Region"].isin(list(REGION_NAMES))]
+    limit = max(float(mapped["difference"].abs().max()) * 100, 0.1) if len(mapped) else 1.0
+    fig = go.Figure(go.Choropleth(
+        geojson=regions,
+        featureidkey="properties.reg_name",
+        locations=mapped["Region"].map(REGION_NAMES),
+        z=mapped["difference"] * 100,
+        zmin=-limit, zmax=limit,
+        colorscale="RdBu_r",
+        colorbar_title="Synthetic - real<br>(points)",
+        customdata=np.column_stack([mapped["Region"], mapped["real_share"] * 100, mapped["synthetic_share"] * 100]),
+        hovertemplate="<b>%{customdata[0]}</b><br>Real: %{customdata[1]:.1f}%<br>"
+                      "Synthetic: %{customdata[2]:.1f}%<extra></extra>",
+        marker_line_width=0.5,
+    ))
+    fig.update_geos(fitbounds="locations", visible=False)
+    fig.update_layout(title="Share of the candidates per region, synthetic against real",
+                      margin={"l": 0, "r": 0, "t": 40, "b": 0}, height=550)
+    return fig
+
+
+if __name__ == "__main__":
+    path = CONFIG["geo"]["simplified_path"]
+    regions = build_simplified_regions()
+    points = sum(
+        len(ring) for feature in regions["features"]
+        for polygon in (feature["geometry"]["coordinates"] if feature["geometry"]["type"] == "MultiPolygon"
+                        else [feature["geometry"]["coordinates"]])
+        for ring in polygon
+    )
+    print(f"Wrote {path} ({len(regions['features'])} regions, {points} points, {os.path.getsize(path) / 1e3:.0f} KB)")
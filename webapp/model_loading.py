@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sdv.sequential import PARSynthesizer
+
+from config import CONFIG
+from par_inference import enable_batched_sampling
+from tracing import span
+
+# Loaded synthesizers shared by every caller in this process, Streamlit sessions
+# and reruns included, least recently used first:
+# abs path -> (file signature, synthesizer, memory in MB)
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+_path_locks = {}
+
+
+def file_signature(path):
+    """Cheap fingerprint of a model file, changes whenever the file is replaced."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def resident_memory_mb():
+    """Resident memory of this process, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def load_synthesizer(path):
+    # PARSynthesizer.load is SDV's generic loader, it returns whatever synthesizer was saved
+    with span("model_load", file=os.path.basename(path)):
+        synthesizer = PARSynthesizer.load(filepath=path)
+    settings = CONFIG["par_inference"]
+    if settings["enabled"]:
+        enable_batched_sampling(synthesizer, settings["batch_size"], settings["quantize"])
+    return synthesizer
+
+
+def _evict(keep, max_loaded_mb, max_loaded_models):
+    # Caller holds _loaded_lock. The model just loaded stays even when it alone is over the budget.
+    while len(_loaded) > 1:
+        total_mb = sum(memory_mb for _, _, memory_mb in _loaded.values())
+        if total_mb <= max_loaded_mb and len(_loaded) <= max_loaded_models:
+            break
+        oldest = next(iter(_loaded))
+        if oldest == keep:
+            _loaded.move_to_end(oldest)
+            continue
+        # Callers still sampling the evicted model keep their reference, it is freed once they are done
+        del _loaded[oldest]
+
+
+def get_synthesizer(path, memory_mb=None):
+    """
+    Return the synthesizer saved at ``path``, loading it on first use.
+
+    Every caller in the process gets the same instance. Concurrent first
+    calls for one path wait for a single load, and the model is loaded
+    again if the file on disk is replaced. The loaded models are kept
+    within ``CONFIG["registry"]``'s ``max_loaded_mb`` and
+    ``max_loaded_models``, the least recently used ones are dropped first.
+
+    Parameters:
+    - path (str): The saved synthesizer.
+    - memory_mb (float or None): Its memory once loaded (see registry.py),
+      measured while loading when not given.
+    """
+    key = os.path.abspath(path)
+    signature = file_signature(path)
+    with _loaded_lock:
+        if key in _loaded and _loaded[key][0] == signature:
+            _loaded.move_to_end(key)
+            return _loaded[key][1]
+        path_lock = _path_locks.setdefault(key, threading.Lock())
+    with path_lock:
+        with _loaded_lock:
+            if key in _loaded and _loaded[key][0] == signature:
+                _loaded.move_to_end(key)
+                return _loaded[key][1]
+        rss_before = resident_memory_mb()
+        synthesizer = load_synthesizer(path)
+        if memory_mb is None:
+            rss_after = resident_memory_mb()
+            # Other threads allocate meanwhile too, the file size is the floor of the estimate
+            memory_mb = max(signature[1] / 2 ** 20, (rss_after - rss_before) if rss_before is not None else 0)
+        with _loaded_lock:
+            _loaded[key] = (signature, synthesizer, memory_mb)
+            _loaded.move_to_end(key)
+            _evict(key, CONFIG["registry"]["max_loaded_mb"], CONFIG["registry"]["max_loaded_models"])
+        return synthesizer
+
+
+def loaded_models():
+    """Path -> memory in MB of the models held, least recently used first."""
+    with _loaded_lock:
+        return {key: memory_mb for key, (_, _, memory_mb) in _loaded.items()}
@@ -0,0 +1,234 @@
+"""
+Sharded sampling of multi-table synthesizers (the HMA of SDV_multitable.ipynb) straight to disk.
+
+A request for N candidates is split into shards of ``shard_size`` root rows
+(candidates), sampled independently over a pool of worker processes. Every
+shard gets its own range of keys for every table, ``index * shard_size *
+capacity + 1`` onwards, where ``capacity`` is the most rows of that table a
+single root row can have (e.g. the most events per candidate seen in
+training). Keys are renumbered into that range and the foreign keys with
+them, so shards never collide and never need to see each other. Each worker
+writes its shard's tables itself, one part file per table, so neither the
+workers nor the caller ever hold more than a shard:
+
+    output_dir/
+        metadata.json            # SDV metadata, keys and relationships
+        candidates/part-00000.parquet
+        events/part-00000.parquet
+        ...
+
+Every table directory reads back as one table, e.g. with
+``pd.read_parquet("output_dir/events")``.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from export import EXPORT_FORMATS, write_csv, write_parquet
+from generation import seed_synthesizer
+from model_loading import get_synthesizer, load_synthesizer
+from parallel_sampling import chunk_sizes
+from tracing import span
+
+# Formats a shard's tables can be written in, Excel has no use for part files
+SHARD_FORMATS = ["parquet", "csv"]
+
+# Synthesizer loaded once per worker process by _init_worker
+_worker_synthesizer = None
+
+
+def _init_worker(synthesizer_path, torch_threads):
+    global _worker_synthesizer
+    try:
+        import torch
+
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    _worker_synthesizer = load_synthesizer(synthesizer_path)
+
+
+def table_plan(synthesizer):
+    """
+    The root table and the key layout of a fitted multi-table synthesizer.
+
+    Returns:
+    - str: The table without parents, sampled ``num_rows`` at a time.
+    - dict: Table -> most rows a single root row can have in it.
+    - dict: Table -> primary key column (tables without one left out).
+    - list of dict: The relationships of the metadata.
+    """
+    metadata = synthesizer.get_metadata()
+    relationships = metadata.relationships
+    children = {relationship["child_table_name"] for relationship in relationships}
+    roots = [table for table in metadata.tables if table not in children]
+    if len(roots) != 1:
+        raise ValueError(f"Expected a single root table, got {roots}")
+    root = roots[0]
+    capacities = {root: 1}
+    pending = list(relationships)
+    while pending:
+        # Parents first, a table with several parents takes the largest of them
+        ready = [relationship for relationship in pending if relationship["parent_table_name"] in capacities]
+        if not ready:
+            raise ValueError("The relationships of the metadata contain a cycle")
+        for relationship in ready:
+            child, parent = relationship["child_table_name"], relationship["parent_table_name"]
+            num_rows_key = f"__{child}__{relationship['child_foreign_key']}__num_rows"
+            max_child_rows = int(synthesizer._max_child_rows.get(num_rows_key, 1))
+            capacities[child] = max(capacities.get(child, 0), capacities[parent] * max(1, max_child_rows))
+            pending.remove(relationship)
+    primary_keys = {
+        table: metadata.tables[table].primary_key for table in metadata.tables if metadata.tables[table].primary_key
+    }
+    return root, capacities, primary_keys, relationships
+
+
+def renumber_keys(tables, offsets, primary_keys, relationships):
+    """
+    Give every table's primary key the values ``offset + 1`` onwards, and the foreign keys with them.
+
+    Foreign keys pointing at no sampled parent become missing values.
+    """
+    tables = {name: frame.copy() for name, frame in tables.items()}
+    mappings = {}
+    for table, key in primary_keys.items():
+        frame = tables[table]
+        new_keys = np.arange(offsets[table] + 1, offsets[table] + len(frame) + 1, dtype=np.int64)
+        mappings[table] = pd.Series(new_keys, index=frame[key].to_numpy())
+        frame[key] = new_keys
+    for relationship in relationships:
+        parent, child = relationship["parent_table_name"], relationship["child_table_name"]
+        foreign_key = relationship["child_foreign_key"]
+        if parent in mappings:
+            tables[child][foreign_key] = tables[child][foreign_key].map(mappings[parent]).astype("Int64")
+    return tables
+
+
+def _stable_dtypes(frame, key_columns):
+    # A column can be whole numbers in one shard and have gaps in the next, keep every part on one schema
+    frame = frame.copy()
+    for column in frame.columns:
+        if column not in key_columns and pd.api.types.is_integer_dtype(frame[column].dtype):
+            frame[column] = frame[column].astype("float64")
+    return frame
+
+
+def write_shard(tables, output_dir, index, export_format, key_columns):
+    """Write every table of a shard to its part file, renamed into place once complete."""
+    extension = EXPORT_FORMATS[export_format]["extension"]
+    writer = write_parquet if export_format == "parquet" else write_csv
+    for table, frame in tables.items():
+        table_dir = os.path.join(output_dir, table)
+        os.makedirs(table_dir, exist_ok=True)
+        path = os.path.join(table_dir, f"part-{index:05d}.{extension}")
+        writer([_stable_dtypes(frame, key_columns.get(table, ()))], f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+
+def sample_shard(synthesizer, index, seed, num_rows, shard_size, output_dir, export_format):
+    """
+    Sample ``num_rows`` root rows with all their related rows and write them as shard ``index``.
+
+    Returns:
+    - int: The shard index.
+    - dict: Table -> number of rows written.
+    """
+    root, capacities, primary_keys, relationships = table_plan(synthesizer)
+    seed_synthesizer(synthesizer, seed)
+    with span("sample_shard", shard=index) as stage:
+        tables = synthesizer.sample(scale=num_rows / synthesizer._table_sizes[root])
+        stage.rows = len(tables[root])
+    offsets = {table: index * shard_size * capacity for table, capacity in capacities.items()}
+    for table, frame in tables.items():
+        if len(frame) > shard_size * capacities[table]:
+            raise RuntimeError(f"Shard {index} sampled {len(frame)} rows of {table}, more than its key range")
+    tables = renumber_keys(tables, offsets, primary_keys, relationships)
+    key_columns = {table: {key} for table, key in primary_keys.items()}
+    for relationship in relationships:
+        key_columns.setdefault(relationship["child_table_name"], set()).add(relationship["child_foreign_key"])
+    with span("write_shard", shard=index, format=export_format) as stage:
+        write_shard(tables, output_dir, index, export_format, key_columns)
+        stage.rows = sum(len(frame) for frame in tables.values())
+    return index, {table: len(frame) for table, frame in tables.items()}
+
+
+def _sample_shard_in_worker(*args, **kwargs):
+    return sample_shard(_worker_synthesizer, *args, **kwargs)
+
+
+class ShardedTableSampler:
+    """
+    Sample related tables in independent shards over a pool of worker processes.
+
+    Parameters:
+    - synthesizer_path (str): Path of the saved multi-table SDV synthesizer.
+    - max_workers (int or None): Number of worker processes, defaults to the number of cores.
+    - shard_size (int): Number of root rows (candidates) per shard.
+    - in_process (bool): Sample the shards one after the other in the calling process.
+    """
+
+    def __init__(self, synthesizer_path, max_workers=None, shard_size=1000, in_process=False):
+        self.synthesizer_path = synthesizer_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.in_process = in_process
+
+    def sample_to_dir(self, num_rows, output_dir, export_format="parquet", seed=None, progress=None):
+        """
+        Write ``num_rows`` root rows and their related rows under ``output_dir``.
+
+        ``progress`` is called as ``progress(done, total)`` every time a shard is written.
+        The shards of the same seed are the same, whatever worker ran them: every
+        shard is seeded on its own, see generation.seed_synthesizer.
+
+        Returns:
+        - dict: Table -> number of rows written.
+        """
+        if export_format not in SHARD_FORMATS:
+            raise ValueError(f"Unknown format {export_format!r}, expected one of {SHARD_FORMATS}")
+        if os.path.isdir(output_dir) and os.listdir(output_dir):
+            raise ValueError(f"{output_dir} is not empty")
+        os.makedirs(output_dir, exist_ok=True)
+        sizes = chunk_sizes(num_rows, self.shard_size)
+        seeds = [int(shard_seed) for shard_seed in np.random.SeedSequence(seed).generate_state(len(sizes))]
+        tasks = [
+            (index, shard_seed, size, self.shard_size, output_dir, export_format)
+            for index, (size, shard_seed) in enumerate(zip(sizes, seeds))
+        ]
+
+        totals = {}
+
+        def add(counts, done):
+            for table, count in counts.items():
+                totals[table] = totals.get(table, 0) + count
+            if progress is not None:
+                progress(done, len(tasks))
+
+        synthesizer = get_synthesizer(self.synthesizer_path)
+        synthesizer.get_metadata().save_to_json(os.path.join(output_dir, "metadata.json"))
+        if self.in_process:
+            for done, task in enumerate(tasks, start=1):
+                add(sample_shard(synthesizer, *task)[1], done)
+            return totals
+
+        workers = min(self.max_workers, len(tasks)) or 1
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+        # A fresh pool per request, the shards of one request are long enough to pay for it
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.synthesizer_path, torch_threads),
+        ) as executor:
+            futures = [executor.submit(_sample_shard_in_worker, *task) for task in tasks]
+            try:
+                for done, future in enumerate(as_completed(futures), start=1):
+                    add(future.result()[1], done)
+            finally:
+                for future in futures:
+                    future.cancel()
+        return totals
@@ -0,0 +1,37 @@
+"""
+Orders of the ordinal columns of the candidate data.
+
+Shared by ingestion.py (``load_dataset(ordinal=True)``) and
+reference_data.py, and free of dependencies so that both can import it.
+"""
+
+RAL_ORDER = [
+    "- 20 K", "20-22 K", "22-24 K", "24-26 K", "26-28 K", "28-30 K", "30-32 K", "32-34 K", "34-36 K",
+    "36-38 K", "38-40 K", "40-42 K", "42-44 K", "44-46 K", "46-48 K", "48-50 K", "+ 50 K",
+]
+# Minimum Ral and Ral Maximum write the same bands without the space
+RAL_RANGE_ORDER = [band.replace(" K", "K") for band in RAL_ORDER]
+STUDY_ORDER = [
+    "Middle school diploma", "High school graduation", "Professional qualification",
+    "Three-year degree", "Five-year degree", "master's degree", "Doctorate",
+]
+YEARS_EXPERIENCE_ORDER = ["[0]", "[0-1]", "[1-3]", "[3-5]", "[5-7]", "[7-10]", "[+10]"]
+AGE_RANGE_ORDER = [
+    "< 20 years", "20 - 25 years", "26 - 30 years", "31 - 35 years",
+    "36 - 40 years", "40 - 45 years", "> 45 years",
+]
+
+# Ordinal orders of data_cleaning_Jarno.ipynb, extended to the columns sharing their levels
+ORDINAL_ORDERS = {
+    "Age Range": AGE_RANGE_ORDER,
+    "Study Title": STUDY_ORDER,
+    "Study Level": STUDY_ORDER,
+    "Years Experience": YEARS_EXPERIENCE_ORDER,
+    "Years Experience.1": YEARS_EXPERIENCE_ORDER,
+    "Minimum Ral": RAL_RANGE_ORDER,
+    "Ral Maximum": RAL_RANGE_ORDER,
+    "Current Ral": RAL_ORDER,
+    "Expected Ral": RAL_ORDER,
+}
+# The columns data_cleaning_Jarno.ipynb itself orders
+NOTEBOOK_ORDINAL_COLUMNS = ["Study Title", "Current Ral", "Expected Ral", "Years Experience", "Age Range"]
@@ -0,0 +1,429 @@
+"""
+Batched CPU sampling of the sequences of PAR models.
+
+SDV samples a PARSynthesizer one sequence at a time, and every step of a
+sequence runs the network again over all the steps sampled before it.
+``BatchedPARSampler`` steps a batch of sequences together instead: it carries
+the recurrent state from one step to the next, computes the context part of
+the input layer once per sequence and runs without autograd, so a step is a
+few matrix products for the whole batch. With ``quantize=True`` the
+recurrent and linear layers run dynamically quantized to int8.
+
+Sequences come from the same distributions as with SDV's sampler (the same
+network, the same sampling of every column and of the end token), but a
+seed gives other rows. ``model_loading.load_synthesizer`` switches the PAR
+models it loads over when ``CONFIG["par_inference"]["enabled"]`` (off by
+default). The sampler stands in for private parts of SDV and deepecho, so
+it is only used with the versions in ``TESTED_VERSIONS`` and models that
+have every attribute it reads; anything else keeps SDV's sampler. The
+benchmark times SDV's sampler against the batched float and int8 ones and
+scores their events against a sample of SDV's sampler:
+
+    python webapp/par_inference.py benchmark --sequences 500
+    python webapp/par_inference.py benchmark --sequences 2000 --batch-size 256 -o par_inference.json
+"""
+import argparse
+import copy
+import functools
+import sys
+import time
+import warnings
+from importlib.metadata import PackageNotFoundError, version
+
+import numpy as np
+import pandas as pd
+import torch
+
+from config import CONFIG
+
+CONTINUOUS_TYPES = ["continuous", "datetime", "timestamp"]
+CATEGORICAL_TYPES = ["categorical", "ordinal"]
+# Releases whose private sampling internals BatchedPARSampler was checked against, by version prefix
+TESTED_VERSIONS = {"sdv": "1.17.", "deepecho": "0.8."}
+# Private attributes read from a PARSynthesizer, its PARModel and the model's PARNet
+SYNTHESIZER_ATTRIBUTES = [
+    "_sample_from_par", "_data_columns", "_output_columns", "_extra_context_columns", "extended_columns",
+    "context_columns", "_sequence_key", "_sequence_index",
+]
+MODEL_ATTRIBUTES = ["_model", "_data_map", "_data_dims", "_ctx_dims", "_context_to_tensor", "_min_length",
+                    "_max_length", "sample_size"]
+NET_ATTRIBUTES = ["down", "up", "rnn", "context_size"]
+
+
+class _StepNet(torch.nn.Module):
+    """A PARNet taking one step of a batch and the recurrent state, with its input layer split in two."""
+
+    def __init__(self, net):
+        super().__init__()
+        data_size = net.up.out_features
+        hidden_size = net.down.out_features
+        weight = net.down.weight.detach().cpu()
+        # down(cat([x, c])) == data_in(x) + context_in(c)
+        self.data_in = torch.nn.Linear(data_size, hidden_size)
+        self.data_in.weight = torch.nn.Parameter(weight[:, :data_size].clone())
+        self.data_in.bias = torch.nn.Parameter(net.down.bias.detach().cpu().clone())
+        self.context_in = None
+        if net.context_size:
+            self.context_in = torch.nn.Linear(net.context_size, hidden_size, bias=False)
+            self.context_in.weight = torch.nn.Parameter(weight[:, data_size:].clone())
+        self.rnn = copy.deepcopy(net.rnn).cpu()
+        self.up = copy.deepcopy(net.up).cpu()
+
+    def forward(self, x, context_term, state):
+        hidden = self.data_in(x)
+        if context_term is not None:
+            hidden = hidden + context_term
+        output, state = self.rnn(hidden.unsqueeze(0), state)
+        return self.up(output[0]), state
+
+
+class BatchedPARSampler:
+    """
+    Sample many sequences of a fitted deepecho PARModel at once on the CPU.
+
+    Parameters:
+    - model: The PARModel of a PARSynthesizer (``synthesizer._model``).
+    - quantize (bool): Run the recurrent and linear layers dynamically quantized to int8.
+    """
+
+    def __init__(self, model, quantize=False):
+        self.model = model
+        self.quantize = quantize
+        step_net = _StepNet(model._model).eval()
+        if quantize:
+            step_net = torch.ao.quantization.quantize_dynamic(
+                step_net, {torch.nn.Linear, torch.nn.GRU, torch.nn.LSTM}, dtype=torch.qint8
+            )
+        self.step_net = step_net
+        self._columns = []
+        for key, props in model._data_map.items():
+            if props["type"] in CATEGORICAL_TYPES:
+                indices = torch.tensor(list(props["indices"].values()))
+                self._columns.append((key, "categorical", props, indices))
+            elif props["type"] in CONTINUOUS_TYPES or props["type"] == "count":
+                self._columns.append((key, props["type"], props, props["indices"]))
+            else:
+                raise ValueError(f"Unsupported type: {props['type']}")
+        token = model._data_map["<TOKEN>"]["indices"]
+        self._start, self._end, self._body = token["<START>"], token["<END>"], token["<BODY>"]
+
+    def _sample_state(self, x):
+        # The batched _sample_state of deepecho: draw every column from the network output and
+        # write the draws over it, the rest of the output is fed back as it is
+        log_likelihood = torch.zeros(len(x))
+        values = {}
+        for key, kind, props, indices in self._columns:
+            if kind == "categorical":
+                probabilities = torch.softmax(x[:, indices], dim=1)
+                codes = torch.multinomial(probabilities, 1)
+                log_likelihood += torch.log(probabilities.gather(1, codes)).squeeze(1)
+                x[:, indices] = torch.zeros_like(probabilities).scatter_(1, codes, 1.0)
+                values[key] = codes.squeeze(1)
+                continue
+
+            value_idx, param_idx, missing_idx = indices
+            if kind == "count":
+                dist = torch.distributions.NegativeBinomial(
+                    torch.nn.functional.softplus(x[:, value_idx]) * props["range"], torch.sigmoid(x[:, param_idx])
+                )
+            else:
+                dist = torch.distributions.Normal(x[:, value_idx], torch.nn.functional.softplus(x[:, param_idx]))
+            value = dist.sample()
+            log_likelihood += dist.log_prob(value)
+            if kind == "count":
+                value = value / props["range"]
+            missing_dist = torch.distributions.Bernoulli(torch.sigmoid(x[:, missing_idx]))
+            missing = missing_dist.sample()
+            log_likelihood += missing_dist.log_prob(missing)
+            x[:, value_idx] = value * (1.0 - missing)
+            x[:, param_idx] = 0.0
+            x[:, missing_idx] = missing
+            values[key] = torch.stack([x[:, value_idx], missing], dim=1)
+        return x, values, log_likelihood
+
+    def _sample_batch(self, context, batch_size, min_length, max_length):
+        x = torch.zeros(batch_size, self.model._data_dims)
+        x[:, self._start] = 1.0
+        context_term = self.step_net.context_in(context) if context is not None else None
+        state = None
+        lengths = torch.full((batch_size,), max_length, dtype=torch.long)
+        active = torch.ones(batch_size, dtype=torch.bool)
+        log_likelihood = torch.zeros(batch_size)
+        steps = []
+        for step in range(max_length):
+            output, state = self.step_net(x, context_term, state)
+            x, values, step_log_likelihood = self._sample_state(output)
+            log_likelihood += step_log_likelihood * active
+            steps.append(values)
+            end = x[:, self._end] > 0.0
+            stop = end & active & (step + 1 >= min_length)
+            lengths[stop] = step + 1
+            active &= ~stop
+            if not active.any():
+                break
+            # Sequences too short to end go on with a body token, as in SDV's sampler
+            x[end, self._body] = 1.0
+            x[end, self._end] = 0.0
+
+        columns = {}
+        for key in steps[0]:
+            stacked = torch.stack([values[key] for values in steps])
+            if len(steps) < max_length:
+                padding = torch.zeros((max_length - len(steps),) + stacked.shape[1:], dtype=stacked.dtype)
+                stacked = torch.cat([stacked, padding])
+            columns[key] = stacked
+        return columns, lengths, log_likelihood
+
+    def _decode(self, columns, lengths):
+        # Steps past the end of a sequence are dropped, the rest is laid out sequence after sequence
+        max_length = next(iter(columns.values())).shape[0]
+        mask = (torch.arange(max_length).unsqueeze(1) < lengths.unsqueeze(0)).T
+        data = [None] * (len(self.model._data_map) - 1)
+        for key, kind, props, _ in self._columns:
+            if key == "<TOKEN>":
+                continue
+            values = columns[key].transpose(0, 1)[mask].numpy()
+            if kind == "categorical":
+                categories = np.empty(len(props["indices"]), dtype=object)
+                categories[:] = list(props["indices"])
+                data[key] = categories[values].tolist()
+                continue
+            nulls = props["nulls"]
+            if kind == "count":
+                data[key] = [
+                    None if missing > 0 and nulls else int(value * props["range"] + props["min"])
+                    for value, missing in values
+                ]
+            else:
+                data[key] = [
+                    None if missing > 0 and nulls else float(value) * props["std"] + props["mu"]
+                    for value, missing in values
+                ]
+        return data
+
+    def sample_sequences(self, contexts, sequence_length=None, batch_size=512):
+        """
+        Sample one sequence per context.
+
+        Parameters:
+        - contexts (list of list): Context values of every sequence, as SDV passes them to ``sample_sequence``.
+        - sequence_length (int or None): Force every sequence to this length, sampled otherwise.
+        - batch_size (int): Sequences stepped together.
+
+        Returns:
+        - list of list: Per data column, the values of all the sequences one after the other.
+        - np.ndarray: The length of every sequence.
+        """
+        model = self.model
+        if sequence_length is not None:
+            min_length = max_length = sequence_length
+        else:
+            min_length, max_length = model._min_length, model._max_length
+        data = [[] for _ in range(len(model._data_map) - 1)]
+        all_lengths = []
+        with torch.inference_mode():
+            for start in range(0, len(contexts), batch_size):
+                batch = contexts[start:start + batch_size]
+                context = None
+                if model._ctx_dims:
+                    context = torch.stack([model._context_to_tensor(values).cpu() for values in batch])
+                best = None
+                for _ in range(model.sample_size):
+                    columns, lengths, log_likelihood = self._sample_batch(context, len(batch), min_length, max_length)
+                    if best is None:
+                        best = columns, lengths, log_likelihood
+                        continue
+                    # Keep the most likely of sample_size draws of every sequence
+                    better = log_likelihood > best[2]
+                    best = (
+                        {
+                            key: torch.where(better.view(1, -1, *[1] * (value.dim() - 2)), value, best[0][key])
+                            for key, value in columns.items()
+                        },
+                        torch.where(better, lengths, best[1]),
+                        torch.where(better, log_likelihood, best[2]),
+                    )
+                for key, values in enumerate(self._decode(best[0], best[1])):
+                    data[key].extend(values)
+                all_lengths.append(best[1].numpy())
+        lengths = np.concatenate(all_lengths) if all_lengths else np.zeros(0, dtype=np.int64)
+        return data, lengths
+
+
+def sample_from_par(synthesizer, context, sequence_length=None, sampler=None, batch_size=512):
+    """Batched stand-in for ``PARSynthesizer._sample_from_par``, same input and output."""
+    context_columns = synthesizer.context_columns + list(synthesizer._extra_context_columns.keys())
+    if synthesizer._sequence_key:
+        context = context.set_index(synthesizer._sequence_key)
+        context = context[context_columns]
+    rows = [values.tolist() for _, values in context.iterrows()]
+    data, lengths = sampler.sample_sequences(rows, sequence_length, batch_size)
+
+    output = pd.DataFrame(dict(zip(synthesizer._data_columns, data)), columns=synthesizer._data_columns)
+    if synthesizer._sequence_index:
+        index_column = synthesizer._sequence_index
+        diffs = synthesizer.extended_columns[index_column].reverse_transform(
+            pd.DataFrame({index_column: output[index_column]})
+        )[index_column].to_numpy()
+        start_index = context_columns.index(f"{index_column}.context")
+        starts = np.repeat([row[start_index] for row in rows], lengths)
+        firsts = np.repeat(diffs[np.cumsum(lengths) - lengths], lengths)
+        sequences = np.repeat(np.arange(len(lengths)), lengths)
+        output[index_column] = pd.Series(diffs).groupby(sequences).cumsum().to_numpy() - firsts + starts
+
+    if synthesizer._sequence_key:
+        keys = context.index.repeat(lengths)
+        for level, column in enumerate(synthesizer._sequence_key):
+            output[column] = keys.get_level_values(level)
+    context_values = pd.DataFrame(rows, columns=context_columns)
+    for column in context_columns:
+        output[column] = context_values[column].to_numpy().repeat(lengths)
+    return output[synthesizer._output_columns].reset_index(drop=True)
+
+
+def is_par(synthesizer):
+    from sdv.sequential import PARSynthesizer
+
+    return isinstance(synthesizer, PARSynthesizer) and getattr(synthesizer, "_model", None) is not None
+
+
+@functools.lru_cache(maxsize=None)
+def untested_versions():
+    """The installed SDV and deepecho releases BatchedPARSampler was not checked against, as name -> version."""
+    untested = {}
+    for package, prefix in TESTED_VERSIONS.items():
+        try:
+            installed = version(package)
+        except PackageNotFoundError:
+            installed = None
+        if installed is None or not installed.startswith(prefix):
+            untested[package] = installed
+    return untested
+
+
+def missing_attributes(synthesizer):
+    """The private attributes of a fitted PARSynthesizer that BatchedPARSampler reads and cannot find."""
+    model = synthesizer._model
+    net = getattr(model, "_model", None)
+    return [
+        name for owner, names in ((synthesizer, SYNTHESIZER_ATTRIBUTES), (model, MODEL_ATTRIBUTES), (net, NET_ATTRIBUTES))
+        for name in names if not hasattr(owner, name)
+    ]
+
+
+def enable_batched_sampling(synthesizer, batch_size=512, quantize=False):
+    """
+    Sample the sequences of a fitted PARSynthesizer with ``BatchedPARSampler`` from now on.
+
+    Other synthesizers are left as they are, and so are PAR models when the
+    installed SDV is untested or the model lacks what the sampler reads, with a warning.
+    """
+    if not is_par(synthesizer):
+        return synthesizer
+    untested = untested_versions()
+    missing = missing_attributes(synthesizer)
+    if untested or missing:
+        reason = f"untested versions {untested}" if untested else f"missing attributes {missing}"
+        warnings.warn(f"Keeping SDV's PAR sampler: {reason}", RuntimeWarning, stacklevel=2)
+        return synthesizer
+    sampler = BatchedPARSampler(synthesizer._model, quantize)
+    synthesizer._sample_from_par = functools.partial(
+        sample_from_par, synthesizer, sampler=sampler, batch_size=batch_size
+    )
+    synthesizer._sampling_mode = "batched-int8" if quantize else "batched"
+    return synthesizer
+
+
+def disable_batched_sampling(synthesizer):
+    """Go back to SDV's own sampler."""
+    synthesizer.__dict__.pop("_sample_from_par", None)
+    synthesizer.__dict__.pop("_sampling_mode", None)
+    return synthesizer
+
+
+def sampling_mode(synthesizer):
+    """How a loaded synthesizer samples, "sdv" unless ``enable_batched_sampling`` switched it over."""
+    return getattr(synthesizer, "_sampling_mode", "sdv")
+
+
+def fidelity_check(synthesizer, num_sequences, seed=0, batch_size=512, quantize=True):
+    """
+    Time SDV's sampler and the batched ones, and score the batched samples against SDV's.
+
+    The sequence columns of every row (event) are counted with ``fidelity.py``
+    against the histograms of an SDV sample of ``seed``. Every sampler draws
+    from ``seed + 1``, so SDV's own score is the noise floor at that size.
+
+    Returns:
+    - pd.DataFrame: Per sampler the sequences/s, the mean sequence length and the
+      mean and lowest total variation complement over the columns.
+    """
+    from fidelity import fidelity_report, get_real_histograms
+    from generation import ID_COLUMN, seed_synthesizer
+
+    def draw(draw_seed):
+        seed_synthesizer(synthesizer, draw_seed)
+        start = time.perf_counter()
+        frame = synthesizer.sample(num_sequences=num_sequences)
+        return frame, time.perf_counter() - start
+
+    disable_batched_sampling(synthesizer)
+    reference, _ = draw(seed)
+    columns = synthesizer._data_columns
+    histograms = get_real_histograms(reference[columns])
+    samplers = [("sdv", None), ("batched", False)] + ([("batched-int8", True)] if quantize else [])
+    rows = []
+    for name, quantized in samplers:
+        if quantized is not None:
+            enable_batched_sampling(synthesizer, batch_size, quantized)
+        frame, seconds = draw(seed + 1)
+        disable_batched_sampling(synthesizer)
+        column_scores, _ = fidelity_report(histograms, frame[columns])
+        rows.append({
+            "sampler": name,
+            "sequences": num_sequences,
+            "seconds": seconds,
+            "sequences_per_second": num_sequences / seconds,
+            "mean_length": len(frame) / frame[ID_COLUMN].nunique(),
+            "mean_tv_complement": column_scores["tv_complement"].mean(),
+            "min_tv_complement": column_scores["tv_complement"].min(),
+        })
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    benchmark = commands.add_parser("benchmark", help="Time and score the batched samplers against SDV's")
+    benchmark.add_argument("--model", default=CONFIG["models"]["sequential"]["path"], help="Saved PARSynthesizer")
+    benchmark.add_argument("--sequences", type=int, default=500)
+    benchmark.add_argument("--batch-size", type=int, default=CONFIG["par_inference"]["batch_size"])
+    benchmark.add_argument("--seed", type=int, default=0)
+    benchmark.add_argument("--threads", type=int, default=1, help="Torch threads, 1 gives sequences/s per core")
+    benchmark.add_argument("--no-quantize", action="store_true", help="Leave the int8 model out")
+    benchmark.add_argument("--tolerance", type=float, default=0.02,
+                           help="Fail when a batched sampler scores this much below SDV's noise floor")
+    benchmark.add_argument("-o", "--output", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    from model_loading import load_synthesizer
+
+    torch.set_num_threads(args.threads)
+    synthesizer = load_synthesizer(args.model)
+    if not is_par(synthesizer):
+        print(f"error: {args.model} is not a fitted PARSynthesizer", file=sys.stderr)
+        return 2
+    results = fidelity_check(synthesizer, args.sequences, args.seed, args.batch_size, not args.no_quantize)
+    print(results.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    if args.output:
+        results.to_json(args.output, orient="records", indent=2)
+    floor = results.loc[results["sampler"] == "sdv", "mean_tv_complement"].iloc[0]
+    failed = results[results["mean_tv_complement"] < floor - args.tolerance]
+    if not failed.empty:
+        print(f"error: {', '.join(failed['sampler'])} below SDV's noise floor {floor:.3f}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
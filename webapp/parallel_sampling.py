@@ -0,0 +1,179 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from config import CONFIG
+from generation import (
+    ID_COLUMN,
+    create_context,
+    generate_data_no_bias,
+    generate_data_quota,
+    renumber_ids,
+    seed_synthesizer,
+)
+from model_loading import get_synthesizer, load_synthesizer
+from tracing import span
+
+# Synthesizer loaded once per worker process by _init_worker
+_worker_synthesizer = None
+
+
+def _init_worker(synthesizer_path, torch_threads):
+    global _worker_synthesizer
+    try:
+        import torch
+
+        # Workers already split the cores between them, so keep torch from oversubscribing
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    _worker_synthesizer = load_synthesizer(synthesizer_path)
+
+
+def sample_chunk(synthesizer, index, seed, is_sequential, num_sequences, column_name=None, context=None):
+    # In a worker this span starts a trace of its own, the caller's trace times the whole request
+    with span("sample_chunk", chunk=index) as stage:
+        seed_synthesizer(synthesizer, seed)
+        if context is None:
+            generated_data = generate_data_no_bias(synthesizer, num_sequences, is_sequential)
+        elif is_sequential:
+            generated_data = synthesizer.sample_sequential_columns(context_columns=context)
+        else:
+            counts = context[column_name].value_counts()
+            category_percentages = {category: 100 * count / len(context) for category, count in counts.items()}
+            generated_data, _ = generate_data_quota(
+                synthesizer, column_name, category_percentages, len(context), is_sequential,
+                **CONFIG["conditional_sampling"],
+            )
+        stage.rows = len(generated_data)
+    return index, generated_data
+
+
+def _sample_chunk_in_worker(*args, **kwargs):
+    return sample_chunk(_worker_synthesizer, *args, **kwargs)
+
+
+def chunk_sizes(total, chunk_size):
+    """Split ``total`` into chunks of at most ``chunk_size``."""
+    full, rest = divmod(total, chunk_size)
+    return [chunk_size] * full + ([rest] if rest else [])
+
+
+class ParallelSampler:
+    """
+    Sample large requests in chunks spread over a pool of worker processes.
+
+    Every worker loads its own copy of the synthesizer once and seeds it per
+    chunk (see generation.seed_synthesizer, which also takes the workers'
+    hash seeds out of the Faker columns), so chunks are independent of the
+    worker that ran them. Results are
+    merged in chunk order with fresh, non-overlapping IDs.
+
+    With ``in_process=True`` the same chunks are sampled one after the other
+    in the calling process, which avoids starting workers for small requests
+    and gives the same rows for the same seed.
+
+    Parameters:
+    - synthesizer_path (str): Path of the saved SDV synthesizer.
+    - is_sequential (bool): Whether the synthesizer is a PARSynthesizer.
+    - max_workers (int or None): Number of worker processes, defaults to the number of cores.
+    - chunk_size (int): Number of sequences (or rows) sampled per task.
+    - in_process (bool): Sample in the calling process instead of a process pool.
+    """
+
+    def __init__(self, synthesizer_path, is_sequential, max_workers=None, chunk_size=250, in_process=False):
+        self.synthesizer_path = synthesizer_path
+        self.is_sequential = is_sequential
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.in_process = in_process
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            torch_threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+            # torch does not survive a fork once it has started its thread pools
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.synthesizer_path, torch_threads),
+            )
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def sample_unbiased(self, num_sequences, seed=None, progress=None):
+        return renumber_ids(self.iter_unbiased(num_sequences, seed, progress))
+
+    def sample_biased(self, column_name, category_percentages, num_sequences, seed=None, progress=None):
+        return renumber_ids(
+            self.iter_biased(column_name, category_percentages, num_sequences, seed, progress)
+        )
+
+    def iter_unbiased(self, num_sequences, seed=None, progress=None):
+        tasks = [{"num_sequences": size} for size in chunk_sizes(num_sequences, self.chunk_size)]
+        return self._iter_chunks(tasks, seed, progress)
+
+    def iter_biased(self, column_name, category_percentages, num_sequences, seed=None, progress=None):
+        context = create_context(column_name, category_percentages, num_sequences)
+        # Shuffle so that every chunk gets the same category mix
+        context = context.sample(frac=1, random_state=seed).reset_index(drop=True)
+        tasks = []
+        start = 0
+        for size in chunk_sizes(len(context), self.chunk_size):
+            tasks.append({
+                "num_sequences": size,
+                "column_name": column_name,
+                "context": context.iloc[start:start + size].reset_index(drop=True),
+            })
+            start += size
+        return self._iter_chunks(tasks, seed, progress)
+
+    def _iter_chunks(self, tasks, seed, progress):
+        """
+        Run the chunk tasks, yielding their results in chunk order as soon as possible.
+
+        Every yielded chunk already has its final IDs, so chunks can be written out
+        one at a time. ``progress`` is called as ``progress(done, total)`` every time
+        a chunk finishes.
+        """
+        seeds = [int(chunk_seed) for chunk_seed in np.random.SeedSequence(seed).generate_state(len(tasks))]
+        futures = []
+        if self.in_process:
+            synthesizer = get_synthesizer(self.synthesizer_path)
+            results = (
+                sample_chunk(synthesizer, index, chunk_seed, self.is_sequential, **task)
+                for index, (task, chunk_seed) in enumerate(zip(tasks, seeds))
+            )
+        else:
+            executor = self._get_executor()
+            futures = [
+                executor.submit(_sample_chunk_in_worker, index, chunk_seed, self.is_sequential, **task)
+                for index, (task, chunk_seed) in enumerate(zip(tasks, seeds))
+            ]
+            results = (future.result() for future in as_completed(futures))
+
+        finished = {}
+        next_index = 0
+        next_id = 1
+        try:
+            for done, (index, frame) in enumerate(results, start=1):
+                finished[index] = frame
+                if progress is not None:
+                    progress(done, len(tasks))
+                while next_index in finished:
+                    chunk = renumber_ids([finished.pop(next_index)], start=next_id)
+                    next_index += 1
+                    if chunk.empty:
+                        continue
+                    next_id += chunk[ID_COLUMN].nunique() if ID_COLUMN in chunk.columns else 0
+                    yield chunk
+        finally:
+            for future in futures:
+                future.cancel()
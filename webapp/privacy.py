@@ -0,0 +1,221 @@
+"""
+Exact copies and distance to closest record (DCR) of synthetic candidates against the real ones.
+
+The real candidates are indexed once (``get_privacy_index``): every real row
+is hashed for exact copies, and the distinct real rows are encoded as
+vectors of their categorical and numeric columns for the distances.
+Unordered categories are one-hot encoded so that two different categories
+are 1 apart, ordinal and numeric columns are scaled to [0, 1] and missing
+values get an indicator of their own. Unordered columns with more than
+``max_categories`` categories (e.g. City) only count for the exact copies.
+
+The distances of a block of synthetic rows to every indexed real row come out
+of one matrix product. A DCR is divided by the square root of the number of
+encoded columns, so 0 is a copy on all of them and 1 differs in every one.
+Synthetic candidates closer to a real one than ``near_copy_quantile`` of
+the real candidates are to each other count as near copies.
+
+From a notebook (repository root):
+
+    import sys; sys.path.insert(0, "webapp")
+    from privacy import privacy_report
+    report = privacy_report(real_data, synthetic_data)
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_numeric_dtype
+
+from config import CONFIG
+from tracing import span
+
+# Same as generation.ID_COLUMN, not imported so that notebooks can use this module without SDV
+ID_COLUMN = "ID"
+# Synthetic rows compared with the whole index at once, bounds the block of distances
+BLOCK_ROWS = 2048
+# Squared distances below this are copies, see PrivacyIndex.dcr_of
+SQUARED_TOLERANCE = 1e-4
+# One-hot value that puts two different categories at a distance of 1
+ONE_HOT = np.float32(np.sqrt(0.5))
+
+
+class PrivacyIndex:
+    """
+    Hashes and encoded vectors of the real rows, built once and shared read-only.
+
+    Parameters:
+    - data (pd.DataFrame): The real data, with the dtypes of reference_data.apply_schema.
+    - columns (list or None): Columns to compare, all but the ID by default.
+    - max_categories (int): Unordered columns with more categories are left out of the distances.
+    - near_copy_quantile (float): Quantile of the real rows' DCR to each other below which a synthetic row is a near copy.
+    """
+
+    def __init__(self, data, columns=None, max_categories=50, near_copy_quantile=0.05):
+        self.columns = [column for column in (columns or data.columns) if column != ID_COLUMN]
+        self.numeric_columns = {column for column in self.columns if is_numeric_dtype(data[column].dtype)}
+        self.features = []
+        for column in self.columns:
+            dtype = data[column].dtype
+            if column in self.numeric_columns:
+                values = data[column].astype("float64")
+                low, high = values.min(), values.max()
+                self.features.append((column, "numeric", (low, high - low if high > low else 1.0)))
+            elif isinstance(dtype, CategoricalDtype) and dtype.ordered:
+                self.features.append((column, "ordinal", dtype))
+            else:
+                categories = pd.Index(data[column].dropna().unique())
+                if len(categories) <= max_categories:
+                    self.features.append((column, "categorical", categories))
+        self.distance_columns = [column for column, _, _ in self.features]
+
+        self.real_rows = len(data)
+        self.hashes = np.unique(self.hash_rows(data))
+        self.vectors, counts = np.unique(self.encode(data), axis=0, return_counts=True)
+        self.norms = (self.vectors ** 2).sum(axis=1)
+        self._transposed = np.ascontiguousarray(self.vectors.T)
+        # A real row's closest other row is a copy of itself if it has one
+        own = np.where(counts > 1, 0.0, self.dcr_of(self.vectors, exclude_self=True))
+        self.real_dcr = np.repeat(own, counts)
+        self.near_copy_distance = float(np.quantile(self.real_dcr, near_copy_quantile)) if len(own) else 0.0
+
+    def hash_rows(self, frame):
+        """Hash of every row over the compared columns, the same for equal values whatever their dtypes."""
+        normalized = pd.DataFrame({
+            column: (pd.to_numeric(frame[column], errors="coerce").astype("float64")
+                     if column in self.numeric_columns else frame[column].astype("string"))
+            for column in self.columns
+        })
+        return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+    def encode(self, frame):
+        """The rows of ``frame`` as float32 vectors, unknown categories are 1 away from every real one."""
+        rows = np.arange(len(frame))
+        blocks = []
+        for column, kind, spec in self.features:
+            values = frame[column]
+            missing = values.isna().to_numpy()
+            if kind == "categorical":
+                block = np.zeros((len(frame), len(spec) + 1), dtype=np.float32)
+                codes = spec.get_indexer(values.astype(object))
+                codes[missing] = len(spec)
+                known = codes >= 0
+                block[rows[known], codes[known]] = ONE_HOT
+            else:
+                if kind == "ordinal":
+                    codes = pd.Categorical(values.astype(object), dtype=spec).codes
+                    missing = codes < 0
+                    scaled = codes / max(len(spec.categories) - 1, 1)
+                else:
+                    low, value_range = spec
+                    scaled = (pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64") - low) / value_range
+                block = np.column_stack([np.where(missing, 0.0, scaled), missing]).astype(np.float32)
+            blocks.append(block)
+        if not blocks:
+            return np.zeros((len(frame), 0), dtype=np.float32)
+        return np.hstack(blocks)
+
+    def dcr_of(self, vectors, exclude_self=False):
+        """Distance of every encoded row to its closest indexed real row, see the module docstring."""
+        squared = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            block = vectors[start:start + BLOCK_ROWS]
+            distances = block @ self._transposed
+            distances *= -2
+            distances += self.norms
+            distances += (block ** 2).sum(axis=1, keepdims=True)
+            if exclude_self:
+                # The index's own vectors, each leaves itself out
+                distances[np.arange(len(block)), np.arange(start, start + len(block))] = np.inf
+            squared[start:start + len(block)] = distances.min(axis=1) if distances.shape[1] else np.inf
+        # float32 leaves a copy up to ~1e-5 away, far below one step of an ordinal (1 / 16 squared)
+        squared[squared < SQUARED_TOLERANCE] = 0.0
+        return np.sqrt(squared) / np.sqrt(max(len(self.distance_columns), 1))
+
+    def check(self, frame):
+        """
+        Exact copies and DCR of every row of ``frame``.
+
+        Returns:
+        - np.ndarray: Whether the row equals a real row on every compared column.
+        - np.ndarray: The row's distance to its closest real row.
+        """
+        exact = np.isin(self.hash_rows(frame), self.hashes)
+        return exact, self.dcr_of(self.encode(frame))
+
+
+class PrivacyAccumulator:
+    """
+    Check synthetic data chunk by chunk, e.g. while it is being exported.
+
+    The index is built for the real columns the first chunk has. For
+    sequential data only the first row of every sequence (the candidate) is
+    checked, as the real data has one row per candidate.
+    """
+
+    def __init__(self, data, is_sequential=False):
+        self.data = data
+        self.is_sequential = is_sequential
+        self.index = None
+        self.num_rows = 0
+        self.exact_matches = 0
+        self.distances = []
+
+    def update(self, frame):
+        if self.is_sequential and ID_COLUMN in frame.columns:
+            frame = frame.drop_duplicates(subset=ID_COLUMN)
+        if self.index is None:
+            self.index = get_privacy_index(self.data, [column for column in self.data.columns if column in frame.columns])
+        exact, distances = self.index.check(frame)
+        self.num_rows += len(frame)
+        self.exact_matches += int(exact.sum())
+        self.distances.append(distances)
+
+    def report(self):
+        """
+        Returns:
+        - dict: Rows checked, exact and near copies of real rows (counts and
+          shares), the median and 5th percentile DCR, the near copy threshold
+          and the share of the real rows that are near copies of another real row.
+        """
+        distances = np.concatenate(self.distances) if self.distances else np.zeros(0)
+        threshold = self.index.near_copy_distance if self.index is not None else 0.0
+        near_copies = int((distances <= threshold).sum())
+        return {
+            "rows": self.num_rows,
+            "exact_matches": self.exact_matches,
+            "exact_match_share": self.exact_matches / self.num_rows if self.num_rows else 0.0,
+            "near_copies": near_copies,
+            "near_copy_share": near_copies / self.num_rows if self.num_rows else 0.0,
+            "near_copy_distance": threshold,
+            "real_near_copy_share": float((self.index.real_dcr <= threshold).mean()) if self.index is not None else 0.0,
+            "median_dcr": float(np.median(distances)) if len(distances) else None,
+            "p05_dcr": float(np.quantile(distances, 0.05)) if len(distances) else None,
+            "columns": self.index.distance_columns if self.index is not None else [],
+        }
+
+
+def privacy_report(data, synthetic_data, is_sequential=False):
+    """Check one synthetic frame against the real ``data``, see ``PrivacyAccumulator.report``."""
+    accumulator = PrivacyAccumulator(data, is_sequential)
+    accumulator.update(synthetic_data)
+    return accumulator.report()
+
+
+# Index per real dataset: (fingerprint, columns, settings) -> PrivacyIndex
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_privacy_index(data, columns=None):
+    """The index of ``data``, built once per process for the same data and columns."""
+    settings = CONFIG["privacy"]
+    fingerprint = int(pd.util.hash_pandas_object(data, index=False).sum())
+    key = (fingerprint, tuple(data.columns), tuple(columns or ()), settings["max_categories"],
+           settings["near_copy_quantile"])
+    with _indexes_lock:
+        if key not in _indexes:
+            with span("privacy_index") as stage:
+                _indexes[key] = PrivacyIndex(data, columns, settings["max_categories"], settings["near_copy_quantile"])
+                stage.rows = len(data)
+        return _indexes[key]
@@ -0,0 +1,137 @@
+"""
+Typed real reference data for the comparison plots.
+
+The real candidates are stored as Parquet with categorical columns, and the
+category frequencies of every column are computed once at load time, so a
+plot only has to count the synthetic column.
+
+    python webapp/reference_data.py   # rebuild real_data_sin.parquet from the CSV
+"""
+import os
+
+import pandas as pd
+import plotly.graph_objects as go
+from pandas.api.types import CategoricalDtype
+from sdmetrics.reports.utils import PlotConfig
+
+from config import CONFIG
+from ordinals import ORDINAL_ORDERS
+
+# Non categorical columns, every other column is an unordered category
+NUMERIC_DTYPES = {
+    "ID": "int32",
+    "Year of insertion": "Int16",
+    "Year of Recruitment": "Int16",
+}
+
+
+def apply_schema(data):
+    """Give ``data`` the reference dtypes, values outside an ordinal order become NaN."""
+    data = data.copy()
+    for column in data.columns:
+        if column in NUMERIC_DTYPES:
+            data[column] = data[column].astype(NUMERIC_DTYPES[column])
+        elif column in ORDINAL_ORDERS:
+            data[column] = data[column].astype(CategoricalDtype(ORDINAL_ORDERS[column], ordered=True))
+        elif not isinstance(data[column].dtype, CategoricalDtype):
+            data[column] = data[column].astype("category")
+    return data
+
+
+def column_frequencies(column):
+    """Share of every category among the non missing values, in category order for ordinals."""
+    ordered = getattr(column.dtype, "ordered", False)
+    counts = column.value_counts(normalize=True, sort=not ordered)
+    # Keep the full order of an ordinal, drop the categories the other columns never use
+    return counts if ordered else counts[counts > 0]
+
+
+class ReferenceData:
+    """
+    Real data with its per column frequencies, shared read-only by all sessions.
+
+    Parameters:
+    - data (pd.DataFrame): The real data, see ``apply_schema``.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.frequencies = {
+            column: column_frequencies(data[column]) for column in data.columns if column != "ID"
+        }
+        self.missing = {column: float(data[column].isna().mean()) for column in data.columns}
+
+    def memory_usage(self):
+        return int(self.data.memory_usage(deep=True).sum())
+
+
+def build_reference_file(csv_path, parquet_path):
+    apply_schema(pd.read_csv(csv_path)).to_parquet(parquet_path, index=False)
+    return parquet_path
+
+
+def load_reference_data(parquet_path=None, csv_path=None):
+    """
+    Load the real candidates, from Parquet when it exists and from the CSV otherwise.
+
+    Returns:
+    - ReferenceData
+    """
+    parquet_path = parquet_path or CONFIG["reference_data"]["parquet_path"]
+    csv_path = csv_path or CONFIG["reference_data"]["csv_path"]
+    if os.path.exists(parquet_path):
+        data = pd.read_parquet(parquet_path)
+    else:
+        data = pd.read_csv(csv_path)
+    # Cheap when the Parquet file already holds these dtypes
+    return ReferenceData(apply_schema(data))
+
+
+def get_frequency_plot(reference, synthetic_column, column_name):
+    """
+    Bar plot of the real against the synthetic category shares of one column.
+
+    Looks like sdmetrics' get_column_plot for a categorical column, but takes
+    the real shares from ``reference`` instead of counting the real data again.
+    """
+    real = reference.frequencies[column_name]
+    synthetic = synthetic_column.value_counts(normalize=True)
+    categories = list(real.index) + [category for category in synthetic.index if category not in real.index]
+
+    fig = go.Figure()
+    fig.add_bar(
+        x=categories, y=real.reindex(categories, fill_value=0).to_numpy(), name="Real",
+        marker_color=PlotConfig.DATACEBO_DARK,
+        hovertemplate="<b>Real</b><br>Frequency: %{y}<extra></extra>",
+    )
+    fig.add_bar(
+        x=categories, y=synthetic.reindex(categories, fill_value=0).to_numpy(), name="Synthetic",
+        marker_color=PlotConfig.DATACEBO_GREEN, marker_pattern_shape="/",
+        hovertemplate="<b>Synthetic</b><br>Frequency: %{y}<extra></extra>",
+    )
+
+    annotations = []
+    missing_real = round(reference.missing[column_name] * 100, 2)
+    missing_synthetic = round(float(synthetic_column.isna().mean()) * 100, 2)
+    if missing_real > 0 or missing_synthetic > 0:
+        annotations.append({
+            "xref": "paper", "yref": "paper", "x": 1.0, "y": 1.05, "showarrow": False,
+            "text": f"*Missing Values: Real Data ({missing_real}%), Synthetic Data ({missing_synthetic}%)",
+        })
+    fig.update_layout(
+        title=f"Real vs. Synthetic Data for column '{column_name}'",
+        xaxis_title="Category",
+        yaxis_title="Frequency",
+        barmode="group",
+        plot_bgcolor=PlotConfig.BACKGROUND_COLOR,
+        font={"size": PlotConfig.FONT_SIZE},
+        legend_title="Data",
+        annotations=annotations,
+    )
+    return fig
+
+
+if __name__ == "__main__":
+    settings = CONFIG["reference_data"]
+    path = build_reference_file(settings["csv_path"], settings["parquet_path"])
+    print(f"Wrote {path} ({os.path.getsize(path) / 1e6:.2f} MB)")
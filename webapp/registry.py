@@ -0,0 +1,394 @@
+"""
+Manifest of every trained synthesizer, the models the app and the service can serve.
+
+Every entry records the synthesizer type, its file and training data hashes,
+epochs, file size, load time, memory once loaded and quality scores. The
+load time, memory and registration time depend on the machine, so they go
+to ``CONFIG["registry"]["measurements_path"]`` (not versioned) instead of
+the manifest, and are merged back into the entries when read. ``scan``
+loads every model found under ``CONFIG["registry"]["search_dirs"]`` in a
+fresh process to measure it, models trained by train_par.py or sweep.py
+also get the hash of their training data (and the sweep's scores) from
+their run directory. Serving goes through model_loading.get_synthesizer,
+which keeps only the recently used models in memory.
+
+    python webapp/registry.py scan --score-rows 500   # (re)build models.json
+    python webapp/registry.py list
+    python webapp/registry.py register SDV/outputs/2024-12-08_17-25-16/synthesizer.pkl --label "PAR 400 candidates"
+    python webapp/registry.py remove webapp/synthesizer_seq_100
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from config import CONFIG, REPO_DIR
+from model_loading import file_signature, get_synthesizer, load_synthesizer, resident_memory_mb
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MANIFEST_VERSION = 1
+# Entry fields measured on this machine, saved next to the manifest rather than in it
+MEASURED_FIELDS = ("load_seconds", "memory_mb", "registered_at")
+# Scores of a sweep.py run, next to the directories of its models
+SWEEP_RESULTS_NAME = "results.csv"
+SWEEP_SCORE_COLUMNS = [
+    "quality_score", "diagnostic_score", "column_shapes", "column_pair_trends",
+    "fidelity_tv_complement", "fidelity_pair_similarity",
+]
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as model_file:
+        for block in iter(lambda: model_file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_name(path):
+    """Name of the model at ``path``: a default model's key, else its path from the repository root."""
+    path = os.path.abspath(path)
+    for name, settings in CONFIG["models"].items():
+        if os.path.abspath(settings["path"]) == path:
+            return name
+    name = os.path.relpath(path, REPO_DIR).replace(os.sep, "/")
+    name = name[:-len(".pkl")] if name.endswith(".pkl") else name
+    return name[:-len("/synthesizer")] if name.endswith("/synthesizer") else name
+
+
+def run_details(path):
+    """Training data hash and scores recorded by train_par.py or sweep.py next to the model."""
+    details = {}
+    run_dir = os.path.dirname(os.path.abspath(path))
+    checkpoint_path = os.path.join(run_dir, "checkpoint.pt")
+    if os.path.exists(checkpoint_path):
+        import torch
+
+        details["data_hash"] = torch.load(checkpoint_path, map_location="cpu", weights_only=False)["fingerprint"]
+    # sweep.py names the directory of its job N "NNN_<synthesizer>"
+    results_path = os.path.join(os.path.dirname(run_dir), SWEEP_RESULTS_NAME)
+    job = os.path.basename(run_dir).split("_", 1)[0]
+    if os.path.exists(results_path) and job.isdigit():
+        results = pd.read_csv(results_path)
+        row = results[results["job"] == int(job)]
+        if len(row):
+            row = row.iloc[0]
+            if isinstance(row.get("data_hash"), str):
+                details["data_hash"] = row["data_hash"]
+            details["quality"] = {
+                column: float(row[column]) for column in SWEEP_SCORE_COLUMNS if column in row and pd.notna(row[column])
+            }
+    return details
+
+
+def score_synthesizer(synthesizer, is_sequential, num_candidates, seed=0):
+    """Fidelity of ``num_candidates`` sampled candidates to the reference data, see fidelity.py."""
+    from fidelity import fidelity_report, get_real_histograms
+    from generation import generate_data_no_bias, seed_synthesizer
+    from reference_data import load_reference_data
+
+    seed_synthesizer(synthesizer, seed)
+    frame = generate_data_no_bias(synthesizer, num_candidates, is_sequential)
+    column_scores, pair_scores = fidelity_report(
+        get_real_histograms(load_reference_data().data), frame, is_sequential
+    )
+    return {
+        "fidelity_tv_complement": float(column_scores["tv_complement"].mean()),
+        "fidelity_pair_similarity": float(pair_scores["contingency_similarity"].mean()),
+    }
+
+
+def inspect_model(path, score_rows=0):
+    """
+    Load the model at ``path`` and describe it, run in a process of its own for a clean memory figure.
+
+    Returns:
+    - dict: The manifest entry, without name and label.
+    """
+    from sdv.multi_table.base import BaseMultiTableSynthesizer
+    from sdv.sequential import PARSynthesizer
+
+    rss_before = resident_memory_mb()
+    start = time.perf_counter()
+    synthesizer = load_synthesizer(path)
+    load_seconds = time.perf_counter() - start
+    rss_after = resident_memory_mb()
+
+    parameters = synthesizer.get_parameters()
+    entry = {
+        "path": os.path.relpath(os.path.abspath(path), REPO_DIR).replace(os.sep, "/"),
+        "synthesizer": type(synthesizer).__name__,
+        "is_sequential": isinstance(synthesizer, PARSynthesizer),
+        "multi_table": isinstance(synthesizer, BaseMultiTableSynthesizer),
+        # HMA models sample a dict of tables, which the app and the service do not serve
+        "servable": not isinstance(synthesizer, BaseMultiTableSynthesizer),
+        "error": None,
+        "file_hash": file_hash(path),
+        "data_hash": None,
+        "epochs": parameters.get("epochs"),
+        "size_mb": round(os.path.getsize(path) / 2 ** 20, 3),
+        "load_seconds": round(load_seconds, 3),
+        "memory_mb": round(max(os.path.getsize(path) / 2 ** 20, (rss_after or 0) - (rss_before or 0)), 1),
+        "sdv_version": getattr(synthesizer, "_fitted_sdv_version", None),
+        "fitted_at": str(getattr(synthesizer, "_fitted_date", None) or "") or None,
+        "quality": {},
+    }
+    details = run_details(path)
+    entry["data_hash"] = details.get("data_hash")
+    entry["quality"].update(details.get("quality", {}))
+    if score_rows and entry["servable"]:
+        try:
+            entry["quality"].update(score_synthesizer(synthesizer, entry["is_sequential"], score_rows))
+        except Exception as error:
+            # E.g. a model trained on a GPU, SDV refuses to sample it on a CPU only machine
+            entry["servable"] = False
+            entry["error"] = f"{type(error).__name__}: {error}"
+    return entry
+
+
+def _inspect_in_process(path, score_rows):
+    warnings.filterwarnings("ignore")
+    # Loading and scoring a model to register it is not a request, keep it out of the traces
+    CONFIG["tracing"]["enabled"] = False
+    try:
+        # SDV's progress bars, one per scored model
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+            return inspect_model(path, score_rows), None
+    except Exception as error:
+        return None, f"{type(error).__name__}: {error}"
+
+
+def find_models(search_dirs=None):
+    paths = []
+    for directory in search_dirs or CONFIG["registry"]["search_dirs"]:
+        paths.extend(glob.glob(os.path.join(directory, "**", "*.pkl"), recursive=True))
+    return sorted(set(os.path.abspath(path) for path in paths))
+
+
+class ModelRegistry:
+    """
+    The manifest at ``manifest_path``, re-read whenever another process rewrites it.
+
+    ``models()`` gives the servable models (the defaults of ``CONFIG["models"]``
+    first), every entry with an absolute ``path``, ``label`` and ``is_sequential``.
+    A model is not servable when it samples several tables or could not
+    sample when it was scored, ``multi_table_models()`` gives the former.
+    """
+
+    def __init__(self, manifest_path=None, measurements_path=None):
+        self.manifest_path = manifest_path or CONFIG["registry"]["manifest_path"]
+        self.measurements_path = measurements_path or (
+            CONFIG["registry"]["measurements_path"] if manifest_path is None
+            else f"{os.path.splitext(manifest_path)[0]}.local.json"
+        )
+        self._entries = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        # Caller holds self._lock
+        signature = tuple(
+            file_signature(path) if os.path.exists(path) else None
+            for path in (self.manifest_path, self.measurements_path)
+        )
+        if signature != self._signature:
+            entries = {}
+            if signature[0] is not None:
+                with open(self.manifest_path) as manifest:
+                    entries = json.load(manifest)["models"]
+            if signature[1] is not None:
+                with open(self.measurements_path) as measurements:
+                    for name, measured in json.load(measurements)["models"].items():
+                        if name in entries:
+                            entries[name] = {**entries[name], **measured}
+            self._entries, self._signature = entries, signature
+        return self._entries
+
+    def _save(self, path, models):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as output:
+            json.dump({"version": MANIFEST_VERSION, "models": models}, output, indent=2, sort_keys=True)
+            output.write("\n")
+        os.replace(tmp_path, path)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Hold the manifest's lock file while reading, changing and saving it, yields the entries."""
+        with open(f"{self.manifest_path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self._lock:
+                self._signature = None
+                entries = dict(self._read())
+                yield entries
+                self._save(self.manifest_path, {
+                    name: {key: value for key, value in entry.items() if key not in MEASURED_FIELDS}
+                    for name, entry in entries.items()
+                })
+                self._save(self.measurements_path, {
+                    name: {key: entry[key] for key in MEASURED_FIELDS if key in entry}
+                    for name, entry in entries.items()
+                })
+
+    def entries(self):
+        """Every model of the manifest by name, those that cannot be served included."""
+        with self._lock:
+            entries = {name: dict(entry) for name, entry in self._read().items()}
+        for entry in entries.values():
+            entry["path"] = os.path.join(REPO_DIR, entry["path"])
+        return entries
+
+    def models(self):
+        entries = self.entries()
+        models = {}
+        for name, settings in CONFIG["models"].items():
+            models[name] = {**settings, **entries.pop(name, {})}
+            models[name]["label"] = settings["label"]
+        for name, entry in sorted(entries.items()):
+            if entry.get("servable", True):
+                models[name] = entry
+        return models
+
+    def multi_table_models(self):
+        """The models that sample related tables, served by multitable.py rather than the samplers."""
+        return {
+            name: entry for name, entry in sorted(self.entries().items())
+            if entry.get("multi_table") and entry.get("error") is None
+        }
+
+    def get(self, name):
+        models = self.models()
+        if name not in models:
+            raise ValueError(f"Unknown model {name!r}, expected one of {list(models)}")
+        return models[name]
+
+    def get_synthesizer(self, name):
+        entry = self.get(name)
+        return get_synthesizer(entry["path"], entry.get("memory_mb"))
+
+    def register(self, path, name=None, label=None, score_rows=0):
+        """Measure the model at ``path`` in a fresh process and add it to the manifest."""
+        entry, error = self._inspect([path], score_rows)[0]
+        if error is not None:
+            raise ValueError(f"Could not load {path}: {error}")
+        return self._add([(path, entry)], {os.path.abspath(path): (name, label)})[0]
+
+    def scan(self, search_dirs=None, score_rows=0, workers=1, progress=None):
+        """
+        Register every loadable model under ``search_dirs``, replacing the entries of files that changed.
+
+        Returns:
+        - list: The names registered.
+        - dict: Path -> error of the files that are not loadable synthesizers.
+        """
+        paths = find_models(search_dirs)
+        with self._lock:
+            known = {entry["path"]: entry for entry in self._read().values()}
+        # A file whose contents did not change keeps its entry (and scores)
+        todo = []
+        for path in paths:
+            entry = known.get(os.path.relpath(path, REPO_DIR).replace(os.sep, "/"))
+            if entry is None or entry["file_hash"] != file_hash(path) or (score_rows and not entry["quality"]):
+                todo.append(path)
+        results = self._inspect(todo, score_rows, workers, progress)
+        errors = {path: error for path, (_, error) in zip(todo, results) if error is not None}
+        names = self._add([(path, entry) for path, (entry, error) in zip(todo, results) if error is None], {})
+        return names, errors
+
+    def _inspect(self, paths, score_rows, workers=1, progress=None):
+        # One process per model: the memory it takes is measured from a clean start
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 max_tasks_per_child=1) as executor:
+            futures = [executor.submit(_inspect_in_process, path, score_rows) for path in paths]
+            results = []
+            for path, future in zip(paths, futures):
+                results.append(future.result())
+                if progress is not None:
+                    progress(path, *results[-1])
+            return results
+
+    def _add(self, inspected, names):
+        registered = []
+        with self._writing() as entries:
+            by_path = {entry["path"]: name for name, entry in entries.items()}
+            for path, entry in inspected:
+                name, label = names.get(os.path.abspath(path), (None, None))
+                name = name or by_path.get(entry["path"]) or model_name(path)
+                previous = entries.get(name, {})
+                default_label = CONFIG["models"].get(name, {}).get("label") or f"{entry['synthesizer']} ({name})"
+                entry["label"] = label or previous.get("label") or default_label
+                entry["registered_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+                entries[name] = entry
+                registered.append(name)
+        return registered
+
+    def remove(self, name):
+        with self._writing() as entries:
+            if entries.pop(name, None) is None:
+                raise ValueError(f"{name!r} is not in the manifest")
+
+
+_registry = None
+
+
+def get_registry():
+    """The registry of the configured manifest, shared by the whole process."""
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry()
+    return _registry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser("scan", help="Register every model under the search directories")
+    scan.add_argument("dirs", nargs="*", help="Directories to search, defaults to CONFIG['registry']['search_dirs']")
+    scan.add_argument("--score-rows", type=int, default=0, help="Candidates sampled to score every model, 0 skips")
+    scan.add_argument("--workers", type=int, default=1, help="Models measured at once")
+    register = commands.add_parser("register", help="Register one model")
+    register.add_argument("path")
+    register.add_argument("--name")
+    register.add_argument("--label")
+    register.add_argument("--score-rows", type=int, default=0)
+    remove = commands.add_parser("remove", help="Remove a model from the manifest")
+    remove.add_argument("name")
+    commands.add_parser("list", help="Show the manifest")
+    args = parser.parse_args(argv)
+
+    registry = get_registry()
+    if args.command == "scan":
+        def progress(path, entry, error):
+            print(f"{os.path.relpath(path, REPO_DIR)}: {error or 'ok'}")
+
+        names, errors = registry.scan(args.dirs or None, args.score_rows, args.workers, progress)
+        print(f"Registered {len(names)} model(s), skipped {len(errors)}")
+    elif args.command == "register":
+        print(f"Registered {registry.register(args.path, args.name, args.label, args.score_rows)}")
+    elif args.command == "remove":
+        registry.remove(args.name)
+    else:
+        columns = ["synthesizer", "is_sequential", "servable", "epochs", "size_mb", "load_seconds", "memory_mb"]
+        table = pd.DataFrame.from_dict(registry.entries(), orient="index")
+        quality = pd.json_normalize(table.pop("quality")).set_index(table.index) if len(table) else pd.DataFrame()
+        print(pd.concat([table[[column for column in columns if column in table]], quality], axis=1).to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
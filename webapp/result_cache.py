@@ -0,0 +1,221 @@
+"""
+Seeded generation results kept on disk and shared by every process.
+
+A seeded request always gives the same rows, so its result is stored as a
+Parquet file named after a hash of everything that shapes it: the model
+file's contents, how PAR models sample (see par_inference.py), the chunk
+size and conditional sampling settings, the bias column and percentages,
+the number of candidates and the seed. The file is written next to its
+final name and renamed into place, so the app and service replicas sharing
+the directory only ever see complete results, and a file that cannot be read
+counts as a miss and is removed. Files unused for ``max_age_seconds`` are
+removed, and the least recently used ones once the directory grows past
+``max_mb``.
+
+    cache = get_result_cache()
+    key = cache.key(model_hash(path), sampling_mode(synthesizer), "Sex", {"Male": 30, "Female": 70}, 1000, seed=7)
+    frames = cache.get(key)
+    if frames is None:
+        frames = cache.store(key, sampler.iter_biased("Sex", {"Male": 30, "Female": 70}, 1000, seed=7))
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from config import CONFIG
+from export import _arrow_schema, _to_arrow
+from model_loading import file_signature
+from registry import file_hash
+from tracing import span
+
+# Part of every key, bump when the stored results change for the same request
+CACHE_VERSION = 2
+
+# abs path -> (file signature, sha256 of the model file)
+_model_hashes = {}
+_model_hashes_lock = threading.Lock()
+
+
+def model_hash(path):
+    """Hash of the model file's contents, computed again only when the file is replaced."""
+    key = os.path.abspath(path)
+    signature = file_signature(path)
+    with _model_hashes_lock:
+        if key in _model_hashes and _model_hashes[key][0] == signature:
+            return _model_hashes[key][1]
+    digest = file_hash(path)
+    with _model_hashes_lock:
+        _model_hashes[key] = (signature, digest)
+    return digest
+
+
+class ResultCache:
+    """
+    Directory of generated results, one Parquet file per request.
+
+    Parameters:
+    - directory (str): Where the results go, can be shared between processes and hosts.
+    - max_mb (float): Size of the directory above which the least recently used results go.
+    - max_age_seconds (float or None): Results unused for longer are removed.
+    """
+
+    def __init__(self, directory, max_mb=1024, max_age_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_mb * 2 ** 20
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(model_hash, sampler, bias_column, category_percentages, num_rows, seed):
+        """The cache key of a request, ``sampler`` is ``par_inference.sampling_mode`` of the loaded model."""
+        request = {
+            "version": CACHE_VERSION,
+            "model": model_hash,
+            "sampler": sampler,
+            # The chunk layout gives the chunk seeds, and the quota top-up which rows come back
+            "chunk_size": CONFIG["parallel"]["chunk_size"],
+            "conditional_sampling": CONFIG["conditional_sampling"],
+            "bias_column": bias_column,
+            # 50 and 50.0 are the same request
+            "percentages": sorted((str(category), float(percentage))
+                                  for category, percentage in (category_percentages or {}).items()),
+            "num_rows": int(num_rows),
+            "seed": int(seed),
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def get(self, key):
+        """
+        The stored result of ``key``, or None.
+
+        Returns:
+        - list of pd.DataFrame or None: The chunks of the result, as they were stored.
+        """
+        import pyarrow.parquet as pq
+
+        path = self.path(key)
+        with span("cache_read") as stage:
+            try:
+                parquet_file = pq.ParquetFile(path)
+                dtypes = json.loads(parquet_file.schema_arrow.metadata[b"dtypes"])
+                frames = [
+                    self._from_arrow(parquet_file.read_row_group(index), dtypes)
+                    for index in range(parquet_file.num_row_groups)
+                ]
+            except FileNotFoundError:
+                # Not stored yet, or just evicted by another process
+                frames = None
+            except (OSError, ValueError, KeyError, TypeError):
+                # A damaged file (ArrowInvalid is a ValueError) or one without the dtypes, generated again
+                frames = None
+                self._remove(path)
+            if frames is not None:
+                try:
+                    # The modification time tells which results were used last
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+            stage.attributes["hit"] = frames is not None
+            stage.rows = sum(len(frame) for frame in frames) if frames is not None else 0
+        return frames
+
+    @staticmethod
+    def _from_arrow(table, dtypes):
+        frame = table.to_pandas()
+        # Back to the sampled dtypes: strings are stored as dictionaries, which
+        # pandas reads as categoricals, and nullable ints come back as floats
+        for column, dtype in dtypes.items():
+            if dtype == "object":
+                frame[column] = frame[column].astype(object)
+            elif str(frame[column].dtype) != dtype:
+                frame[column] = frame[column].astype(dtype)
+        return frame
+
+    def store(self, key, frames):
+        """
+        Pass the chunks of a result through, writing them to the cache as they go.
+
+        The result is only stored once every chunk went through. A chunk that
+        cannot be written (e.g. its columns change type) leaves the result
+        uncached, the chunks are passed through all the same.
+        """
+        import pyarrow.parquet as pq
+
+        tmp_path = f"{self.path(key)}.{uuid.uuid4().hex}.tmp"
+        writer = None
+        failed = False
+        try:
+            for frame in frames:
+                if not failed:
+                    try:
+                        if writer is None:
+                            dtypes = {column: str(dtype) for column, dtype in frame.dtypes.items()}
+                            schema = _arrow_schema(frame).with_metadata({"dtypes": json.dumps(dtypes)})
+                            writer = pq.ParquetWriter(tmp_path, schema)
+                        writer.write_table(_to_arrow(frame, schema))
+                    except Exception:
+                        failed = True
+                yield frame
+            if writer is not None:
+                writer.close()
+                writer = None
+                if not failed:
+                    os.replace(tmp_path, self.path(key))
+                    self.evict()
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Remove the results past their age, then the least recently used ones over the size limit."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".parquet"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            expired = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+            if not expired and total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".parquet", ".tmp")):
+                os.remove(entry.path)
+
+
+_cache = None
+
+
+def get_result_cache():
+    """The cache of ``CONFIG["result_cache"]``, shared by the whole process."""
+    global _cache
+    if _cache is None:
+        _cache = ResultCache(**CONFIG["result_cache"])
+    return _cache
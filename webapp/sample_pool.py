@@ -0,0 +1,222 @@
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import CONFIG
+from generation import ID_COLUMN, category_counts, generate_data_no_bias, generate_data_quota, renumber_ids
+
+# Bucket holding candidates sampled without any bias
+UNBIASED = (None, None)
+
+
+class _Bucket:
+    """FIFO of generated batches, counted in candidates (unique IDs)."""
+
+    def __init__(self):
+        self.batches = deque()  # (created_at, frame, number of candidates)
+        self.size = 0
+
+    def add(self, frame, id_column):
+        count = frame[id_column].nunique() if id_column in frame.columns else len(frame)
+        if count:
+            self.batches.append((time.monotonic(), frame, count))
+            self.size += count
+
+    def take(self, count, id_column):
+        taken = []
+        while count > 0 and self.batches:
+            created_at, frame, available = self.batches.popleft()
+            self.size -= available
+            if available <= count:
+                taken.append(frame)
+                count -= available
+                continue
+            if id_column in frame.columns:
+                head_ids = frame[id_column].unique()[:count]
+                head = frame[id_column].isin(head_ids)
+                taken.append(frame[head])
+                rest = frame[~head]
+            else:
+                taken.append(frame.iloc[:count])
+                rest = frame.iloc[count:]
+            self.batches.appendleft((created_at, rest, available - count))
+            self.size += available - count
+            count = 0
+        return taken
+
+    def evict(self, max_size, max_age_seconds):
+        if max_age_seconds is not None:
+            oldest_allowed = time.monotonic() - max_age_seconds
+            while self.batches and self.batches[0][0] < oldest_allowed:
+                self.size -= self.batches.popleft()[2]
+        # Oldest batches go first, a batch is only ever dropped as a whole
+        while self.batches and self.size > max_size:
+            self.size -= self.batches.popleft()[2]
+
+
+class _SamplingLock:
+    """Lock around the synthesizer, draws waiting for it go before the background refills."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._held = False
+        self._waiting_draws = 0
+
+    @contextmanager
+    def hold(self, background=False):
+        with self._condition:
+            if background:
+                self._condition.wait_for(lambda: not self._held and not self._waiting_draws)
+            else:
+                self._waiting_draws += 1
+                try:
+                    self._condition.wait_for(lambda: not self._held)
+                finally:
+                    self._waiting_draws -= 1
+            self._held = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._held = False
+                self._condition.notify_all()
+
+
+class SamplePool:
+    """
+    Pool of pre-generated candidates for one loaded synthesizer.
+
+    Candidates are kept in one bucket for unbiased requests and one bucket per
+    category of every bias column. A request is built by drawing (without
+    replacement) from the buckets; only a shortfall is sampled on the spot.
+    Buckets that drop below the low watermark are refilled by a background
+    thread, which gives way to a draw waiting to sample its shortfall.
+
+    Parameters:
+    - synthesizer: A trained SDV synthesizer object, or a function returning it
+      (e.g. through model_loading.get_synthesizer, so the pool does not hold the model).
+    - is_sequential (bool): Whether the synthesizer is a PARSynthesizer.
+    - bias_categories (dict): Bias column name -> list of its categories.
+    - max_size (int): Cap on the number of candidates held per bucket.
+    - low_watermark (int): A bucket holding fewer candidates gets refilled.
+    - refill_batch (int): Number of candidates sampled per refill.
+    - max_age_seconds (float or None): Batches older than this are evicted.
+    """
+
+    def __init__(self, synthesizer, is_sequential, bias_categories, max_size=2000,
+                 low_watermark=200, refill_batch=250, max_age_seconds=None, id_column=ID_COLUMN):
+        self.synthesizer = synthesizer
+        self.is_sequential = is_sequential
+        self.bias_categories = bias_categories
+        self.max_size = max_size
+        self.low_watermark = min(low_watermark, max_size)
+        self.refill_batch = refill_batch
+        self.max_age_seconds = max_age_seconds
+        self.id_column = id_column
+
+        self._buckets = {UNBIASED: _Bucket()}
+        for column, categories in bias_categories.items():
+            for category in categories:
+                self._buckets[(column, category)] = _Bucket()
+
+        # SDV synthesizers are not thread safe, so every sampling call holds this lock
+        self._sampling_lock = _SamplingLock()
+        self._buckets_lock = threading.Lock()
+        self._pending = set()
+        self._refills = queue.Queue()
+        self._worker = threading.Thread(target=self._refill_loop, name="sample-pool-refill", daemon=True)
+        self._worker.start()
+
+    def warm_up(self):
+        """
+        Queue a refill of the unbiased bucket.
+
+        A bias bucket is filled once a request drew from it, most categories never are.
+        """
+        self._schedule_refill(UNBIASED)
+
+    def stats(self):
+        with self._buckets_lock:
+            return {key: bucket.size for key, bucket in self._buckets.items()}
+
+    def draw_unbiased(self, num_sequences):
+        return self._draw({UNBIASED: num_sequences})
+
+    def draw_biased(self, column_name, category_percentages, num_sequences):
+        counts = category_counts(category_percentages, num_sequences)
+        return self._draw({(column_name, category): count for category, count in counts.items()})
+
+    def _draw(self, counts):
+        frames = []
+        for key, count in counts.items():
+            if count <= 0:
+                continue
+            with self._buckets_lock:
+                bucket = self._buckets[key]
+                bucket.evict(self.max_size, self.max_age_seconds)
+                taken = bucket.take(count, self.id_column)
+            frames.extend(taken)
+            shortfall = count - sum(self._count(frame) for frame in taken)
+            if shortfall > 0:
+                frames.append(self._sample(key, shortfall))
+            self._schedule_refill(key)
+        return renumber_ids(frames, id_column=self.id_column)
+
+    def _count(self, frame):
+        if self.id_column in frame.columns:
+            return frame[self.id_column].nunique()
+        return len(frame)
+
+    def _sample(self, key, count, background=False):
+        column, category = key
+        synthesizer = self.synthesizer() if callable(self.synthesizer) else self.synthesizer
+        with self._sampling_lock.hold(background):
+            if key == UNBIASED:
+                return generate_data_no_bias(synthesizer, count, self.is_sequential)
+            # A rare category comes back short rather than stalling the pool, the app reports the shortfall
+            generated_data, _ = generate_data_quota(
+                synthesizer,
+                column_name=column,
+                category_percentages={category: 100},
+                num_sequences=count,
+                is_sequential=self.is_sequential,
+                **{**CONFIG["conditional_sampling"], "oversample": 0},
+            )
+            return generated_data
+
+    def _schedule_refill(self, key):
+        with self._buckets_lock:
+            if key in self._pending or self._buckets[key].size >= self.low_watermark:
+                return
+            self._pending.add(key)
+        self._refills.put(key)
+
+    def close(self):
+        """Stop the refill thread once it is done with the current refill."""
+        self._refills.put(None)
+
+    def _refill_loop(self):
+        while True:
+            key = self._refills.get()
+            if key is None:
+                return
+            refilled = False
+            try:
+                with self._buckets_lock:
+                    missing = self.max_size - self._buckets[key].size
+                if missing > 0:
+                    frame = self._sample(key, min(self.refill_batch, missing), background=True)
+                    with self._buckets_lock:
+                        self._buckets[key].add(frame, self.id_column)
+                    refilled = not frame.empty
+            except Exception:
+                # A failed refill only means the next draw samples on the spot
+                pass
+            finally:
+                with self._buckets_lock:
+                    self._pending.discard(key)
+            if refilled:
+                # Keep going until the bucket is back above the low watermark
+                self._schedule_refill(key)
@@ -0,0 +1,388 @@
+import json
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import CONFIG
+from export import EXPORT_FORMATS, export_frames
+from par_inference import sampling_mode
+from parallel_sampling import ParallelSampler
+from registry import get_registry
+from result_cache import get_result_cache, model_hash
+from sample_pool import SamplePool
+from tracing import get_metrics, span, trace, traced_frames
+
+# Formats offered by the service, Excel is left to the Streamlit app
+SERVICE_FORMATS = ["csv", "parquet"]
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the job queue is full."""
+
+
+def validate_request(request):
+    """
+    Check a generation request and fill in its defaults.
+
+    A request is a dict with ``model`` (a model of the registry, see registry.py),
+    ``num_rows`` and optionally ``bias_column``, ``category_percentages``,
+    ``seed`` and ``format``. Raises ValueError on invalid input.
+    """
+    model = request.get("model", "single")
+    get_registry().get(model)
+    num_rows = request.get("num_rows", 150)
+    # bool is a subclass of int, but true is not a number of rows
+    if not isinstance(num_rows, int) or isinstance(num_rows, bool) or num_rows <= 0:
+        raise ValueError("num_rows must be a positive integer")
+    export_format = request.get("format", "csv")
+    if export_format not in SERVICE_FORMATS:
+        raise ValueError(f"Unknown format {export_format!r}, expected one of {SERVICE_FORMATS}")
+    seed = request.get("seed")
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+        raise ValueError("seed must be a non-negative integer")
+
+    bias_column = request.get("bias_column")
+    if bias_column in (None, "None"):
+        bias_column, category_percentages = None, None
+    else:
+        if bias_column not in CONFIG["defaults"]:
+            raise ValueError(f"Unknown bias column {bias_column!r}, expected one of {list(CONFIG['defaults'])}")
+        category_percentages = request.get("category_percentages") or CONFIG["defaults"][bias_column]
+        if not isinstance(category_percentages, dict):
+            raise ValueError("category_percentages must map every category to its percentage")
+        invalid = sorted(
+            str(category) for category, percentage in category_percentages.items()
+            if not isinstance(percentage, (int, float)) or isinstance(percentage, bool)
+            or not 0 <= percentage <= 100
+        )
+        if invalid:
+            raise ValueError(f"The percentages of {invalid} must be numbers from 0 to 100")
+        unknown = set(category_percentages) - set(CONFIG["defaults"][bias_column])
+        if unknown:
+            raise ValueError(f"Unknown categories for {bias_column}: {sorted(unknown)}")
+        if sum(category_percentages.values()) != 100:
+            raise ValueError(
+                f"The percentages add up to {sum(category_percentages.values())}%, they must add up to 100%"
+            )
+    return {
+        "model": model,
+        "num_rows": num_rows,
+        "bias_column": bias_column,
+        "category_percentages": category_percentages,
+        "seed": seed,
+        "format": export_format,
+    }
+
+
+def _checked(frames, privacy):
+    # Pass the chunks through the privacy check on their way to the export
+    for frame in frames:
+        privacy.update(frame)
+        yield frame
+
+
+class GenerationService:
+    """
+    Keeps the models resident and runs generation requests outside Streamlit.
+
+    Large requests are sampled in chunks by the model's parallel sampler. With
+    ``use_pool`` (a long running server) small unseeded requests are drawn from
+    a sample pool and seeded ones go to the worker processes; without it (a one
+    off CLI call) small requests are sampled in process. Seeded requests give
+    the same rows on every path, and are kept in the result cache so that
+    repeating one is only a read.
+
+    Pools and samplers are kept for the ``CONFIG["registry"]["max_loaded_models"]``
+    most recently used models, as the loaded models themselves.
+    """
+
+    def __init__(self, max_workers=None, use_pool=True):
+        self.max_workers = max_workers or CONFIG["parallel"]["max_workers"]
+        self.use_pool = use_pool
+        self.max_models = CONFIG["registry"]["max_loaded_models"]
+        self._pools = OrderedDict()
+        self._samplers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_cached(self, cache, key, create):
+        # Caller holds self._lock
+        if key not in cache:
+            cache[key] = create()
+            while len(cache) > self.max_models:
+                _, evicted = cache.popitem(last=False)
+                evicted.close()
+        cache.move_to_end(key)
+        return cache[key]
+
+    def get_pool(self, model):
+        def create():
+            settings = get_registry().get(model)
+            pool = SamplePool(
+                # Through the registry every time, so the pool does not keep an evicted model in memory
+                lambda: get_registry().get_synthesizer(model),
+                is_sequential=settings["is_sequential"],
+                bias_categories={
+                    column: list(categories) for column, categories in CONFIG["defaults"].items()
+                },
+                **CONFIG["sample_pool"],
+            )
+            pool.warm_up()
+            return pool
+
+        with self._lock:
+            return self._get_cached(self._pools, model, create)
+
+    def get_sampler(self, model, in_process=False):
+        def create():
+            settings = get_registry().get(model)
+            return ParallelSampler(
+                settings["path"],
+                is_sequential=settings["is_sequential"],
+                max_workers=self.max_workers,
+                chunk_size=CONFIG["parallel"]["chunk_size"],
+                in_process=in_process,
+            )
+
+        with self._lock:
+            return self._get_cached(self._samplers, (model, in_process), create)
+
+    def iter_frames(self, request, progress=None):
+        """Generate a validated request as an iterable of DataFrame chunks."""
+        model, num_rows = request["model"], request["num_rows"]
+        column_name = request["bias_column"]
+        category_percentages = request["category_percentages"]
+        small = num_rows < CONFIG["parallel"]["min_sequences"]
+        if small and self.use_pool and request["seed"] is None:
+            pool = self.get_pool(model)
+            with span("pool_draw") as stage:
+                if column_name is None:
+                    frame = pool.draw_unbiased(num_rows)
+                else:
+                    frame = pool.draw_biased(column_name, category_percentages, num_rows)
+                stage.rows = len(frame)
+            return [frame]
+        if request["seed"] is not None:
+            cache = get_result_cache()
+            key = cache.key(
+                model_hash(get_registry().get(model)["path"]),
+                # The workers load the model the same way, so they sample as the one loaded here
+                sampling_mode(get_registry().get_synthesizer(model)),
+                column_name, category_percentages, num_rows, request["seed"],
+            )
+            frames = cache.get(key)
+            if frames is not None:
+                return frames
+        # The pool's refill thread shares the loaded synthesizer, so a server never samples in process
+        sampler = self.get_sampler(model, in_process=small and not self.use_pool)
+        if column_name is None:
+            frames = sampler.iter_unbiased(num_rows, seed=request["seed"], progress=progress)
+        else:
+            frames = sampler.iter_biased(
+                column_name, category_percentages, num_rows, seed=request["seed"], progress=progress
+            )
+        if request["seed"] is not None:
+            return cache.store(key, frames)
+        return frames
+
+    def run(self, request, path, privacy=None):
+        """
+        Generate a validated request straight into the file at ``path``, a file name or a binary file object.
+
+        Every chunk is also passed to ``privacy.update`` when a PrivacyAccumulator is given.
+        """
+        with trace(
+            "request", model=request["model"], bias_column=request["bias_column"],
+            num_rows=request["num_rows"], seed=request["seed"], format=request["format"],
+        ):
+            # The chunks are sampled while the export pulls them, see tracing.traced_frames
+            frames = traced_frames(self.iter_frames(request), "sample")
+            if privacy is not None:
+                frames = traced_frames(_checked(frames, privacy), "privacy_update")
+            return export_frames(frames, request["format"], path)
+
+    def close(self):
+        for sampler in self._samplers.values():
+            sampler.close()
+        for pool in self._pools.values():
+            pool.close()
+
+
+class JobQueue:
+    """
+    Bounded queue of generation jobs with a fixed number of job runners.
+
+    ``submit`` never blocks: when ``max_queued`` jobs are already waiting it
+    raises QueueFullError, so callers can shed load instead of piling up.
+    """
+
+    def __init__(self, service, max_concurrent=2, max_queued=16):
+        self.service = service
+        self._jobs = queue.Queue(maxsize=max_queued)
+        self._runners = [
+            threading.Thread(target=self._run_jobs, name=f"generation-job-{index}", daemon=True)
+            for index in range(max_concurrent)
+        ]
+        for runner in self._runners:
+            runner.start()
+
+    def queued(self):
+        return self._jobs.qsize()
+
+    def submit(self, request, path):
+        future = Future()
+        try:
+            self._jobs.put_nowait((request, path, future))
+        except queue.Full:
+            raise QueueFullError("Too many generation jobs are waiting, try again later") from None
+        return future
+
+    def _run_jobs(self):
+        while True:
+            request, path, future = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.service.run(request, path))
+            except Exception as error:
+                future.set_exception(error)
+
+
+class ChunkedResponse:
+    """
+    Binary file object sending what is written to it as the chunks of an HTTP response.
+
+    The status line and headers go out with the first chunk, so a job that
+    fails before writing anything can still be answered with an error.
+    """
+
+    closed = False
+
+    def __init__(self, handler, mime, file_name, block_size=64 * 1024):
+        self.handler = handler
+        self.mime = mime
+        self.file_name = file_name
+        self.block_size = block_size
+        self.started = False
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.block_size:
+            self._send_chunk()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def _send_chunk(self):
+        if not self.started:
+            self.handler.send_response(200)
+            self.handler.send_header("Content-Type", self.mime)
+            self.handler.send_header("Transfer-Encoding", "chunked")
+            self.handler.send_header("Content-Disposition", f'attachment; filename="{self.file_name}"')
+            self.handler.end_headers()
+            self.started = True
+        if self._buffer:
+            self.handler.wfile.write(b"%X\r\n%s\r\n" % (len(self._buffer), self._buffer))
+            self._buffer.clear()
+
+    def finish(self):
+        """Send what is left and the last, empty chunk."""
+        self._send_chunk()
+        self.handler.wfile.write(b"0\r\n\r\n")
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP front end of the job queue.
+
+    - ``GET /health``: service status and number of waiting jobs.
+    - ``GET /models``: the models that can be requested, with their manifest details.
+    - ``GET /metrics``: latency histograms of the request stages, in the Prometheus text format.
+    - ``POST /generate``: JSON request (see ``validate_request``), answered with the file
+      streamed in chunks (chunked transfer encoding) while it is generated. A job failing
+      midway ends the connection without the last chunk, so clients see a truncated download.
+    """
+
+    # Chunked transfer encoding needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+    # Set by make_server
+    job_queue = None
+    block_size = 64 * 1024
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "queued_jobs": self.job_queue.queued()})
+        elif self.path == "/models":
+            self._send_json(200, {
+                name: {key: value for key, value in entry.items() if key != "path"}
+                for name, entry in get_registry().models().items()
+            })
+        elif self.path == "/metrics":
+            payload = get_metrics().render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            # The body is left unread, so the connection cannot take another request
+            self.close_connection = True
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = validate_request(json.loads(self.rfile.read(length) or b"{}"))
+        except (ValueError, AttributeError) as error:
+            self._send_json(400, {"error": str(error)})
+            return
+
+        file_format = EXPORT_FORMATS[request["format"]]
+        # The job's runner writes the export straight into the response, see ChunkedResponse
+        response = ChunkedResponse(
+            self, file_format["mime"], f"synthetic_data.{file_format['extension']}", self.block_size
+        )
+        try:
+            self.job_queue.submit(request, response).result()
+        except QueueFullError as error:
+            self._send_json(503, {"error": str(error)}, headers={"Retry-After": "5"})
+            return
+        except Exception as error:
+            if response.started:
+                self.close_connection = True
+            else:
+                self._send_json(500, {"error": f"Generation failed: {error}"})
+            return
+        response.finish()
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def make_server(service, host=None, port=None, max_concurrent=None, max_queued=None):
+    settings = CONFIG["service"]
+    job_queue = JobQueue(
+        service,
+        max_concurrent=max_concurrent or settings["max_concurrent_jobs"],
+        max_queued=max_queued or settings["max_queued_jobs"],
+    )
+    handler = type("Handler", (GenerationRequestHandler,), {"job_queue": job_queue})
+    return ThreadingHTTPServer((host or settings["host"], port or settings["port"]), handler)
@@ -0,0 +1,366 @@
+"""
+Timed spans of the generation path, written as JSON lines and counted in latency histograms.
+
+A request is traced as a tree of spans: ``trace`` opens the root with the
+model and bias column the histograms are split by, ``span`` every stage inside
+it (model load, context building, sampling, export, plot...). A span records
+its duration, the part of it not spent in child spans, the rows it handled,
+rows/s, the resident memory of its process at its end and how much that grew
+during the span, and the peak resident memory of the process so far (a
+lifetime peak, not the span's own). Finished spans are counted in this
+process' histograms, which the service serves at ``GET /metrics`` and the app
+shows in its admin sidebar (``?admin=1``), and appended to
+``CONFIG["tracing"]["path"]``, one JSON object per line from every process
+(the sampling workers included). A process keeps its spans until their trace
+ends and appends them at once, so the processes take turns through the
+file's lock once per request or chunk rather than once per span.
+
+    with trace("request", model="single", bias_column="Sex"):
+        with span("create_context") as stage:
+            context = create_context(...)
+            stage.rows = len(context)
+
+    python webapp/tracing.py summary                  # latency percentiles per stage, model and bias
+    python webapp/tracing.py summary -o metrics.json
+"""
+import argparse
+import bisect
+import contextlib
+import contextvars
+import datetime
+import json
+import multiprocessing.util
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+
+from config import CONFIG
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The innermost open span of the running thread or task
+_current = contextvars.ContextVar("tracing_span", default=None)
+_write_lock = threading.Lock()
+
+
+class Span:
+    """
+    One timed stage. Set ``rows`` (and any attribute) before it ends.
+
+    Spans take the model and bias labels of their parent, so every stage of a
+    request is counted under the request's model and bias column.
+    """
+
+    def __init__(self, name, parent=None, labels=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.labels = dict(parent.labels) if parent is not None else {"model": None, "bias": "none"}
+        self.labels.update(labels or {})
+        self.attributes = attributes
+        self.rows = None
+        self.child_seconds = 0.0
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._start_rss = _resident_mb()
+
+    def finish(self, seconds=None, error=None):
+        """Record the span, ``seconds`` overrides the time since it was opened."""
+        seconds = time.perf_counter() - self._start if seconds is None else seconds
+        if self.parent is not None:
+            self.parent.child_seconds += seconds
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "name": self.name,
+            **self.labels,
+            "started_at": datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec="milliseconds"),
+            "seconds": round(seconds, 6),
+            "self_seconds": round(max(0.0, seconds - self.child_seconds), 6),
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / seconds, 1) if self.rows and seconds > 0 else None,
+            **memory_mb(self._start_rss),
+            "pid": os.getpid(),
+            "error": error,
+            **self.attributes,
+        }
+        record_span(record)
+        return record
+
+
+def _resident_mb():
+    # model_loading imports this module
+    from model_loading import resident_memory_mb
+
+    return resident_memory_mb()
+
+
+def memory_mb(start_rss=None):
+    """
+    Resident memory of this process, its growth since ``start_rss`` and the process' lifetime peak.
+
+    Concurrent spans of one process share its memory, so the growth of a
+    span includes what the others allocated meanwhile.
+    """
+    rss = _resident_mb()
+    # ru_maxrss is in KB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "rss_mb": round(rss, 1) if rss is not None else None,
+        "rss_delta_mb": round(rss - start_rss, 1) if rss is not None and start_rss is not None else None,
+        "process_peak_rss_mb": round(peak, 1),
+    }
+
+
+@contextlib.contextmanager
+def _opened(current):
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as error:
+        current.finish(error=f"{type(error).__name__}: {error}")
+        raise
+    else:
+        current.finish()
+    finally:
+        _current.reset(token)
+
+
+def span(name, **attributes):
+    """Time the block as a stage of the current trace (or as a trace of its own)."""
+    return _opened(Span(name, _current.get(), **attributes))
+
+
+def trace(name, model=None, bias_column=None, **attributes):
+    """Time a request, starting a new trace labelled with its model and bias column."""
+    return _opened(Span(name, labels={"model": model, "bias": bias_column or "none"}, **attributes))
+
+
+def traced_frames(frames, name, **attributes):
+    """
+    Pass DataFrame chunks through, timing only the work of producing them.
+
+    Chunks are usually sampled while a consumer (e.g. the export) pulls them,
+    so the span becomes a child of the consumer's span, which then counts the
+    sampling as child time rather than as its own.
+    """
+    creator = _current.get()
+
+    def iterate():
+        iterator = iter(frames)
+        current = None
+        seconds = 0.0
+        rows = 0
+        try:
+            while True:
+                if current is None:
+                    current = Span(name, _current.get() or creator, **attributes)
+                token = _current.set(current)
+                start = time.perf_counter()
+                try:
+                    frame = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                    _current.reset(token)
+                rows += len(frame)
+                yield frame
+        finally:
+            if current is not None:
+                current.rows = rows
+                current.finish(seconds)
+
+    return iterate()
+
+
+class Metrics:
+    """Latency histograms and row counts per span name, model and bias column."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record):
+        key = (record["name"], record.get("model") or "", record.get("bias") or "none")
+        with self._lock:
+            series = self._series.setdefault(
+                key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0, "rows": 0, "errors": 0}
+            )
+            series["counts"][bisect.bisect_left(self.buckets, record["seconds"])] += 1
+            series["sum"] += record["seconds"]
+            series["count"] += 1
+            series["rows"] += record.get("rows") or 0
+            series["errors"] += record.get("error") is not None
+
+    def snapshot(self):
+        """One row per span name, model and bias, with percentiles estimated from the buckets."""
+        with self._lock:
+            series = {key: {**value, "counts": list(value["counts"])} for key, value in self._series.items()}
+        rows = []
+        for (name, model, bias), value in sorted(series.items()):
+            rows.append({
+                "span": name,
+                "model": model,
+                "bias": bias,
+                "count": value["count"],
+                "errors": value["errors"],
+                "mean_seconds": value["sum"] / value["count"],
+                "p50_seconds": self._quantile(value["counts"], 0.5),
+                "p95_seconds": self._quantile(value["counts"], 0.95),
+                "rows_per_second": value["rows"] / value["sum"] if value["rows"] and value["sum"] else None,
+            })
+        return rows
+
+    def _quantile(self, counts, quantile):
+        # Upper bound of the bucket holding the quantile, inf past the last bucket
+        target = quantile * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def render_prometheus(self):
+        """The histograms in the Prometheus text format."""
+        with self._lock:
+            series = {key: {**value, "counts": list(value["counts"])} for key, value in self._series.items()}
+        lines = [
+            "# HELP generation_span_seconds Duration of the stages of the generation path.",
+            "# TYPE generation_span_seconds histogram",
+        ]
+        for (name, model, bias), value in sorted(series.items()):
+            labels = f'span="{name}",model="{model}",bias="{bias}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], value["counts"]):
+                cumulative += count
+                lines.append(f'generation_span_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"generation_span_seconds_sum{{{labels}}} {value['sum']:.6f}")
+            lines.append(f"generation_span_seconds_count{{{labels}}} {value['count']}")
+        lines += ["# HELP generation_span_rows_total Rows handled by the stages.", "# TYPE generation_span_rows_total counter"]
+        for (name, model, bias), value in sorted(series.items()):
+            lines.append(f'generation_span_rows_total{{span="{name}",model="{model}",bias="{bias}"}} {value["rows"]}')
+        lines += ["# HELP generation_span_errors_total Stages that raised.", "# TYPE generation_span_errors_total counter"]
+        for (name, model, bias), value in sorted(series.items()):
+            lines.append(f'generation_span_errors_total{{span="{name}",model="{model}",bias="{bias}"}} {value["errors"]}')
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics(CONFIG["tracing"]["buckets_seconds"])
+# Most recent spans of this process, for the admin sidebar
+_recent = []
+# Lines of the finished spans not yet in the trace file
+_pending = []
+
+
+def get_metrics():
+    return _metrics
+
+
+def recent_spans():
+    with _write_lock:
+        return list(_recent)
+
+
+def record_span(record):
+    """Count a finished span, it goes to the trace file with the rest of its trace."""
+    settings = CONFIG["tracing"]
+    if not settings["enabled"]:
+        return
+    _metrics.observe(record)
+    with _write_lock:
+        _recent.append(record)
+        del _recent[:-settings["recent_spans"]]
+        _pending.append(json.dumps(record, default=str) + "\n")
+        due = record["parent_id"] is None or len(_pending) >= settings["flush_spans"]
+    if due:
+        flush()
+
+
+def flush():
+    """Append the spans this process still holds to the trace file."""
+    with _write_lock:
+        lines = _pending[:]
+        del _pending[:]
+    if not lines:
+        return
+    path = CONFIG["tracing"]["path"]
+    try:
+        # Processes sharing the file take turns through its lock file, for the rotation and the append
+        with open(f"{path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if os.path.exists(path) and os.path.getsize(path) > CONFIG["tracing"]["max_mb"] * 2 ** 20:
+                # One previous file is kept
+                os.replace(path, f"{path}.1")
+            with open(path, "a", encoding="utf-8") as trace_file:
+                trace_file.write("".join(lines))
+    except OSError:
+        # Tracing never fails a request
+        pass
+
+
+# Also run when a sampling worker exits, where atexit handlers are not
+multiprocessing.util.Finalize(None, flush, exitpriority=10)
+
+
+def read_spans(path):
+    spans = []
+    with open(path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            line = line.strip()
+            if line:
+                spans.append(json.loads(line))
+    return spans
+
+
+def summarize(spans):
+    """Latency percentiles, rows/s and memory growth per span name, model and bias column."""
+    import pandas as pd
+
+    frame = pd.DataFrame(spans)
+    if frame.empty:
+        return frame
+    frame["model"] = frame["model"].fillna("")
+    grouped = frame.groupby(["name", "model", "bias"])
+    summary = grouped["seconds"].describe(percentiles=[0.5, 0.95])[["count", "mean", "50%", "95%", "max"]]
+    summary.columns = ["count", "mean_seconds", "p50_seconds", "p95_seconds", "max_seconds"]
+    summary["count"] = summary["count"].astype(int)
+    summary["self_seconds"] = grouped["self_seconds"].mean()
+    summary["rows_per_second"] = grouped["rows"].sum(min_count=1) / grouped["seconds"].sum()
+    summary["max_rss_delta_mb"] = grouped["rss_delta_mb"].max()
+    summary["process_peak_rss_mb"] = grouped["process_peak_rss_mb"].max()
+    summary["errors"] = grouped["error"].count()
+    return summary.reset_index().sort_values("mean_seconds", ascending=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary = commands.add_parser("summary", help="Aggregate the trace file into latency percentiles")
+    summary.add_argument("--traces", default=CONFIG["tracing"]["path"])
+    summary.add_argument("-o", "--output", help="Also write the summary as JSON")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.traces):
+        print(f"error: no trace file at {args.traces}", file=sys.stderr)
+        return 2
+    table = summarize(read_spans(args.traces))
+    print(table.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    if args.output:
+        table.to_json(args.output, orient="records", indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())